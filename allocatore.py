@@ -0,0 +1,160 @@
+import numpy as np
+
+# ALLOCAZIONE DELLA POTENZA
+# Water-filling vettoriale per Server.distribuisci_potenza: le colonnine attive vengono servite in ordine di
+# priorità (SoC più basso prima) fino a esaurire la potenza della stazione, poi un secondo passaggio rabbocca
+# fino alla richiesta piena. Stessa politica del ciclo greedy originale, arrotondamenti compresi.
+
+FATTORI_MODALITA = {"Eco": 0.75, "Standard": 1.0, "Boost": 1.2}
+
+
+def arrotonda(x, cifre=1):
+    # np.round scala, arrotonda e riscala: sui casi vicini a ...5 può divergere da round() di Python,
+    # che è quello usato dal resto della simulazione. Quei pochi casi si ricalcolano uno per uno.
+    x = np.asarray(x, dtype=float)
+    y = np.round(x, cifre)
+    scala = x * 10 ** cifre
+    dubbi = np.flatnonzero(np.abs(scala - np.floor(scala) - 0.5) < 1e-6)
+    for i in dubbi:
+        y[i] = round(float(x[i]), cifre)
+    return y
+
+
+def richieste_regolate(richiesta, fattore_modalita, limite_veicolo, max_potenza, riduzione_agente):
+    # Richiesta del veicolo scalata per modalità, limitata da veicolo e colonnina, ridotta dall'agente
+    req = np.asarray(richiesta, dtype=float) * fattore_modalita
+    req = np.minimum(req, limite_veicolo)
+    req = np.minimum(req, max_potenza)
+    req = req * (1 - np.asarray(riduzione_agente, dtype=float))
+    return arrotonda(req)
+
+
+def _riempi_sequenziale(richieste, restante, min_attiva):
+    # Primo passaggio scalare, usato dal punto di saturazione in poi. Appena il restante scende sotto la
+    # soglia minima nessun'altra colonnina può ricevere potenza: il resto della coda va a riposo.
+    out = np.zeros(len(richieste))
+    riposo = np.ones(len(richieste), dtype=bool)
+    for i, richi in enumerate(richieste.tolist()):
+        if restante <= 0 or restante < min_attiva:
+            break
+        asseg = min(richi, restante)
+        if asseg >= min_attiva:
+            riposo[i] = False
+            out[i] = round(max(0.0, asseg), 1)
+            restante -= out[i]
+    return out, riposo, restante
+
+
+class Allocatore:
+    # Mantiene l'ordine di priorità tra un ciclo e l'altro: se cambia la chiave di poche colonnine si
+    # riposizionano solo quelle (ricerca binaria + inserimento), altrimenti si riordina tutto.
+    def __init__(self, soglia_riordino=0.25):
+        self.soglia_riordino = soglia_riordino
+        self._ids = np.empty(0, dtype=np.int64)
+        self._chiavi = np.empty(0)
+        self.riordini_completi = 0
+        self.riordini_incrementali = 0
+
+    def ordine_priorita(self, ids, chiavi):
+        # Permutazione che ordina per chiave crescente, a parità di chiave per posizione (come sorted())
+        ids = np.asarray(ids, dtype=np.int64)
+        chiavi = np.asarray(chiavi, dtype=float)
+        n = len(ids)
+        ordine = self._ordine_incrementale(ids, chiavi) if len(self._ids) and n else None
+        if ordine is None:
+            ordine = np.lexsort((np.arange(n), chiavi))
+            self.riordini_completi += 1
+        else:
+            self.riordini_incrementali += 1
+        self._ids = ids[ordine]
+        self._chiavi = chiavi[ordine]
+        return ordine
+
+    def _ordine_incrementale(self, ids, chiavi):
+        n = len(ids)
+        per_id = np.argsort(ids)
+        k = np.minimum(np.searchsorted(ids[per_id], self._ids), n - 1)
+        presenti = ids[per_id][k] == self._ids
+        indici = per_id[k[presenti]]
+        # Colonnine ancora attive con la stessa chiave: il loro ordine relativo del ciclo scorso resta valido
+        tenuti = indici[chiavi[indici] == self._chiavi[presenti]]
+        cambiati = np.setdiff1d(np.arange(n), tenuti, assume_unique=True)
+        if len(cambiati) > self.soglia_riordino * n:
+            return None
+
+        kt = chiavi[tenuti]
+        if len(tenuti) > 1:
+            crescente = (kt[1:] > kt[:-1]) | ((kt[1:] == kt[:-1]) & (tenuti[1:] > tenuti[:-1]))
+            if not crescente.all():
+                return None
+        if not len(cambiati):
+            return tenuti
+
+        cambiati = cambiati[np.lexsort((cambiati, chiavi[cambiati]))]
+        kc = chiavi[cambiati]
+        inizio = np.searchsorted(kt, kc, side="left")
+        fine = np.searchsorted(kt, kc, side="right")
+        posizioni = inizio.copy()
+        for i in np.flatnonzero(fine > inizio):
+            # Chiave già presente: a parità di chiave vale la posizione nella lista
+            posizioni[i] += np.searchsorted(tenuti[inizio[i]:fine[i]], cambiati[i])
+        return np.insert(tenuti, posizioni, cambiati)
+
+    def alloca(self, ids, richieste, chiavi, calde, potenza_disponibile, min_attiva, riduzione_calde, max_potenza):
+        # Restituisce la potenza per colonnina (allineata agli ingressi), chi è rimasto a riposo nel primo
+        # passaggio e se le richieste stavano tutte nel budget
+        n = len(ids)
+        potenza = np.zeros(n)
+        riposo = np.zeros(n, dtype=bool)
+        if not n:
+            return {"potenza": potenza, "riposo": riposo, "sotto_budget": True}
+
+        ordine = self.ordine_priorita(ids, chiavi)
+        richi = np.asarray(richieste, dtype=float)[ordine]
+        calde = np.asarray(calde, dtype=bool)[ordine]
+        ridotte = np.where(calde, richi * (1 - riduzione_calde), richi)
+
+        totale = np.add.accumulate(richi)[-1]
+        sotto_budget = bool(totale <= potenza_disponibile)
+        if sotto_budget:
+            asseg = arrotonda(np.maximum(0.0, ridotte))
+        else:
+            asseg, riposo_ord, restante = self._primo_passaggio(ridotte, potenza_disponibile, min_attiva)
+            if restante > 0:
+                asseg = self._rabbocco(asseg, richi, restante)
+            riposo[ordine] = riposo_ord
+
+        potenza[ordine] = arrotonda(np.maximum(0.0, np.minimum(asseg, max_potenza)))
+        return {"potenza": potenza, "riposo": riposo, "sotto_budget": sotto_budget}
+
+    def _primo_passaggio(self, ridotte, potenza_disponibile, min_attiva):
+        # Finché la potenza basta ognuno riceve la propria richiesta: il restante prima di ogni colonnina è
+        # una sottrazione cumulata (stessa sequenza di operazioni del ciclo scalare)
+        piene = np.where(ridotte >= min_attiva, arrotonda(np.maximum(0.0, ridotte)), 0.0)
+        restanti = np.subtract.accumulate(np.concatenate(([potenza_disponibile], piene)))[:-1]
+        saturi = np.flatnonzero((ridotte > restanti) | (restanti <= 0))
+
+        asseg = piene.copy()
+        riposo = ridotte < min_attiva
+        if not len(saturi):
+            return asseg, riposo, restanti[-1] - piene[-1]
+
+        k = saturi[0]
+        coda, riposo_coda, restante = _riempi_sequenziale(ridotte[k:], restanti[k], min_attiva)
+        asseg[k:] = coda
+        riposo[k:] = riposo_coda
+        return asseg, riposo, restante
+
+    def _rabbocco(self, asseg, richi, restante):
+        # Secondo passaggio: chi ha ricevuto meno della richiesta piena sale fino a esaurire il restante
+        mancanti = np.maximum(0.0, richi - asseg)
+        restanti = np.subtract.accumulate(np.concatenate(([restante], mancanti)))[:-1]
+        ultimi = np.flatnonzero((mancanti > 0) & (mancanti >= restanti))
+        fine = ultimi[0] if len(ultimi) else len(asseg)
+
+        out = asseg.copy()
+        pieni = np.flatnonzero(mancanti[:fine] > 0)
+        out[pieni] = arrotonda(asseg[pieni] + mancanti[pieni])
+        if fine < len(asseg):
+            out[fine] = round(float(asseg[fine] + restanti[fine]), 1)
+        return out
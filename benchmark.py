@@ -0,0 +1,319 @@
+import argparse
+import gc
+import json
+import logging
+import platform
+import statistics
+import subprocess
+import sys
+import time
+import tracemalloc
+
+import numpy as np
+
+import rifornimento
+from rifornimento import (
+    aggiorna_info_globali,
+    crea_stazione,
+    esegui_ciclo,
+    gestisci_arrivi,
+    leggi_colonnine,
+    nuove_statistiche,
+)
+
+# BENCHMARK DEI PERCORSI CALDI
+# Ogni misura è il costo di un ciclo per l'intera flotta (n colonnine), con seed fisso e senza attese.
+# I risultati vanno in JSON; con --baseline si confrontano mediana del tempo e picco di memoria (tracemalloc).
+
+DIMENSIONI = (4, 40, 400, 4000, 10000)
+CICLI_RISCALDAMENTO = 5
+
+# Il nucleo di controllo deve caricarsi solo con NumPy: tempo d'import massimo e moduli pesanti vietati
+BUDGET_IMPORT_S = 0.4
+MODULI_PESANTI = ("matplotlib", "scipy", "paho")
+
+
+def prepara_stazione(n, seed, flotta=False):
+    # Stazione già a regime: qualche ciclo per avere colonnine occupate, agenti con belief aggiornate
+    server, rng = crea_stazione(n, seed, flotta=flotta)
+    stats = nuove_statistiche(storico=64)
+    anomalie = 0
+    for ciclo in range(1, CICLI_RISCALDAMENTO + 1):
+        anomalie = esegui_ciclo(server, rng, stats, ciclo, anomalie)
+    return {"server": server, "rng": rng, "stats": stats, "anomalie": anomalie, "ciclo": CICLI_RISCALDAMENTO}
+
+
+def _letture_correnti(stazione):
+    server = stazione["server"]
+    stazione["ciclo"] += 1
+    server.cache.nuovo_ciclo(stazione["ciclo"])
+    gestisci_arrivi(server, stazione["rng"])
+    parametri = leggi_colonnine(server)
+    aggiorna_info_globali(server, parametri)
+    return parametri
+
+
+def _info(server):
+    return {"quante_altre_calda": server.quante_colonnine_calide, "media_voti_centrali": server.media_voti_centrali}
+
+
+def bench_leggi_parametri(stazione):
+    colonnine = list(stazione["server"].registro)
+    return lambda: [col.leggi_parametri() for col in colonnine]
+
+
+def bench_calcola_efe(stazione):
+    server = stazione["server"]
+    occupate = [(col, p) for col, p in zip(server.registro, _letture_correnti(stazione)) if p["stato"] == "OCCUPATA"]
+    lavori = [(col.agente, col.agente.genera_politiche(),
+               {"temperatura": p["temperatura"], "soc": p["soc"], "potenza_effettiva": 0}) for col, p in occupate]
+    return lambda: [agente.calcola_efe_politiche(politiche, s) for agente, politiche, s in lavori]
+
+
+def bench_decide(stazione):
+    server = stazione["server"]
+    occupate = [(col, p) for col, p in zip(server.registro, _letture_correnti(stazione)) if p["stato"] == "OCCUPATA"]
+    info = _info(server)
+    return lambda: [col.agente.decide(info, p) for col, p in occupate]
+
+
+def bench_decide_cache(stazione):
+    # Stesse decisioni con la cache EFE condivisa, riscaldata da un primo giro sugli stessi stati
+    from cache_efe import CacheEFE
+    rifornimento.usa_cache_efe(stazione["server"], CacheEFE())
+    esegui = bench_decide(stazione)
+    esegui()
+    return esegui
+
+
+def bench_decide_pool(stazione):
+    # Fase decisioni di prepara_richieste sul pool di thread (default di ThreadPoolExecutor)
+    server = stazione["server"]
+    server.usa_pool_decisioni()
+    occupate = [(col, p) for col, p in zip(server.registro, _letture_correnti(stazione)) if p["stato"] == "OCCUPATA"]
+
+    def esegui():
+        server.decidi(occupate)
+
+    # misura() chiude il pool a fine misura, anche se una ripetizione fallisce
+    esegui.chiudi = server.chiudi_pool_decisioni
+    return esegui
+
+
+def bench_distribuisci_potenza(stazione):
+    # Solo allocazione: le decisioni sono già in cache, il costo degli agenti è misurato da bench_decide
+    server = stazione["server"]
+    parametri = _letture_correnti(stazione)
+    info = _info(server)
+    for col, p in zip(server.registro, parametri):
+        if p["stato"] == "OCCUPATA":
+            server.cache.registra_decisione(col, col.agente.decide(info, p))
+    copie = []
+
+    def esegui():
+        server.distribuisci_potenza(copie.pop())
+
+    def prima():
+        copie.append([p.copy() for p in parametri])
+
+    esegui.prima = prima
+    return esegui
+
+
+def bench_ciclo(stazione):
+    def esegui():
+        stazione["ciclo"] += 1
+        stazione["anomalie"] = esegui_ciclo(stazione["server"], stazione["rng"], stazione["stats"],
+                                            stazione["ciclo"], stazione["anomalie"])
+    return esegui
+
+
+def bench_leggi_flotta(stazione):
+    # Letture di tutta la flotta struct-of-arrays in un solo blocco (BancoFlotta), da confrontare con leggi_parametri
+    server = stazione["server"]
+    colonnine = list(server.registro)
+    return lambda: server.sensori.leggi(colonnine)
+
+
+def bench_ciclo_strumentato(stazione):
+    # Stesso ciclo con le metriche attive: la differenza con "ciclo" è il costo dell'instrumentazione
+    from metriche import Metriche
+    stazione["server"].metriche = Metriche()
+    return bench_ciclo(stazione)
+
+
+BENCHMARK = {
+    "leggi_parametri": bench_leggi_parametri,
+    "calcola_efe": bench_calcola_efe,
+    "decide": bench_decide,
+    "decide_cache": bench_decide_cache,
+    "decide_pool": bench_decide_pool,
+    "distribuisci_potenza": bench_distribuisci_potenza,
+    "ciclo": bench_ciclo,
+    "ciclo_strumentato": bench_ciclo_strumentato,
+    "leggi_flotta": bench_leggi_flotta,
+    "ciclo_flotta": bench_ciclo,
+}
+# Benchmark che girano sulla stazione con il backend struct-of-arrays (crea_stazione(flotta=True))
+SU_FLOTTA = {"leggi_flotta", "ciclo_flotta"}
+
+
+def ripetizioni_per(tempo_stimato, budget_s):
+    return int(np.clip(budget_s / max(tempo_stimato, 1e-9), 3, 200))
+
+
+def misura(nome, n, seed=42, budget_s=1.0):
+    funzione = BENCHMARK[nome](prepara_stazione(n, seed, flotta=nome in SU_FLOTTA))
+    try:
+        return _misura(funzione, n, budget_s)
+    finally:
+        chiudi = getattr(funzione, "chiudi", None)
+        if chiudi is not None:
+            chiudi()
+
+
+def _misura(funzione, n, budget_s):
+    # funzione.prima(), se c'è, prepara ogni ripetizione fuori dal tempo misurato
+    prima = getattr(funzione, "prima", None)
+
+    def una_volta():
+        if prima is not None:
+            prima()
+        inizio = time.perf_counter()
+        funzione()
+        return time.perf_counter() - inizio
+
+    stima = una_volta()
+    # Raccolte del GC durante le ripetizioni: misura indiretta degli oggetti allocati per ciclo
+    raccolte = sum(s["collections"] for s in gc.get_stats())
+    tempi = [una_volta() for _ in range(ripetizioni_per(stima, budget_s))]
+    raccolte = sum(s["collections"] for s in gc.get_stats()) - raccolte
+
+    # Memoria in una ripetizione separata: tracemalloc rallenta e falserebbe i tempi
+    if prima is not None:
+        prima()
+    tracemalloc.start()
+    funzione()
+    _, picco = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return {
+        "mediana_s": statistics.median(tempi),
+        "min_s": min(tempi),
+        "p95_s": float(np.percentile(tempi, 95)),
+        "per_colonnina_us": statistics.median(tempi) / n * 1e6,
+        "picco_mem_kb": picco / 1024,
+        "gc_per_ripetizione": raccolte / len(tempi),
+        "ripetizioni": len(tempi),
+    }
+
+
+def misura_import(modulo="rifornimento", ripetizioni=5):
+    # Interprete nuovo per ogni misura: la cache dei moduli del processo corrente falserebbe il tempo
+    codice = (
+        "import json, resource, sys, time\n"
+        "inizio = time.perf_counter()\n"
+        f"import {modulo}\n"
+        "durata = time.perf_counter() - inizio\n"
+        f"pesanti = [m for m in {MODULI_PESANTI!r} if m in sys.modules]\n"
+        "print(json.dumps({'tempo_s': durata, 'pesanti': pesanti,\n"
+        "                  'rss_kb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss}))\n"
+    )
+    misure = []
+    for _ in range(ripetizioni):
+        uscita = subprocess.run([sys.executable, "-c", codice], capture_output=True, text=True, check=True,
+                                cwd=sys.path[0] or None)
+        misure.append(json.loads(uscita.stdout))
+    return {
+        "modulo": modulo,
+        "tempo_s": min(m["tempo_s"] for m in misure),
+        "rss_kb": min(m["rss_kb"] for m in misure),
+        "pesanti": sorted({p for m in misure for p in m["pesanti"]}),
+    }
+
+
+def verifica_import(misura, budget_s=BUDGET_IMPORT_S):
+    problemi = []
+    if misura["tempo_s"] > budget_s:
+        problemi.append(f"import {misura['modulo']}: {misura['tempo_s'] * 1e3:.0f} ms oltre il budget di "
+                        f"{budget_s * 1e3:.0f} ms")
+    if misura["pesanti"]:
+        problemi.append(f"import {misura['modulo']}: carica {', '.join(misura['pesanti'])}")
+    return problemi
+
+
+def esegui_benchmark(nomi=None, dimensioni=DIMENSIONI, seed=42, budget_s=1.0):
+    risultati = {}
+    for nome in nomi or BENCHMARK:
+        risultati[nome] = {}
+        for n in dimensioni:
+            risultati[nome][str(n)] = m = misura(nome, n, seed, budget_s)
+            print(f"  {nome:<22} n={n:<6} {m['mediana_s'] * 1e3:10.3f} ms  "
+                  f"{m['per_colonnina_us']:9.2f} µs/col  {m['picco_mem_kb']:10.1f} KiB  "
+                  f"{m['gc_per_ripetizione']:6.1f} gc", file=sys.stderr)
+    return {
+        "versione": 1,
+        "data": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "macchina": platform.machine(),
+        "seed": seed,
+        "risultati": risultati,
+    }
+
+
+def confronta(attuale, baseline, soglia_tempo=1.2, soglia_memoria=1.2):
+    # Regressione: mediana o picco di memoria oltre soglia × baseline, sulle stesse (benchmark, n)
+    regressioni = []
+    for nome, per_n in attuale["risultati"].items():
+        for n, m in per_n.items():
+            rif = baseline.get("risultati", {}).get(nome, {}).get(n)
+            if rif is None:
+                continue
+            rapporto_t = m["mediana_s"] / rif["mediana_s"] if rif["mediana_s"] else 1.0
+            rapporto_m = m["picco_mem_kb"] / rif["picco_mem_kb"] if rif["picco_mem_kb"] else 1.0
+            m["rapporto_tempo"] = rapporto_t
+            m["rapporto_memoria"] = rapporto_m
+            if rapporto_t > soglia_tempo:
+                regressioni.append(f"{nome} n={n}: tempo ×{rapporto_t:.2f}")
+            if rapporto_m > soglia_memoria:
+                regressioni.append(f"{nome} n={n}: memoria ×{rapporto_m:.2f}")
+    if "import" in attuale and "import" in baseline:
+        rapporto = attuale["import"]["tempo_s"] / baseline["import"]["tempo_s"]
+        if rapporto > soglia_tempo:
+            regressioni.append(f"import {attuale['import']['modulo']}: tempo ×{rapporto:.2f}")
+    return regressioni
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark dei percorsi caldi della stazione")
+    parser.add_argument("--solo", nargs="*", choices=list(BENCHMARK), default=None)
+    parser.add_argument("--dimensioni", type=int, nargs="*", default=list(DIMENSIONI))
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--budget", type=float, default=1.0, help="secondi di misura per (benchmark, n)")
+    parser.add_argument("--out", default="benchmark.json")
+    parser.add_argument("--baseline", default=None, help="JSON di un'esecuzione precedente da confrontare")
+    parser.add_argument("--soglia-tempo", type=float, default=1.2)
+    parser.add_argument("--soglia-memoria", type=float, default=1.2)
+    parser.add_argument("--budget-import", type=float, default=BUDGET_IMPORT_S, help="secondi per importare il nucleo")
+    args = parser.parse_args()
+
+    logging.getLogger(rifornimento.log.name).setLevel(logging.ERROR)
+    risultato = esegui_benchmark(args.solo, args.dimensioni, args.seed, args.budget)
+    risultato["import"] = misura_import()
+    print(f"  import rifornimento     {risultato['import']['tempo_s'] * 1e3:10.1f} ms  "
+          f"{risultato['import']['rss_kb'] / 1024:9.1f} MiB RSS", file=sys.stderr)
+
+    regressioni = verifica_import(risultato["import"], args.budget_import)
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressioni += confronta(risultato, json.load(f), args.soglia_tempo, args.soglia_memoria)
+        risultato["baseline"] = args.baseline
+    risultato["regressioni"] = regressioni
+
+    with open(args.out, "w") as f:
+        json.dump(risultato, f, indent=1)
+
+    for r in regressioni:
+        print(f"REGRESSIONE: {r}", file=sys.stderr)
+    sys.exit(1 if regressioni else 0)
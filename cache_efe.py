@@ -0,0 +1,129 @@
+import math
+from collections import OrderedDict, defaultdict
+
+import numpy as np
+
+from statistiche import Aggregato
+
+# CACHE DELL'EFE
+# Surrogato opzionale di AgenteLocale.calcola_efe_politiche: i valori EFE si memorizzano su una chiave
+# quantizzata (temperatura, SoC, potenza, belief) con eviction LRU e si condividono tra tutti gli agenti
+# le cui belief cadono nello stesso bucket. Quando aggiorna_beliefs porta l'ultimo agente fuori da un
+# bucket, le voci di quel bucket vengono invalidate. Ogni `verifica_ogni` hit si ricalcola il valore
+# esatto per stimare l'errore del surrogato.
+
+CAPACITA_PREDEFINITA = 4096
+VERIFICA_OGNI = 50
+
+# Larghezza dei bucket
+PASSI_STATO = {"temperatura": 0.5, "soc": 1.0, "potenza_effettiva": 1.0}
+PASSI_BELIEFS = {"p_fail_raff_locale": 0.005, "var_temp": 0.25}
+
+
+def _quantizza(valore, passo):
+    return math.floor(valore / passo)
+
+
+def firma_politiche(politiche):
+    return tuple((p['raff_locale'], p['downgrade'], p['rid_pot']) for p in politiche)
+
+
+class CacheEFE:
+    def __init__(self, capacita=CAPACITA_PREDEFINITA, passi_stato=None, passi_beliefs=None, verifica_ogni=VERIFICA_OGNI):
+        self.capacita = capacita
+        self.passi_stato = dict(PASSI_STATO, **(passi_stato or {}))
+        self.passi_beliefs = dict(PASSI_BELIEFS, **(passi_beliefs or {}))
+        self.verifica_ogni = verifica_ogni
+        self._voci = OrderedDict()              # chiave → EFE per politica (array in sola lettura)
+        self._per_bucket = defaultdict(set)     # bucket belief → chiavi presenti
+        self._occupanti = defaultdict(int)      # bucket belief → agenti che vi si trovano ora
+        self.hit = 0
+        self.miss = 0
+        self.evizioni = 0
+        self.invalidazioni = 0
+        # Verifiche contro il calcolo esatto: errore assoluto sull'EFE minimo e stessa politica scelta
+        self.errore = Aggregato()
+        self.verifiche = 0
+        self.concordi = 0
+
+    def __len__(self):
+        return len(self._voci)
+
+    # BUCKET DELLE BELIEF
+    def bucket_beliefs(self, beliefs):
+        return tuple(_quantizza(beliefs[k], passo) for k, passo in self.passi_beliefs.items())
+
+    def entra(self, bucket):
+        self._occupanti[bucket] += 1
+
+    def sposta(self, vecchio, nuovo):
+        self._occupanti[vecchio] -= 1
+        if self._occupanti[vecchio] <= 0:
+            del self._occupanti[vecchio]
+            self._invalida(vecchio)
+        self._occupanti[nuovo] += 1
+
+    def _invalida(self, bucket):
+        for chiave in self._per_bucket.pop(bucket, ()):
+            del self._voci[chiave]
+            self.invalidazioni += 1
+
+    # LOOKUP
+    def chiave(self, bucket, stato_attuale, firma):
+        passi = self.passi_stato
+        return (bucket,
+                _quantizza(stato_attuale['temperatura'], passi['temperatura']),
+                _quantizza(stato_attuale['soc'], passi['soc']),
+                _quantizza(stato_attuale.get('potenza_effettiva', 0), passi['potenza_effettiva']),
+                firma)
+
+    def efe(self, agente, politiche, stato_attuale):
+        chiave = self.chiave(agente.bucket_efe, stato_attuale, firma_politiche(politiche))
+        valori = self._voci.get(chiave)
+        if valori is None:
+            self.miss += 1
+            valori = agente.calcola_efe_politiche(politiche, stato_attuale)
+            valori.setflags(write=False)
+            self._inserisci(chiave, valori)
+            return valori
+
+        self._voci.move_to_end(chiave)
+        self.hit += 1
+        if self.verifica_ogni and self.hit % self.verifica_ogni == 0:
+            esatti = agente.calcola_efe_politiche(politiche, stato_attuale)
+            self.errore.aggiungi(abs(float(valori.min()) - float(esatti.min())))
+            self.verifiche += 1
+            self.concordi += int(np.argmin(valori) == np.argmin(esatti))
+        return valori
+
+    def _inserisci(self, chiave, valori):
+        self._voci[chiave] = valori
+        self._per_bucket[chiave[0]].add(chiave)
+        while len(self._voci) > self.capacita:
+            vecchia, _ = self._voci.popitem(last=False)
+            voci_bucket = self._per_bucket[vecchia[0]]
+            voci_bucket.discard(vecchia)
+            if not voci_bucket:
+                del self._per_bucket[vecchia[0]]
+            self.evizioni += 1
+
+    # RIEPILOGO
+    @property
+    def hit_rate(self):
+        richieste = self.hit + self.miss
+        return self.hit / richieste if richieste else 0.0
+
+    def riepilogo(self):
+        return {
+            "voci": len(self._voci),
+            "bucket_beliefs": len(self._occupanti),
+            "hit": self.hit,
+            "miss": self.miss,
+            "hit_rate": self.hit_rate,
+            "evizioni": self.evizioni,
+            "invalidazioni": self.invalidazioni,
+            "verifiche": self.verifiche,
+            "errore_medio": self.errore.media,
+            "errore_max": self.errore.massimo if self.errore.n else 0.0,
+            "concordanza_politica": self.concordi / self.verifiche if self.verifiche else 1.0,
+        }
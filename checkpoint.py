@@ -0,0 +1,398 @@
+import atexit
+import glob
+import json
+import logging
+import os
+import threading
+import time
+import zipfile
+
+import numpy as np
+
+from rifornimento import CONFIG, MODALITA, NOMI_VEICOLI, STATI
+
+log = logging.getLogger("rifornimento.checkpoint")
+
+# CHECKPOINT DELLA STAZIONE
+# Un checkpoint è un solo file .npz: stato delle colonnine e credenze degli agenti in colonne (una riga per
+# colonnina, in ordine di id), stato dei generatori casuali, scalari di server e corsa, statistiche e coda
+# eventi. La fotografia si prende sul thread di controllo tra un ciclo e l'altro (solo copie in array);
+# la scrittura avviene su un thread dedicato, in un file temporaneo poi rinominato con os.replace, quindi
+# sul disco c'è sempre un checkpoint completo. Alla ripartenza la stazione riprende dall'ultimo.
+
+VERSIONE = 1
+PREFISSO = "checkpoint_"
+OGNI_PREDEFINITO = 100
+CONSERVATI = 3
+
+RAFF_USATO = (None, "centrale", "locale")
+_MASCHERA_64 = (1 << 64) - 1
+
+# Attributi copiati così come sono, con il tipo della colonna
+_CAMPI_COLONNINA = (
+    ("soc_kwh", np.float64),
+    ("carica_attiva", np.bool_),
+    ("raffreddamento_attivo", np.bool_),
+    ("fail_raff_consecutivi", np.int32),
+    ("stato_raff_fallito", np.bool_),
+)
+_CAMPI_AGENTE = (
+    ("isteresi_raff_locale", np.float64),
+    ("ultima_temp_vista", np.float64),
+    ("voto_centrale_ultimo", np.float64),
+    ("campioni_estratti", np.int64),
+)
+_CAMPI_SERVER = ("quante_colonnine_calide", "media_voti_centrali", "potenza_massima", "allocazioni_riusate")
+
+
+# GENERATORI CASUALI
+def stato_rng(rng):
+    # PCG64 (default_rng): stato e incremento a 128 bit spezzati in due uint64, più l'eventuale uint32 in sospeso
+    s = rng.bit_generator.state
+    if s["bit_generator"] != "PCG64":
+        raise ValueError(f"Checkpoint: generatore {s['bit_generator']} non supportato (serve PCG64)")
+    stato, inc = s["state"]["state"], s["state"]["inc"]
+    return (stato >> 64, stato & _MASCHERA_64, inc >> 64, inc & _MASCHERA_64, s["has_uint32"], s["uinteger"])
+
+
+def imposta_rng(rng, riga):
+    # Sul generatore esistente: chi ne condivide il riferimento (sensori, pianificatore) riparte con lui
+    alto, basso, inc_alto, inc_basso, ha_uint32, uinteger = (int(x) for x in riga)
+    rng.bit_generator.state = {
+        "bit_generator": "PCG64",
+        "state": {"state": (alto << 64) | basso, "inc": (inc_alto << 64) | inc_basso},
+        "has_uint32": ha_uint32,
+        "uinteger": uinteger,
+    }
+
+
+def _righe_rng(generatori):
+    return np.array([stato_rng(g) for g in generatori], dtype=np.uint64).reshape(-1, 6)
+
+
+def _rng_sensori(server):
+    sorgente = getattr(server.sensori, "sorgente", None)
+    sorgente = getattr(sorgente, "riserva", sorgente)      # SorgenteMQTT: la parte sintetica
+    return getattr(sorgente, "rng", None)
+
+
+# FOTOGRAFIA
+def fotografa(server, rng, ciclo, counter_anomalie, stats=None, pianificatore=None):
+    colonnine = sorted(server.registro, key=lambda col: col.id)
+    agenti = [col.agente for col in colonnine]
+    stati = {s: i for i, s in enumerate(STATI)}
+    veicoli = {v: i for i, v in enumerate(NOMI_VEICOLI)}
+    modalita = {m: i for i, m in enumerate(MODALITA)}
+    raff = {r: i for i, r in enumerate(RAFF_USATO)}
+
+    dati = {
+        "colonnine/id": np.array([col.id for col in colonnine], dtype=np.int64),
+        "colonnine/stato": np.array([stati[col.stato] for col in colonnine], dtype=np.int8),
+        "colonnine/veicolo": np.array([veicoli.get(col.veicolo, -1) for col in colonnine], dtype=np.int8),
+        "colonnine/modalita": np.array([modalita[col.modalita] for col in colonnine], dtype=np.int8),
+        "colonnine/capacita": np.array([np.nan if col.capacita is None else col.capacita for col in colonnine]),
+        "colonnine/ultimo_raff_usato": np.array([raff[col.ultimo_raff_usato] for col in colonnine], dtype=np.int8),
+        "colonnine/rng": _righe_rng(col.rng for col in colonnine),
+        "agenti/rng": _righe_rng(a.rng for a in agenti),
+        "rng/stazione": _righe_rng([rng]),
+    }
+    for stato in STATI:
+        dati[f"registro/{stato}"] = np.array(server.registro.ordine(stato), dtype=np.int64)
+    for nome, tipo in _CAMPI_COLONNINA:
+        dati[f"colonnine/{nome}"] = np.array([getattr(col, nome) for col in colonnine], dtype=tipo)
+    for nome, tipo in _CAMPI_AGENTE:
+        dati[f"agenti/{nome}"] = np.array([getattr(a, nome) for a in agenti], dtype=tipo)
+    for nome in (agenti[0].beliefs if agenti else ()):
+        dati[f"beliefs/{nome}"] = np.array([a.beliefs[nome] for a in agenti], dtype=np.float64)
+
+    meta = {
+        "versione": VERSIONE,
+        "ciclo": ciclo,
+        "counter_anomalie": counter_anomalie,
+        "creato": time.time(),
+        "config": dict(CONFIG),
+        "server": {nome: getattr(server, nome) for nome in _CAMPI_SERVER},
+    }
+    rng_sensori = _rng_sensori(server)
+    if rng_sensori is not None:
+        dati["rng/sensori"] = _righe_rng([rng_sensori])
+    flotta = getattr(colonnine[0], "flotta", None) if colonnine else None
+    if flotta is not None:
+        dati["rng/flotta"] = _righe_rng([flotta.rng])
+    tick = getattr(getattr(server.sensori, "sorgente", None), "tick", None)
+    if tick is not None:
+        meta["tick_sensori"] = tick
+    if stats is not None:
+        meta["storico"] = stats.storico
+        dati.update({f"stats/{k}": v for k, v in stats.esporta_stato().items()})
+    if pianificatore is not None:
+        dati["eventi/coda"] = np.array(pianificatore.coda.in_ordine(), dtype=np.int64).reshape(-1, 3)
+        meta["pianificatore"] = {"da_traccia": pianificatore.da_traccia, "eventi_gestiti": pianificatore.eventi_gestiti,
+                                 "arrivi_persi": pianificatore.arrivi_persi, "toccate": pianificatore.toccate}
+    dati["meta"] = np.array(json.dumps(meta))
+    return dati
+
+
+# RIPRISTINO
+def ripristina(dati, server, rng, stats=None, pianificatore=None, mantieni=()):
+    # Riporta una stazione appena creata (stesse colonnine) allo stato fotografato; restituisce
+    # (ultimo ciclo eseguito, contatore delle anomalie). mantieni: chiavi di CONFIG impostate per questa
+    # corsa (es. da riga di comando) che prevalgono su quelle salvate.
+    meta = json.loads(str(dati["meta"]))
+    if meta["versione"] != VERSIONE:
+        raise ValueError(f"Checkpoint versione {meta['versione']}, attesa {VERSIONE}")
+    ids = dati["colonnine/id"].tolist()
+    colonnine = [server.registro.get(i) for i in ids]
+    if len(ids) != len(server.registro) or any(col is None for col in colonnine):
+        raise ValueError(f"Checkpoint per {len(ids)} colonnine, la stazione ne ha {len(server.registro)} con id diversi")
+
+    ripristina_config(meta["config"], mantieni)
+    for nome, valore in meta["server"].items():
+        setattr(server, nome, valore)
+
+    colonne = {nome: dati[f"colonnine/{nome}"].tolist() for nome, _ in _CAMPI_COLONNINA}
+    colonne_agenti = {nome: dati[f"agenti/{nome}"].tolist() for nome, _ in _CAMPI_AGENTE}
+    beliefs = {k[len("beliefs/"):]: v.tolist() for k, v in dati.items() if k.startswith("beliefs/")}
+    stato = dati["colonnine/stato"].tolist()
+    veicolo = dati["colonnine/veicolo"].tolist()
+    modalita = dati["colonnine/modalita"].tolist()
+    capacita = dati["colonnine/capacita"].tolist()
+    raff = dati["colonnine/ultimo_raff_usato"].tolist()
+    rng_colonnine, rng_agenti = dati["colonnine/rng"], dati["agenti/rng"]
+
+    for k, col in enumerate(colonnine):
+        # Il setter dello stato aggiorna anche l'indice del registro
+        col.stato = STATI[stato[k]]
+        col.veicolo = NOMI_VEICOLI[veicolo[k]] if veicolo[k] >= 0 else None
+        col.modalita = MODALITA[modalita[k]]
+        col.capacita = None if np.isnan(capacita[k]) else capacita[k]
+        col.ultimo_raff_usato = RAFF_USATO[raff[k]]
+        for nome, valori in colonne.items():
+            setattr(col, nome, valori[k])
+        imposta_rng(col.rng, rng_colonnine[k])
+
+        agente = col.agente
+        for nome, valori in colonne_agenti.items():
+            setattr(agente, nome, valori[k])
+        agente.beliefs.update({nome: valori[k] for nome, valori in beliefs.items()})
+        imposta_rng(agente.rng, rng_agenti[k])
+        agente.aggiorna_bucket_efe()
+
+    for stato in STATI:
+        if f"registro/{stato}" in dati:
+            server.registro.imposta_ordine(stato, dati[f"registro/{stato}"].tolist())
+
+    imposta_rng(rng, dati["rng/stazione"][0])
+    rng_sensori = _rng_sensori(server)
+    if rng_sensori is not None and "rng/sensori" in dati:
+        imposta_rng(rng_sensori, dati["rng/sensori"][0])
+    if "rng/flotta" in dati:
+        imposta_rng(colonnine[0].flotta.rng, dati["rng/flotta"][0])
+    if "tick_sensori" in meta:
+        server.sensori.sorgente.tick = meta["tick_sensori"]
+
+    if stats is not None and "storico" in meta:
+        if meta["storico"] != stats.storico:
+            raise ValueError(f"Checkpoint con storico di {meta['storico']} cicli, statistiche con {stats.storico}")
+        stats.carica_stato({k[len("stats/"):]: v for k, v in dati.items() if k.startswith("stats/")})
+
+    # La coda eventi si sostituisce per ultima: i cambi di stato qui sopra ne hanno programmati di spuri
+    if pianificatore is not None:
+        if "eventi/coda" not in dati:
+            raise ValueError("Checkpoint del passo fisso: riprenderlo senza simulazione a eventi")
+        from eventi import CodaEventi
+        pianificatore.coda = CodaEventi()
+        pianificatore.coda.programma_molti(tuple(e) for e in dati["eventi/coda"].tolist())
+        for nome, valore in meta["pianificatore"].items():
+            setattr(pianificatore, nome, valore)
+        pianificatore.ciclo = meta["ciclo"]
+        pianificatore.cambiate = {}
+    elif "eventi/coda" in dati:
+        log.warning("Checkpoint della simulazione a eventi ripreso al passo fisso: coda eventi ignorata")
+
+    return meta["ciclo"], meta["counter_anomalie"]
+
+
+def ripristina_config(salvata, mantieni=()):
+    # Ogni differenza tra la configurazione salvata e quella attuale finisce nel log
+    for chiave, valore in salvata.items():
+        attuale = CONFIG.get(chiave)
+        if attuale == valore:
+            continue
+        if chiave in mantieni:
+            log.warning("Checkpoint: %s=%r mantenuto (nel checkpoint %r)", chiave, attuale, valore)
+        else:
+            log.warning("Checkpoint: %s=%r dal checkpoint (era %r)", chiave, valore, attuale)
+            CONFIG[chiave] = valore
+
+
+# FILE
+def percorso_checkpoint(cartella, ciclo):
+    return os.path.join(cartella, f"{PREFISSO}{ciclo:010d}.npz")
+
+
+def elenca_checkpoint(cartella):
+    # Dal più recente al più vecchio; i .tmp di una scrittura interrotta non contano
+    return sorted(glob.glob(os.path.join(cartella, f"{PREFISSO}*.npz")), reverse=True)
+
+
+def scrivi(percorso, dati, comprimi=False):
+    temporaneo = percorso + ".tmp"
+    with open(temporaneo, "wb") as f:
+        (np.savez_compressed if comprimi else np.savez)(f, **dati)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(temporaneo, percorso)
+    # La rinomina è durevole solo quando lo è anche la voce nella cartella
+    _fsync_cartella(os.path.dirname(percorso) or ".")
+
+
+def _fsync_cartella(cartella):
+    if not hasattr(os, "O_DIRECTORY"):     # Windows: le cartelle non si aprono con os.open
+        return
+    fd = os.open(cartella, os.O_RDONLY | os.O_DIRECTORY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def carica(percorso):
+    with np.load(percorso, allow_pickle=False) as f:
+        return {k: f[k] for k in f.files}
+
+
+def carica_ultimo(cartella):
+    # Il più recente leggibile; (None, None) se non ce ne sono
+    for percorso in elenca_checkpoint(cartella):
+        try:
+            return percorso, carica(percorso)
+        except (OSError, ValueError, KeyError, zipfile.BadZipFile) as e:
+            log.warning("Checkpoint %s illeggibile (%s): si prova il precedente", percorso, e)
+    return None, None
+
+
+# SCRITTURA IN BACKGROUND
+class GestoreCheckpoint:
+    # Il ciclo di controllo fotografa e consegna; compressione, fsync e rinomina avvengono sul thread dedicato.
+    # Se una scrittura è ancora in corso la fotografia in attesa viene sostituita dalla più recente.
+    def __init__(self, cartella, ogni=OGNI_PREDEFINITO, conservati=CONSERVATI, comprimi=True, riprendi=True,
+                 mantieni=()):
+        self.cartella = cartella
+        self.ogni = ogni
+        self.conservati = conservati
+        self.comprimi = comprimi
+        self.riprendi = riprendi
+        self.mantieni = frozenset(mantieni)     # chiavi di CONFIG che la ripresa non sovrascrive
+        os.makedirs(cartella, exist_ok=True)
+
+        self.ultimo_ciclo = None            # ultimo ciclo fotografato
+        self.ultimo_scritto = None
+        self.fotografie = 0
+        self.scritti = 0
+        self.sostituiti = 0
+        self.errori = 0
+        self.tempo_fotografia_s = 0.0
+        self.tempo_scrittura_s = 0.0
+        self.byte = 0
+
+        self._in_attesa = None
+        self._in_scrittura = False
+        self._cond = threading.Condition()
+        self._attivo = True
+        # Thread daemon per non bloccare l'uscita se nessuno chiama chiudi(): all'uscita l'hook atexit
+        # (che gira prima che i thread daemon vengano fermati) scrive comunque la fotografia in attesa
+        self._thread = threading.Thread(target=self._esegui, name="checkpoint", daemon=True)
+        self._thread.start()
+        atexit.register(self.chiudi)
+
+    def ripristina(self, server, rng, stats=None, pianificatore=None):
+        # (ultimo ciclo, contatore anomalie) dal checkpoint più recente, oppure None se si parte da zero
+        if not self.riprendi:
+            return None
+        percorso, dati = carica_ultimo(self.cartella)
+        if dati is None:
+            return None
+        ripreso = ripristina(dati, server, rng, stats, pianificatore, self.mantieni)
+        self.ultimo_ciclo = self.ultimo_scritto = ripreso[0]
+        log.warning("Ripresa dal checkpoint %s (ciclo %d)", percorso, ripreso[0])
+        return ripreso
+
+    def dopo_ciclo(self, ciclo, server, rng, counter_anomalie, stats=None, pianificatore=None):
+        if self.ogni and ciclo % self.ogni == 0:
+            self.salva(ciclo, server, rng, counter_anomalie, stats, pianificatore)
+
+    def salva(self, ciclo, server, rng, counter_anomalie, stats=None, pianificatore=None):
+        inizio = time.perf_counter()
+        dati = fotografa(server, rng, ciclo, counter_anomalie, stats, pianificatore)
+        self.tempo_fotografia_s += time.perf_counter() - inizio
+        self.fotografie += 1
+        self.ultimo_ciclo = ciclo
+        with self._cond:
+            if self._in_attesa is not None:
+                self.sostituiti += 1
+            self._in_attesa = (ciclo, dati)
+            self._cond.notify_all()
+
+    def _esegui(self):
+        while True:
+            with self._cond:
+                while self._in_attesa is None and self._attivo:
+                    self._cond.wait()
+                if self._in_attesa is None:
+                    return
+                ciclo, dati = self._in_attesa
+                self._in_attesa = None
+                self._in_scrittura = True
+            try:
+                self._scrivi(ciclo, dati)
+            except Exception:
+                # Il thread resta vivo: un checkpoint perso viene sostituito dal successivo
+                self.errori += 1
+                log.exception("Scrittura del checkpoint del ciclo %d fallita", ciclo)
+            finally:
+                with self._cond:
+                    self._in_scrittura = False
+                    self._cond.notify_all()
+
+    def _scrivi(self, ciclo, dati):
+        percorso = percorso_checkpoint(self.cartella, ciclo)
+        inizio = time.perf_counter()
+        scrivi(percorso, dati, self.comprimi)
+        self.tempo_scrittura_s += time.perf_counter() - inizio
+        self.byte = os.path.getsize(percorso)
+        self.scritti += 1
+        self.ultimo_scritto = ciclo
+        self._pota()
+
+    def _pota(self):
+        for vecchio in elenca_checkpoint(self.cartella)[self.conservati:]:
+            try:
+                os.remove(vecchio)
+            except OSError:
+                pass
+
+    def svuota(self, timeout=30.0):
+        # Attende che la fotografia in attesa e la scrittura in corso siano su disco; il thread resta attivo
+        with self._cond:
+            return self._cond.wait_for(lambda: self._in_attesa is None and not self._in_scrittura, timeout)
+
+    def chiudi(self, timeout=30.0):
+        # Scrive l'eventuale fotografia in attesa (entro timeout) e ferma il thread
+        with self._cond:
+            self._attivo = False
+            self._cond.notify_all()
+        self._thread.join(timeout)
+        atexit.unregister(self.chiudi)
+
+    def riepilogo(self):
+        return {
+            "fotografie": self.fotografie,
+            "scritti": self.scritti,
+            "sostituiti": self.sostituiti,
+            "errori": self.errori,
+            "ultimo_scritto": self.ultimo_scritto,
+            "byte_ultimo": self.byte,
+            "fotografia_ms": self.tempo_fotografia_s / self.fotografie * 1e3 if self.fotografie else 0.0,
+            "scrittura_ms": self.tempo_scrittura_s / self.scritti * 1e3 if self.scritti else 0.0,
+        }
@@ -0,0 +1,189 @@
+import json
+import logging
+import time
+from collections import deque
+
+import numpy as np
+
+from rifornimento import CONFIG, MODALITA
+from telemetria import sottoscrivi_sempre
+
+log = logging.getLogger("rifornimento.comandi")
+
+TOPIC_COMANDI = "ev/comandi"
+
+# Parametri CONFIG modificabili da remoto e relativi vincoli
+LIMITI_CONFIG = {
+    "max_potenza": (0, None),
+    "soglia_temp_alta": (0, None),
+    "soglia_temp_critica": (0, None),
+    "soglia_degrado": (0, 100),
+    "potenza_massima_stazione": (0, None),
+    "percentuale_riduzione_temp_alta": (0, 1),
+    "min_power_for_active": (0, None),
+    "max_raffreddamenti_per_ciclo": (0, None),
+    "soglia_fail_consecutivi_blocco": (1, None),
+}
+# Coppie (a, b) che devono restare con CONFIG[a] < CONFIG[b] dopo ogni modifica
+VINCOLI_CONFIG = (
+    ("soglia_temp_alta", "soglia_temp_critica"),
+    ("min_power_for_active", "max_potenza"),
+)
+
+
+class ComandoNonValido(ValueError):
+    pass
+
+
+# PARSING
+def interpreta_comando(payload):
+    # Formati accettati:
+    #   {"tipo": "config",   "chiave": "soglia_temp_alta", "valore": 60}
+    #   {"tipo": "modalita", "id": 3, "modalita": "Eco"}
+    #   {"tipo": "sblocca",  "id": 2}
+    if isinstance(payload, (bytes, bytearray)):
+        payload = payload.decode()
+    if isinstance(payload, str):
+        try:
+            payload = json.loads(payload)
+        except json.JSONDecodeError as e:
+            raise ComandoNonValido(f"JSON non valido: {e}") from None
+    if not isinstance(payload, dict):
+        raise ComandoNonValido("Il comando deve essere un oggetto JSON")
+
+    tipo = payload.get("tipo")
+    if tipo == "config":
+        chiave, valore = payload.get("chiave"), payload.get("valore")
+        if chiave not in LIMITI_CONFIG:
+            raise ComandoNonValido(f"Parametro non modificabile: {chiave}")
+        if isinstance(valore, bool) or not isinstance(valore, (int, float)):
+            raise ComandoNonValido(f"Valore non numerico per {chiave}: {valore!r}")
+        minimo, massimo = LIMITI_CONFIG[chiave]
+        if valore < minimo or (massimo is not None and valore > massimo):
+            raise ComandoNonValido(f"{chiave}={valore} fuori dai limiti [{minimo}, {massimo}]")
+        if isinstance(CONFIG[chiave], int) and not float(valore).is_integer():
+            raise ComandoNonValido(f"Valore non intero per {chiave}: {valore!r}")
+        valore = type(CONFIG[chiave])(valore)
+        return {"tipo": "config", "chiave": chiave, "valore": valore}
+
+    id_colonnina = payload.get("id")
+    if isinstance(id_colonnina, bool) or not isinstance(id_colonnina, int):
+        raise ComandoNonValido(f"Id colonnina non valido: {id_colonnina!r}")
+    if tipo == "modalita":
+        modalita = payload.get("modalita")
+        if modalita not in MODALITA:
+            raise ComandoNonValido(f"Modalità sconosciuta: {modalita!r}")
+        return {"tipo": "modalita", "id": id_colonnina, "modalita": modalita}
+    if tipo == "sblocca":
+        return {"tipo": "sblocca", "id": id_colonnina}
+    raise ComandoNonValido(f"Tipo di comando sconosciuto: {tipo!r}")
+
+
+# APPLICAZIONE
+def _applica(comando, server):
+    if comando["tipo"] == "config":
+        # I vincoli tra parametri si verificano qui, sul CONFIG corrente: i comandi del lotto arrivano in ordine
+        nuova = {**CONFIG, comando["chiave"]: comando["valore"]}
+        violati = [f"{a} < {b}" for a, b in VINCOLI_CONFIG if not nuova[a] < nuova[b]]
+        if violati:
+            log.warning("Comando config %s=%s rifiutato: deve valere %s", comando["chiave"], comando["valore"],
+                        ", ".join(violati))
+            return False
+        CONFIG[comando["chiave"]] = comando["valore"]
+        return True
+
+    col = server.registro.get(comando["id"])
+    if col is None:
+        log.warning("Comando %s: colonnina %s inesistente", comando["tipo"], comando["id"])
+        return False
+
+    if comando["tipo"] == "modalita":
+        col.modalita = comando["modalita"]
+        return True
+
+    if not col.stato.startswith("BLOCCATA"):
+        log.warning("Comando sblocca: colonnina %s non bloccata (%s)", col.id, col.stato)
+        return False
+    col.reset_raff_fail()
+    col.raffreddamento_attivo = False
+    if col.veicolo and col.soc_kwh < col.capacita * 0.98:
+        col.carica_attiva = True
+        col.stato = "OCCUPATA"
+    else:
+        col.veicolo = None
+        col.stato = "LIBERA"
+    log.info("Colonnina %s sbloccata da operatore → %s", col.id, col.stato)
+    return True
+
+
+# RICEVITORE
+class RicevitoreComandi:
+    # Parsing e validazione avvengono sul thread di rete; il ciclo di controllo applica il lotto in sospeso
+    # a inizio ciclo, mai durante distribuisci_potenza. deque.append/popleft sono atomiche: nessun lock.
+    def __init__(self, storico_latenze=1024):
+        self._in_sospeso = deque()
+        self._latenze = deque(maxlen=storico_latenze)
+        self.ricevuti = 0
+        self.rifiutati = 0
+        self.applicati = 0
+        self.falliti = 0
+        self._rifiutati_esportati = 0
+
+    def collega(self, client, topic=TOPIC_COMANDI):
+        # Callback solo per questo topic: on_message resta libero per gli altri utenti del client (sensori)
+        client.message_callback_add(topic, lambda client, userdata, msg: self.ricevi(msg.payload))
+        sottoscrivi_sempre(client, topic, qos=1)
+
+    def ricevi(self, payload):
+        self.ricevuti += 1
+        try:
+            comando = interpreta_comando(payload)
+        except ComandoNonValido as e:
+            self.rifiutati += 1
+            log.warning("Comando rifiutato: %s", e)
+            return False
+        self._in_sospeso.append((time.monotonic(), comando))
+        return True
+
+    def in_sospeso(self):
+        return len(self._in_sospeso)
+
+    def applica(self, server):
+        # Preleva tutto ciò che è arrivato finora e lo applica in blocco, prima della fase di controllo
+        lotto = []
+        while True:
+            try:
+                lotto.append(self._in_sospeso.popleft())
+            except IndexError:
+                break
+        applicati = sum(_applica(comando, server) for _, comando in lotto)
+        self.applicati += applicati
+        self.falliti += len(lotto) - applicati
+        adesso = time.monotonic()
+        latenze = [adesso - ricevuto for ricevuto, _ in lotto]
+        self._latenze.extend(latenze)
+
+        metriche = server.metriche
+        if metriche is not None:
+            for latenza in latenze:
+                metriche.latenza_comandi.osserva(latenza)
+            metriche.incrementa("comandi_applicati", applicati)
+            metriche.incrementa("comandi_falliti", len(lotto) - applicati)
+            # I rifiutati si contano sul thread di rete: qui si esporta solo la differenza dall'ultimo ciclo
+            rifiutati = self.rifiutati
+            metriche.incrementa("comandi_rifiutati", rifiutati - self._rifiutati_esportati)
+            self._rifiutati_esportati = rifiutati
+        return len(lotto)
+
+    def metriche(self):
+        latenze = np.array(self._latenze) if self._latenze else np.zeros(1)
+        return {
+            "ricevuti": self.ricevuti,
+            "rifiutati": self.rifiutati,
+            "applicati": self.applicati,
+            "falliti": self.falliti,
+            "in_sospeso": self.in_sospeso(),
+            "latenza_media_s": float(latenze.mean()),
+            "latenza_p95_s": float(np.percentile(latenze, 95)),
+            "latenza_max_s": float(latenze.max()),
+        }
@@ -0,0 +1 @@
+# I moduli della stazione stanno nella radice del repository: pytest la aggiunge a sys.path da qui
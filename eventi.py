@@ -0,0 +1,167 @@
+import argparse
+import heapq
+import itertools
+import logging
+import math
+import time
+
+import numpy as np
+
+from rifornimento import CONFIG
+
+log = logging.getLogger("rifornimento.eventi")
+
+# SIMULAZIONE A EVENTI DISCRETI
+# Alternativa al passo fisso di gestisci_arrivi: arrivi e partenze sono eventi in uno heap indicizzato per
+# ciclo, e a ogni tick si toccano solo le colonnine non libere (in carica, completate, bloccate) più quelle
+# con un evento in scadenza. Le colonnine libere non costano nulla finché non arriva il loro veicolo.
+#
+# Arrivi Poisson: al passo fisso ogni colonnina libera estrae un arrivo con probabilità p a ogni ciclo, a
+# partire dal ciclo successivo a quello in cui si è liberata; qui si estrae direttamente il ciclo d'arrivo
+# da una geometrica di parametro p (stessa distribuzione). In alternativa gli arrivi vengono da una traccia.
+# Completamenti e fallimenti del raffreddamento restano quelli di aggiorna_soc / applica_raffreddamento
+# (la potenza si rialloca a ogni ciclo), e i cambi di stato che producono arrivano qui dal registro.
+
+ARRIVO = 0
+PARTENZA = 1
+
+
+class CodaEventi:
+    def __init__(self):
+        self._heap = []
+        self._seq = itertools.count()   # a parità di ciclo, ordine di inserimento
+
+    def __len__(self):
+        return len(self._heap)
+
+    def programma(self, ciclo, tipo, id_colonnina):
+        heapq.heappush(self._heap, (ciclo, next(self._seq), tipo, id_colonnina))
+
+    def programma_molti(self, eventi):
+        self._heap.extend((ciclo, next(self._seq), tipo, id_col) for ciclo, tipo, id_col in eventi)
+        heapq.heapify(self._heap)
+
+    def prossimo_ciclo(self):
+        return self._heap[0][0] if self._heap else math.inf
+
+    def in_ordine(self):
+        # (ciclo, tipo, id) nell'ordine in cui verranno estratti, per il checkpoint
+        return [(ciclo, tipo, id_col) for ciclo, _, tipo, id_col in sorted(self._heap)]
+
+    def scaduti(self, ciclo):
+        heap = self._heap
+        while heap and heap[0][0] <= ciclo:
+            evento = heapq.heappop(heap)
+            yield evento[0], evento[2], evento[3]
+
+
+class Pianificatore:
+    def __init__(self, server, rng, arrivi=None):
+        # arrivi: None → Poisson con CONFIG["prob_arrivo"]; altrimenti sequenza di (ciclo, id_colonnina)
+        self.server = server
+        self.rng = rng
+        self.coda = CodaEventi()
+        self.da_traccia = arrivi is not None
+        self.ciclo = 0
+        self.eventi_gestiti = 0
+        self.arrivi_persi = 0
+        self.toccate = 0
+        self.cambiate = {}              # id → colonnina cambiata di stato dall'ultimo tick
+        server.registro.osservatori.append(self._cambio_stato)
+
+        if self.da_traccia:
+            self.coda.programma_molti((int(c), ARRIVO, int(i)) for c, i in arrivi)
+        else:
+            libere = [col.id for col in server.registro.per_stato("LIBERA")]
+            attese = self.rng.geometric(CONFIG["prob_arrivo"], size=len(libere))
+            self.coda.programma_molti((int(a), ARRIVO, i) for a, i in zip(attese, libere))
+
+    def _cambio_stato(self, col, vecchio, nuovo):
+        self.cambiate[col.id] = col
+        if nuovo == "COMPLETATA":
+            # Il veicolo parte all'inizio del ciclo successivo, come al passo fisso
+            self.coda.programma(self.ciclo + 1, PARTENZA, col.id)
+        elif nuovo == "LIBERA" and not self.da_traccia:
+            self.coda.programma(self.ciclo + int(self.rng.geometric(CONFIG["prob_arrivo"])), ARRIVO, col.id)
+
+    def tick(self, ciclo):
+        # Applica gli eventi scaduti e restituisce le colonnine da leggere in questo ciclo: quelle non libere
+        # più quelle cambiate di stato dall'ultimo tick (es. appena liberate, lette una volta come LIBERA)
+        self.ciclo = ciclo
+        registro = self.server.registro
+        for _, tipo, id_col in self.coda.scaduti(ciclo):
+            col = registro.get(id_col)
+            if col is None:
+                continue
+            self.eventi_gestiti += 1
+            if tipo == ARRIVO:
+                if col.stato == "LIBERA":
+                    col.assegna_auto()
+                else:
+                    self.arrivi_persi += 1
+            elif col.stato == "COMPLETATA":
+                log.info(" Colonnina %s è stata liberata.", col.id)
+                col.stato = "LIBERA"
+                col.veicolo = None
+                col.raffreddamento_attivo = False
+                col.reset_raff_fail()
+
+        attive = {col.id: col for stato in ("OCCUPATA", "COMPLETATA", "BLOCCATA_RAFF_FALLITO")
+                  for col in registro.per_stato(stato)}
+        attive.update(self.cambiate)
+        self.cambiate = {}
+        colonnine = sorted(attive.values(), key=lambda col: col.id)
+        self.toccate += len(colonnine)
+        return colonnine
+
+    def riepilogo(self):
+        return {"eventi_gestiti": self.eventi_gestiti, "arrivi_persi": self.arrivi_persi,
+                "in_coda": len(self.coda), "colonnine_toccate": self.toccate}
+
+
+def carica_arrivi(percorso):
+    # CSV con una riga "ciclo,id_colonnina" per arrivo (intestazione facoltativa con #)
+    dati = np.loadtxt(percorso, delimiter=",", dtype=np.int64, ndmin=2)
+    return [(int(c), int(i)) for c, i in dati]
+
+
+# CONFRONTO CON IL PASSO FISSO
+def confronta_modalita(num_colonnine, cicli, seed, repliche=3, config=None):
+    import rifornimento
+    from scenari import config_temporanea, riassumi_stats
+
+    semi = np.random.SeedSequence(seed).spawn(repliche)
+    risultati = {}
+    for eventi in (False, True):
+        tempi, sintesi = [], []
+        with config_temporanea(config or {}):
+            for s in semi:
+                inizio = time.perf_counter()
+                stats = rifornimento.avvia_headless(num_colonnine, cicli, s, eventi=eventi)
+                tempi.append(time.perf_counter() - inizio)
+                sintesi.append(riassumi_stats(stats))
+        risultati["eventi" if eventi else "passo_fisso"] = {
+            "tempo_s": float(np.mean(tempi)),
+            "metriche": {k: float(np.mean([r[k] for r in sintesi])) for k in sintesi[0]},
+        }
+    return risultati
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Passo fisso contro eventi discreti sulla stessa stazione")
+    parser.add_argument("--colonnine", type=int, default=5000)
+    parser.add_argument("--cicli", type=int, default=300)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--repliche", type=int, default=3)
+    parser.add_argument("--prob-arrivo", type=float, default=2e-4)
+    parser.add_argument("--potenza-stazione", type=float, default=5000)
+    args = parser.parse_args()
+
+    logging.basicConfig(level="ERROR", format="%(message)s")
+    esito = confronta_modalita(args.colonnine, args.cicli, args.seed, args.repliche,
+                               {"prob_arrivo": args.prob_arrivo, "potenza_massima_stazione": args.potenza_stazione})
+    fisso, eventi = esito["passo_fisso"], esito["eventi"]
+    print(f"{'':<20}{'passo fisso':>14}{'eventi':>14}")
+    print(f"{'tempo (s)':<20}{fisso['tempo_s']:>14.3f}{eventi['tempo_s']:>14.3f}   ×{fisso['tempo_s'] / eventi['tempo_s']:.1f}")
+    for k in fisso["metriche"]:
+        print(f"{k:<20}{fisso['metriche'][k]:>14.3f}{eventi['metriche'][k]:>14.3f}")
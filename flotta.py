@@ -0,0 +1,427 @@
+from collections.abc import MutableMapping
+
+import numpy as np
+
+from rifornimento import CONFIG, MODALITA, NOMI_VEICOLI, STATI, VEICOLI, AgenteLocale, Lettura
+from sensori import SorgenteSintetica
+
+# FLOTTA STRUCT-OF-ARRAYS
+# Stato di tutte le colonnine in array NumPy: ogni fase del ciclo è un kernel vettoriale sull'intera flotta
+# (o su un sottoinsieme di righe, dato come maschera o come indici).
+LIBERA, OCCUPATA, COMPLETATA, BLOCCATA_RAFF_FALLITO = range(len(STATI))
+RAFF_USATO = (None, "centrale", "locale")
+NESSUN_RAFF, RAFF_CENTRALE, RAFF_LOCALE = range(len(RAFF_USATO))
+CHIAVI_BELIEFS = ("p_fail_raff_locale", "p_fail_raff_centrale", "var_temp")
+
+_BATTERIA = np.array([VEICOLI[v]["batteria"] for v in NOMI_VEICOLI], dtype=float)
+_MAX_POTENZA = np.array([VEICOLI[v]["max_potenza"] for v in NOMI_VEICOLI], dtype=float)
+
+
+def _indici(selezione):
+    # Maschera booleana sulla flotta o elenco di indici → indici
+    selezione = np.asarray(selezione)
+    return np.flatnonzero(selezione) if selezione.dtype == bool else selezione.reshape(-1)
+
+
+class Flotta:
+    def __init__(self, num_colonnine, rng=None, sorgente_sensori=None):
+        n = num_colonnine
+        self.rng = rng if rng is not None else np.random.default_rng()
+        self.sorgente_sensori = sorgente_sensori if sorgente_sensori is not None else SorgenteSintetica(self.rng)
+        self.id = np.arange(1, n + 1)
+        self.veicolo = np.full(n, -1, dtype=np.int8)
+        self.capacita = np.zeros(n)
+        self.soc_kwh = np.zeros(n)
+        self.carica_attiva = np.zeros(n, dtype=bool)
+        self.stato = np.full(n, LIBERA, dtype=np.int8)
+        self.modalita = np.full(n, MODALITA.index("Standard"), dtype=np.int8)
+
+        self.raffreddamento_attivo = np.zeros(n, dtype=bool)
+        self.fail_raff_consecutivi = np.zeros(n, dtype=np.int32)
+        self.stato_raff_fallito = np.zeros(n, dtype=bool)
+        self.ultimo_raff_usato = np.full(n, NESSUN_RAFF, dtype=np.int8)
+
+        # Credenze degli agenti locali
+        self.p_fail_raff_locale = np.full(n, CONFIG["prob_fail_raffreddamento_locale"])
+        self.p_fail_raff_centrale = np.full(n, CONFIG["prob_fail_raffreddamento_centrale"])
+        self.var_temp = np.full(n, 5.0)
+        self._viste = None
+
+    def __len__(self):
+        return len(self.id)
+
+    def colonnine(self, rngs=None):
+        # Viste stile Colonnina, create una volta sola: il Server le tiene nel registro.
+        # rngs: un generatore per vista (per il suo agente); di default derivati dal generatore della flotta
+        if self._viste is None:
+            rngs = rngs if rngs is not None else self.rng.spawn(len(self))
+            self._viste = [VistaColonnina(self, i, rng) for i, rng in enumerate(rngs)]
+        return self._viste
+
+    def colonnina(self, i):
+        return self.colonnine()[i]
+
+    def bloccate(self):
+        return self.stato == BLOCCATA_RAFF_FALLITO
+
+    def soc_percento(self, indici=None):
+        idx = slice(None) if indici is None else _indici(indici)
+        veicolo, capacita = self.veicolo[idx], self.capacita[idx]
+        with np.errstate(divide='ignore', invalid='ignore'):
+            soc = np.where(veicolo >= 0, self.soc_kwh[idx] / capacita * 100, 0.0)
+        return np.round(soc, 1)
+
+    # --- Arrivi e partenze ---
+    def reset_raff_fail(self, selezione):
+        self.fail_raff_consecutivi[selezione] = 0
+        self.stato_raff_fallito[selezione] = False
+
+    def assegna_auto(self, selezione):
+        idx = _indici(selezione)
+        veicoli = self.rng.integers(len(NOMI_VEICOLI), size=len(idx))
+        self.veicolo[idx] = veicoli
+        self.capacita[idx] = _BATTERIA[veicoli]
+        self.soc_kwh[idx] = self.rng.uniform(5, 0.25 * self.capacita[idx])
+        self.carica_attiva[idx] = True
+        self.stato[idx] = OCCUPATA
+        self.raffreddamento_attivo[idx] = False
+        self.reset_raff_fail(idx)
+        self.modalita[idx] = self.rng.integers(len(MODALITA), size=len(idx))
+
+    def libera_completate(self):
+        mask = self.stato == COMPLETATA
+        self.stato[mask] = LIBERA
+        self.veicolo[mask] = -1
+        self.raffreddamento_attivo[mask] = False
+        self.reset_raff_fail(mask)
+        return mask
+
+    def arrivi(self, prob=0.4):
+        mask = (self.stato == LIBERA) & (self.rng.random(len(self)) < prob)
+        self.assegna_auto(mask)
+        return mask
+
+    # --- Sensori ---
+    def rileva(self, indici=None, grezze=None):
+        # grezze: colonne già campionate per queste righe (come SorgenteSintetica.campiona), altrimenti si
+        # interroga la sorgente della flotta. Si tocca solo la parte di flotta richiesta.
+        idx = np.arange(len(self)) if indici is None else _indici(indici)
+        n = len(idx)
+        rng = self.rng
+        stato = self.stato[idx]
+        bloccata = stato == BLOCCATA_RAFF_FALLITO
+        occupata = stato == OCCUPATA
+
+        if grezze is None:
+            grezze = self.sorgente_sensori.campiona(self.id[idx])
+        t_esterna = np.asarray(grezze["temperatura_esterna"], dtype=float)
+        t_reale = np.asarray(grezze["temperatura"], dtype=float)
+
+        max_p = np.where(occupata, _MAX_POTENZA[self.veicolo[idx]], 0.0)
+        potenza_teorica = np.where(occupata, rng.uniform(0.5, 1.0, n) * max_p, 0.0)
+        inc_teorico = potenza_teorica / 10.0 * 2.0
+        inc_teorico = np.where(self.raffreddamento_attivo[idx], inc_teorico * 0.6, inc_teorico)
+        temp_predetta = np.where(occupata, t_esterna + inc_teorico, t_esterna + 1.0)
+
+        gap = np.abs(t_reale - temp_predetta)
+        media_temp = (t_reale + temp_predetta) / 2
+        anomalia = gap > 15.0
+        anomalia_pericolosa = anomalia & (media_temp > 45.0)
+
+        temperatura = np.where(anomalia, np.maximum(t_reale, temp_predetta), t_reale)
+        temperatura = np.where(bloccata, np.maximum(temperatura, 75.0), temperatura)
+
+        return {
+            "indici": idx,
+            "id": self.id[idx],
+            "stato": stato,
+            "soc": self.soc_percento(idx),
+            "temperatura": np.round(temperatura, 1),
+            "temperatura_esterna": t_esterna,
+            "temperatura_predetta": np.round(temp_predetta, 1),
+            "temperatura_reale_grezzo": np.round(t_reale, 1),
+            "gap_rilevato": np.round(gap, 1),
+            "anomalia": anomalia,
+            "anomalia_pericolosa": anomalia_pericolosa,
+            "media_temperatura": np.round(media_temp, 1),
+            "degrado": np.asarray(grezze["degrado"], dtype=float),
+            "tensione": np.asarray(grezze["tensione"], dtype=float),
+            "potenza_richiesta": np.round(potenza_teorica, 1),
+            "raffreddamento_attivo": self.raffreddamento_attivo[idx].copy(),
+            "fail_raff_consecutivi": self.fail_raff_consecutivi[idx].copy(),
+            "modalita": self.modalita[idx].copy(),
+        }
+
+    def letture(self, indici=None, grezze=None):
+        # Le Lettura di leggi_parametri per le righe richieste, calcolate in blocco da rileva
+        r = self.rileva(indici, grezze)
+        idx = r["indici"]
+        stati = [STATI[s] for s in r["stato"].tolist()]
+        veicoli = [NOMI_VEICOLI[v] if s == "OCCUPATA" else None for s, v in zip(stati, self.veicolo[idx].tolist())]
+        modalita = [MODALITA[m] for m in r["modalita"].tolist()]
+        colonne = [r[campo].tolist() for campo in (
+            "soc", "temperatura", "temperatura_esterna", "temperatura_predetta", "temperatura_reale_grezzo",
+            "gap_rilevato", "anomalia", "anomalia_pericolosa", "media_temperatura", "degrado", "tensione",
+            "potenza_richiesta", "raffreddamento_attivo", "fail_raff_consecutivi")]
+        raff_fallito = self.stato_raff_fallito[idx].tolist()
+        bloccata = (r["stato"] == BLOCCATA_RAFF_FALLITO).tolist()
+        return [Lettura(id_col, stato, veicolo, mod, *valori, fallito, blocco)
+                for id_col, stato, veicolo, mod, fallito, blocco, *valori
+                in zip(r["id"].tolist(), stati, veicoli, modalita, raff_fallito, bloccata, *colonne)]
+
+    # --- Dinamica ---
+    def aggiorna_soc(self, potenza_effettiva, selezione=None):
+        # potenza_effettiva: scalare o un valore per riga selezionata; restituisce gli indici delle completate
+        idx = np.arange(len(self)) if selezione is None else _indici(selezione)
+        potenza = np.broadcast_to(potenza_effettiva, idx.shape)
+        attive = self.carica_attiva[idx] & (self.stato[idx] != BLOCCATA_RAFF_FALLITO)
+        righe = idx[attive]
+        self.soc_kwh[righe] = np.minimum(self.capacita[righe], self.soc_kwh[righe] + potenza[attive] / 60.0)
+        completate = righe[self.soc_kwh[righe] >= self.capacita[righe] * 0.98]
+        self.stato[completate] = COMPLETATA
+        self.carica_attiva[completate] = False
+        return completate
+
+    def applica_raffreddamento(self, centrale_attivo, locale_attivo, selezione=None):
+        # Equivalente vettoriale di Colonnina.applica_raffreddamento (di default sulle occupate);
+        # restituisce gli indici delle nuove bloccate
+        idx = np.flatnonzero(self.stato == OCCUPATA) if selezione is None else _indici(selezione)
+        centrale = np.broadcast_to(centrale_attivo, idx.shape)
+        locale = np.broadcast_to(locale_attivo, idx.shape)
+        attivato = centrale | locale
+
+        self.ultimo_raff_usato[idx] = np.where(centrale, RAFF_CENTRALE, np.where(locale, RAFF_LOCALE, NESSUN_RAFF))
+        self.raffreddamento_attivo[idx] = attivato
+        self.reset_raff_fail(idx[~attivato])
+
+        fallito = attivato & (self.rng.random(len(idx)) < CONFIG["prob_fail_raffreddamento_locale"])
+        self.fail_raff_consecutivi[idx[fallito]] += 1
+        self.stato_raff_fallito[idx[fallito]] = True
+        self.reset_raff_fail(idx[attivato & ~fallito])
+
+        bloccate = idx[fallito & (self.fail_raff_consecutivi[idx] >= CONFIG["soglia_fail_consecutivi_blocco"])]
+        self.stato[bloccate] = BLOCCATA_RAFF_FALLITO
+        self.carica_attiva[bloccate] = False
+
+        self.aggiorna_beliefs(idx[attivato], fallito[attivato], centrale[attivato])
+        return bloccate
+
+    def aggiorna_beliefs(self, indici, fallito, centrale):
+        # Stesso aggiornamento di AgenteLocale.aggiorna_beliefs, per le righe `indici` (array allineati)
+        prior_alpha, prior_beta = 1, 19
+        peso = prior_alpha + prior_beta
+        f = fallito.astype(float)
+        loc, cen = indici[~centrale], indici[centrale]
+        self.p_fail_raff_locale[loc] = (self.p_fail_raff_locale[loc] * peso + f[~centrale]) / (peso + 1)
+        self.p_fail_raff_centrale[cen] = (self.p_fail_raff_centrale[cen] * peso + f[centrale]) / (peso + 1)
+        self.var_temp[indici] = np.maximum(1.0, self.var_temp[indici] * np.where(fallito, 1.1, 0.9))
+
+    # --- Kernel per le viste registrate in un Server ---
+    def _notifica(self, idx, vecchi):
+        # Le viste delle righe che il kernel ha cambiato di stato aggiornano versione_stato e registro
+        for k in np.flatnonzero(self.stato[idx] != vecchi).tolist():
+            self._viste[idx[k]]._dopo_kernel(STATI[vecchi[k]])
+
+    def aggiorna_soc_viste(self, viste, potenze):
+        idx = np.array([v.indice for v in viste], dtype=np.intp)
+        vecchi = self.stato[idx]
+        self.aggiorna_soc(np.asarray(potenze, dtype=float), idx)
+        self._notifica(idx, vecchi)
+
+    def applica_raffreddamento_viste(self, viste, centrale_attivo, locale_attivo):
+        # Come VistaColonnina.applica_raffreddamento per ogni vista, in un solo kernel; esiti allineati a viste
+        idx = np.array([v.indice for v in viste], dtype=np.intp)
+        vecchi = self.stato[idx]
+        centrale = np.broadcast_to(np.asarray(centrale_attivo, dtype=bool), idx.shape)
+        locale = np.broadcast_to(np.asarray(locale_attivo, dtype=bool), idx.shape)
+        bloccate = self.applica_raffreddamento(centrale, locale, idx)
+        for k in np.flatnonzero(centrale | locale).tolist():
+            viste[k].agente.aggiorna_bucket_efe()
+        self._notifica(idx, vecchi)
+        return np.isin(idx, bloccate).tolist()
+
+# LETTURE IN BLOCCO
+class BancoFlotta:
+    # Al posto di sensori.BancoSensori: una sola rilevazione vettoriale per tutte le colonnine lette nel ciclo.
+    # leggi() restituisce già le Lettura, che VistaColonnina.leggi_parametri lascia passare.
+    def __init__(self, flotta):
+        self.flotta = flotta
+        self.sorgente = flotta.sorgente_sensori
+
+    def leggi(self, colonnine):
+        return self.flotta.letture([col.indice for col in colonnine])
+
+
+# VISTA A OGGETTI
+class BeliefsFlotta(MutableMapping):
+    # Il dict beliefs di AgenteLocale, letto e scritto direttamente negli array della flotta
+    def __init__(self, flotta, indice):
+        self.flotta = flotta
+        self.indice = indice
+
+    def __getitem__(self, chiave):
+        if chiave not in CHIAVI_BELIEFS:
+            raise KeyError(chiave)
+        return float(getattr(self.flotta, chiave)[self.indice])
+
+    def __setitem__(self, chiave, valore):
+        if chiave not in CHIAVI_BELIEFS:
+            raise KeyError(chiave)
+        getattr(self.flotta, chiave)[self.indice] = valore
+
+    def __delitem__(self, chiave):
+        raise TypeError("le belief della flotta non si rimuovono")
+
+    def __iter__(self):
+        return iter(CHIAVI_BELIEFS)
+
+    def __len__(self):
+        return len(CHIAVI_BELIEFS)
+
+
+class VistaColonnina:
+    # Interfaccia di Colonnina su una riga della flotta: si registra nel Server come una colonnina qualsiasi.
+    # I cambi di stato fatti dai kernel passano da _dopo_kernel, che aggiorna versione_stato e registro.
+    def __init__(self, flotta, indice, rng=None):
+        self.flotta = flotta
+        self.indice = indice
+        self.rng = rng if rng is not None else flotta.rng
+        self.versione_stato = 0
+        self.registro = None
+        self.agente = AgenteLocale(self, rng=self.rng.spawn(1)[0])
+        self.agente.beliefs = BeliefsFlotta(flotta, indice)
+
+    @property
+    def id(self):
+        return int(self.flotta.id[self.indice])
+
+    @property
+    def veicolo(self):
+        v = self.flotta.veicolo[self.indice]
+        return NOMI_VEICOLI[v] if v >= 0 else None
+
+    @veicolo.setter
+    def veicolo(self, nuovo):
+        self.flotta.veicolo[self.indice] = -1 if nuovo is None else NOMI_VEICOLI.index(nuovo)
+
+    @property
+    def capacita(self):
+        return float(self.flotta.capacita[self.indice]) if self.veicolo else None
+
+    @capacita.setter
+    def capacita(self, nuova):
+        self.flotta.capacita[self.indice] = 0.0 if nuova is None else nuova
+
+    @property
+    def soc_kwh(self):
+        return float(self.flotta.soc_kwh[self.indice])
+
+    @soc_kwh.setter
+    def soc_kwh(self, nuovo):
+        self.flotta.soc_kwh[self.indice] = nuovo
+
+    @property
+    def carica_attiva(self):
+        return bool(self.flotta.carica_attiva[self.indice])
+
+    @carica_attiva.setter
+    def carica_attiva(self, nuova):
+        self.flotta.carica_attiva[self.indice] = nuova
+
+    @property
+    def stato(self):
+        return STATI[self.flotta.stato[self.indice]]
+
+    @stato.setter
+    def stato(self, nuovo):
+        vecchio = self.stato
+        self.flotta.stato[self.indice] = STATI.index(nuovo)
+        self.versione_stato += 1
+        if self.registro is not None and vecchio != nuovo:
+            self.registro.cambio_stato(self, vecchio, nuovo)
+
+    def _dopo_kernel(self, vecchio):
+        # Un kernel della flotta può aver cambiato lo stato di questa riga
+        nuovo = self.stato
+        if nuovo != vecchio:
+            self.versione_stato += 1
+            if self.registro is not None:
+                self.registro.cambio_stato(self, vecchio, nuovo)
+
+    @property
+    def modalita(self):
+        return MODALITA[self.flotta.modalita[self.indice]]
+
+    @modalita.setter
+    def modalita(self, nuova):
+        self.flotta.modalita[self.indice] = MODALITA.index(nuova)
+
+    @property
+    def raffreddamento_attivo(self):
+        return bool(self.flotta.raffreddamento_attivo[self.indice])
+
+    @raffreddamento_attivo.setter
+    def raffreddamento_attivo(self, attivo):
+        self.flotta.raffreddamento_attivo[self.indice] = attivo
+
+    @property
+    def fail_raff_consecutivi(self):
+        return int(self.flotta.fail_raff_consecutivi[self.indice])
+
+    @fail_raff_consecutivi.setter
+    def fail_raff_consecutivi(self, n):
+        self.flotta.fail_raff_consecutivi[self.indice] = n
+
+    @property
+    def stato_raff_fallito(self):
+        return bool(self.flotta.stato_raff_fallito[self.indice])
+
+    @stato_raff_fallito.setter
+    def stato_raff_fallito(self, fallito):
+        self.flotta.stato_raff_fallito[self.indice] = fallito
+
+    @property
+    def ultimo_raff_usato(self):
+        return RAFF_USATO[self.flotta.ultimo_raff_usato[self.indice]]
+
+    @ultimo_raff_usato.setter
+    def ultimo_raff_usato(self, tipo):
+        self.flotta.ultimo_raff_usato[self.indice] = RAFF_USATO.index(tipo)
+
+    @property
+    def beliefs(self):
+        return self.agente.beliefs
+
+    def reset_raff_fail(self):
+        self.flotta.reset_raff_fail(self.indice)
+
+    def soc_percento(self) -> float:
+        f, i = self.flotta, self.indice
+        if f.veicolo[i] < 0:
+            return 0.0
+        return round(float(f.soc_kwh[i] / f.capacita[i] * 100), 1)
+
+    def assegna_auto(self):
+        vecchio = self.stato
+        self.flotta.assegna_auto([self.indice])
+        self._dopo_kernel(vecchio)
+
+    def leggi_parametri(self, letture=None) -> Lettura:
+        # letture: valori grezzi di un BancoSensori (dict), oppure la Lettura già calcolata da BancoFlotta
+        if letture is not None and not isinstance(letture, dict):
+            return letture
+        grezze = None if letture is None else {g: [v] for g, v in letture.items()}
+        return self.flotta.letture([self.indice], grezze)[0]
+
+    def aggiorna_soc(self, potenza_effettiva: float):
+        vecchio = self.stato
+        self.flotta.aggiorna_soc(potenza_effettiva, [self.indice])
+        self._dopo_kernel(vecchio)
+
+    def applica_raffreddamento(self, centrale_attivo: bool, locale_attivo: bool) -> bool:
+        vecchio = self.stato
+        bloccate = self.flotta.applica_raffreddamento(centrale_attivo, locale_attivo, [self.indice])
+        if centrale_attivo or locale_attivo:
+            self.agente.aggiorna_bucket_efe()
+        self._dopo_kernel(vecchio)
+        return len(bloccate) > 0
@@ -0,0 +1,216 @@
+import bisect
+import logging
+import os
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+log = logging.getLogger("rifornimento.metriche")
+
+# METRICHE DEL CICLO
+# Timer per fase, istogrammi di latenza e contatori, esportati in formato testo Prometheus (file per il
+# textfile collector o endpoint HTTP /metrics) e come istantanea JSON sul topic MQTT delle metriche.
+# Disattivate (server.metriche = None) costano un nullcontext per fase e nient'altro.
+
+TOPIC_METRICHE = "ev/metriche"
+PREFISSO = "rifornimento"
+
+# Limiti superiori dei bucket, in secondi
+BUCKET_LATENZA = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+FASI = ("comandi", "arrivi", "sensori", "decisioni", "raffreddamento", "allocazione", "applicazione",
+        "statistiche", "pubblicazione")
+
+CONTATORI = {
+    "cicli": "Cicli di controllo completati",
+    "decisioni": "Decisioni degli agenti calcolate",
+    "campioni_efe": "Campioni Monte Carlo estratti per l'EFE",
+    "fallimenti_raffreddamento": "Raffreddamenti locali falliti",
+    "blocchi": "Colonnine passate in BLOCCATA_RAFF_FALLITO",
+    "anomalie": "Letture anomale dei sensori su colonnine non libere",
+    "comandi_applicati": "Comandi operatore applicati",
+    "comandi_falliti": "Comandi operatore validi ma non applicabili",
+    "comandi_rifiutati": "Comandi operatore scartati in validazione",
+}
+
+VALORI = {
+    "colonnine_occupate": "Colonnine occupate nell'ultimo ciclo",
+    "colonnine_bloccate": "Colonnine bloccate nell'ultimo ciclo",
+    "potenza_totale_kw": "Potenza erogata nell'ultimo ciclo",
+    "cache_efe_hit_rate": "Quota di decisioni servite dalla cache EFE",
+}
+
+
+class Istogramma:
+    def __init__(self, limiti=BUCKET_LATENZA):
+        self.limiti = limiti
+        self.conteggi = [0] * (len(limiti) + 1)
+        self.somma = 0.0
+        self.n = 0
+
+    def osserva(self, valore):
+        self.conteggi[bisect.bisect_left(self.limiti, valore)] += 1
+        self.somma += valore
+        self.n += 1
+
+    def quantile(self, q):
+        # Stima dal bucket: limite superiore del primo bucket che copre la quota q
+        if not self.n:
+            return 0.0
+        soglia = q * self.n
+        cumulato = 0
+        for limite, c in zip(self.limiti, self.conteggi):
+            cumulato += c
+            if cumulato >= soglia:
+                return limite
+        return float("inf")
+
+
+class _Timer:
+    # Riutilizzabile: un oggetto per fase, nessuna allocazione per ciclo. Una fase può aprirsi più volte
+    # nello stesso ciclo (l'allocazione: richieste regolate, poi assegnazione): le durate si sommano e
+    # l'istogramma riceve un solo valore per ciclo, a chiudi_ciclo.
+    __slots__ = ("istogramma", "_inizio", "_durata", "_aperto")
+
+    def __init__(self, istogramma):
+        self.istogramma = istogramma
+        self._inizio = 0.0
+        self._durata = 0.0
+        self._aperto = False
+
+    def __enter__(self):
+        self._inizio = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self._durata += time.perf_counter() - self._inizio
+        self._aperto = True
+        return False
+
+    def chiudi_ciclo(self):
+        if self._aperto:
+            self.istogramma.osserva(self._durata)
+            self._durata = 0.0
+            self._aperto = False
+
+
+class Metriche:
+    def __init__(self, stazione="stazione", file=None, ogni=10):
+        # file: percorso per il textfile collector, riscritto ogni `ogni` cicli
+        self.stazione = stazione
+        self.file = file
+        self.ogni = ogni
+        self.fasi = {f: Istogramma() for f in FASI}
+        self.ciclo = Istogramma()
+        self.latenza_decisione = Istogramma()
+        self.latenza_comandi = Istogramma()
+        self.contatori = dict.fromkeys(CONTATORI, 0)
+        self.valori = dict.fromkeys(VALORI, 0.0)
+        self._timer = {f: _Timer(h) for f, h in self.fasi.items()}
+        self._timer_ciclo = _Timer(self.ciclo)
+
+    def fase(self, nome):
+        return self._timer[nome]
+
+    def durata_ciclo(self):
+        return self._timer_ciclo
+
+    def incrementa(self, nome, quanto=1):
+        self.contatori[nome] += quanto
+
+    def imposta(self, nome, valore):
+        self.valori[nome] = valore
+
+    def fine_ciclo(self, pubblicatore=None):
+        for timer in self._timer.values():
+            timer.chiudi_ciclo()
+        self._timer_ciclo.chiudi_ciclo()
+        self.contatori["cicli"] += 1
+        if pubblicatore is not None:
+            self.pubblica(pubblicatore)
+        if self.file is not None and self.contatori["cicli"] % self.ogni == 0:
+            self.scrivi_file(self.file)
+
+    # ESPORTAZIONE
+    def testo_prometheus(self):
+        etichetta = f'stazione="{self.stazione}"'
+        righe = []
+
+        def istogramma(nome, h, extra=""):
+            etichette = f"{etichetta},{extra}" if extra else etichetta
+            cumulato = 0
+            for limite, c in zip(h.limiti, h.conteggi):
+                cumulato += c
+                righe.append(f'{nome}_bucket{{{etichette},le="{limite:g}"}} {cumulato}')
+            righe.append(f'{nome}_bucket{{{etichette},le="+Inf"}} {h.n}')
+            righe.append(f"{nome}_sum{{{etichette}}} {h.somma:.9g}")
+            righe.append(f"{nome}_count{{{etichette}}} {h.n}")
+
+        nome = f"{PREFISSO}_fase_durata_secondi"
+        righe += [f"# HELP {nome} Durata di ogni fase del ciclo di controllo", f"# TYPE {nome} histogram"]
+        for fase, h in self.fasi.items():
+            istogramma(nome, h, f'fase="{fase}"')
+
+        for nome, aiuto, h in ((f"{PREFISSO}_ciclo_durata_secondi", "Durata del ciclo completo", self.ciclo),
+                               (f"{PREFISSO}_decisione_durata_secondi", "Latenza di decide() per colonnina",
+                                self.latenza_decisione),
+                               (f"{PREFISSO}_comando_latenza_secondi", "Attesa dei comandi tra ricezione e applicazione",
+                                self.latenza_comandi)):
+            righe += [f"# HELP {nome} {aiuto}", f"# TYPE {nome} histogram"]
+            istogramma(nome, h)
+
+        for chiave, aiuto in CONTATORI.items():
+            nome = f"{PREFISSO}_{chiave}_total"
+            righe += [f"# HELP {nome} {aiuto}", f"# TYPE {nome} counter", f"{nome}{{{etichetta}}} {self.contatori[chiave]}"]
+        for chiave, aiuto in VALORI.items():
+            nome = f"{PREFISSO}_{chiave}"
+            righe += [f"# HELP {nome} {aiuto}", f"# TYPE {nome} gauge", f"{nome}{{{etichetta}}} {self.valori[chiave]:g}"]
+        return "\n".join(righe) + "\n"
+
+    def istantanea(self):
+        # Versione compatta per MQTT: medie e p95 per fase invece dei bucket
+        return {
+            "stazione": self.stazione,
+            "fasi_ms": {f: {"media": h.somma / h.n * 1e3 if h.n else 0.0, "p95": h.quantile(0.95) * 1e3}
+                        for f, h in self.fasi.items()},
+            "ciclo_ms": {"media": self.ciclo.somma / self.ciclo.n * 1e3 if self.ciclo.n else 0.0,
+                         "p95": self.ciclo.quantile(0.95) * 1e3},
+            "decisione_ms_p95": self.latenza_decisione.quantile(0.95) * 1e3,
+            "comando_ms_p95": self.latenza_comandi.quantile(0.95) * 1e3,
+            "contatori": dict(self.contatori),
+            "valori": dict(self.valori),
+        }
+
+    def pubblica(self, pubblicatore):
+        # Passa per la coda del pubblicatore di telemetria: stesso thread, stessa politica di backpressure
+        pubblicatore.accoda({TOPIC_METRICHE: self.istantanea()})
+
+    def scrivi_file(self, percorso):
+        # Scrittura atomica, come richiesto dal textfile collector di node_exporter
+        temporaneo = f"{percorso}.tmp"
+        with open(temporaneo, "w") as f:
+            f.write(self.testo_prometheus())
+        os.replace(temporaneo, percorso)
+
+
+# ENDPOINT HTTP
+def avvia_endpoint(metriche, porta=9108, host=""):
+    class Gestore(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split("?")[0] != "/metrics":
+                self.send_error(404)
+                return
+            corpo = metriche.testo_prometheus().encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+            self.send_header("Content-Length", str(len(corpo)))
+            self.end_headers()
+            self.wfile.write(corpo)
+
+        def log_message(self, formato, *args):
+            log.debug(formato, *args)
+
+    server = ThreadingHTTPServer((host, porta), Gestore)
+    threading.Thread(target=server.serve_forever, name="metriche-http", daemon=True).start()
+    log.info("Metriche Prometheus su http://%s:%d/metrics", host or "0.0.0.0", server.server_address[1])
+    return server
@@ -0,0 +1,186 @@
+import argparse
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from rifornimento import CONFIG
+
+# REPORT OFFLINE
+# Il report di fine corsa su file (PNG/SVG, backend Agg, nessuna finestra), con le serie ridotte a un
+# numero fisso di punti: tempo e memoria del rendering non dipendono da quanti cicli sono stati simulati.
+
+PUNTI_PREDEFINITI = 2000
+
+
+# RIDUZIONE DELLE SERIE
+def lttb(x, y, punti):
+    # Largest-Triangle-Three-Buckets: tiene primo e ultimo punto e, per ogni bucket, il punto che forma il
+    # triangolo più grande con il punto scelto prima e la media del bucket successivo
+    x = np.asarray(x, dtype=float)
+    y = np.asarray(y, dtype=float)
+    n = len(x)
+    if punti >= n or punti < 3:
+        return x, y
+    bordi = np.linspace(1, n - 1, punti - 1).astype(np.intp)
+    scelti = np.empty(punti, dtype=np.intp)
+    scelti[0], scelti[-1] = 0, n - 1
+    a = 0
+    for i in range(punti - 2):
+        inizio, fine = bordi[i], max(bordi[i + 1], bordi[i] + 1)
+        prossimo_fine = bordi[i + 2] if i + 2 < len(bordi) else n
+        mx = x[fine:prossimo_fine].mean() if prossimo_fine > fine else x[-1]
+        my = y[fine:prossimo_fine].mean() if prossimo_fine > fine else y[-1]
+        area = np.abs((x[a] - mx) * (y[inizio:fine] - y[a]) - (x[a] - x[inizio:fine]) * (my - y[a]))
+        a = inizio + int(np.argmax(area))
+        scelti[i + 1] = a
+    return x[scelti], y[scelti]
+
+
+def minmax(x, y, punti):
+    # Per ogni bucket il minimo e il massimo, nell'ordine in cui compaiono: i picchi non si perdono mai
+    x = np.asarray(x, dtype=float)
+    y = np.asarray(y, dtype=float)
+    n = len(x)
+    bucket = max(1, punti // 2)
+    if 2 * bucket >= n:
+        return x, y
+    larghezza = -(-n // bucket)
+    riempiti = np.full(bucket * larghezza, np.nan)
+    riempiti[:n] = y
+    righe = riempiti.reshape(bucket, larghezza)
+    base = np.arange(bucket) * larghezza
+    i_min = base + np.nanargmin(righe, axis=1)
+    i_max = base + np.nanargmax(righe, axis=1)
+    indici = np.unique(np.concatenate((i_min, i_max)))
+    return x[indici], y[indici]
+
+
+def _serie(stats, nome, punti):
+    # Corsa più lunga dello storico degli anelli: si usa la panoramica decimata (media + inviluppo min/max)
+    panoramica = getattr(stats, "panoramica", None)
+    if panoramica is not None and stats.cicli > stats.storico:
+        x, basso, alto, media = panoramica[nome].valori()
+        return {"x": x, "y": media, "min": basso, "max": alto}
+    x = np.asarray(stats['cicli'], dtype=float)
+    y = np.asarray(stats[nome], dtype=float)
+    # I conteggi (fallimenti) conservano i picchi, le grandezze continue la forma
+    x, y = minmax(x, y, punti) if nome == 'fallimenti_raff' else lttb(x, y, punti)
+    return {"x": x, "y": y}
+
+
+def dati_report(stats, punti=PUNTI_PREDEFINITI, titolo="Risultati sperimentali – Active Inference"):
+    # Solo dati ridotti: è questo (non stats) che viaggia verso i processi di rendering
+    nomi = ('efe_medio', 'temp_medie', 'temp_max', 'soc_medio', 'fallimenti_raff', 'p_fail_medio',
+            'var_temp_medio', 'potenza_totale')
+    cicli = getattr(stats, "cicli", None)
+    return {
+        "titolo": titolo,
+        "cicli": cicli if isinstance(cicli, int) else len(stats['cicli']),
+        "serie": {nome: _serie(stats, nome, punti) for nome in nomi},
+        "soglie": {k: CONFIG[k] for k in ("soglia_temp_alta", "soglia_temp_critica", "potenza_massima_stazione")},
+    }
+
+
+# DISEGNO
+def _linea(ax, s, stile, etichetta, colore=None):
+    extra = {"color": colore} if colore is not None else {}
+    linea, = ax.plot(s["x"], s["y"], stile, label=etichetta, **extra)
+    if "min" in s:
+        ax.fill_between(s["x"], s["min"], s["max"], color=linea.get_color(), alpha=0.2, linewidth=0)
+
+
+def disegna_pannelli(fig, dati):
+    serie, soglie = dati["serie"], dati["soglie"]
+    axs = fig.subplots(3, 2)
+    fig.suptitle(f"{dati['titolo']} ({dati['cicli']} cicli)", fontsize=16)
+
+    _linea(axs[0, 0], serie['efe_medio'], 'b-', 'EFE medio')
+    axs[0, 0].set_title("Expected Free Energy medio")
+    axs[0, 0].set_ylabel("EFE")
+
+    _linea(axs[0, 1], serie['temp_medie'], 'r-', 'Temp media')
+    _linea(axs[0, 1], serie['temp_max'], 'r--', 'Temp max')
+    axs[0, 1].axhline(soglie["soglia_temp_alta"], color='orange', ls='--', label='Soglia alta')
+    axs[0, 1].axhline(soglie["soglia_temp_critica"], color='darkred', ls='--', label='Soglia critica')
+    axs[0, 1].set_title("Temperature")
+    axs[0, 1].set_ylabel("°C")
+
+    _linea(axs[1, 0], serie['soc_medio'], 'g-', 'SoC medio')
+    axs[1, 0].set_title("Stato di carica medio")
+    axs[1, 0].set_ylabel("%")
+
+    fallimenti = serie['fallimenti_raff']
+    picchi = fallimenti.get("max", fallimenti["y"])
+    axs[1, 1].vlines(fallimenti["x"], 0, picchi, color='purple', alpha=0.6)
+    axs[1, 1].set_title("Fallimenti raffreddamento per ciclo")
+    axs[1, 1].set_ylabel("N°")
+
+    _linea(axs[2, 0], serie['p_fail_medio'], 'm-', 'p(fail raff) medio')
+    _linea(axs[2, 0], serie['var_temp_medio'], 'c-', 'var_temp media')
+    axs[2, 0].set_title("Evoluzione credenze bayesiane")
+
+    _linea(axs[2, 1], serie['potenza_totale'], '-', 'Potenza totale', colore='darkgreen')
+    axs[2, 1].axhline(soglie["potenza_massima_stazione"], color='red', ls='--', label='Limite')
+    axs[2, 1].set_title("Potenza erogata totale")
+    axs[2, 1].set_ylabel("kW")
+
+    for ax in axs.flat:
+        ax.set_xlabel("Ciclo")
+        ax.grid(True, axis='y' if ax is axs[1, 1] else 'both')
+        if ax is not axs[1, 1]:
+            ax.legend()
+    fig.tight_layout(rect=[0, 0, 1, 0.96])
+    return axs
+
+
+def salva_report(stats_o_dati, percorso, punti=PUNTI_PREDEFINITI, dpi=100):
+    # Figure senza pyplot: nessuno stato globale né backend interattivo, sicuro nei worker.
+    # Il formato viene dall'estensione del file (.png, .svg, .pdf).
+    from matplotlib.figure import Figure
+
+    dati = stats_o_dati if isinstance(stats_o_dati, dict) and "serie" in stats_o_dati else dati_report(stats_o_dati, punti)
+    cartella = os.path.dirname(percorso)
+    if cartella:
+        os.makedirs(cartella, exist_ok=True)
+    fig = Figure(figsize=(15, 12))
+    disegna_pannelli(fig, dati)
+    fig.savefig(percorso, dpi=dpi)
+    return percorso
+
+
+def _rendi(lavoro):
+    dati, percorso = lavoro
+    inizio = time.perf_counter()
+    salva_report(dati, percorso)
+    return percorso, time.perf_counter() - inizio
+
+
+def rendi_report(lavori, max_workers=None):
+    # lavori: [(stats, percorso), ...]; la riduzione avviene qui, ai worker arrivano solo i punti da disegnare
+    lavori = [(dati_report(stats) if not (isinstance(stats, dict) and "serie" in stats) else stats, percorso)
+              for stats, percorso in lavori]
+    if max_workers == 1 or len(lavori) <= 1:
+        return [_rendi(l) for l in lavori]
+    with ProcessPoolExecutor(max_workers=max_workers) as pool:
+        return list(pool.map(_rendi, lavori))
+
+
+if __name__ == "__main__":
+    import logging
+    import rifornimento
+
+    parser = argparse.ArgumentParser(description="Report offline di una corsa headless")
+    parser.add_argument("--colonnine", type=int, default=4)
+    parser.add_argument("--cicli", type=int, default=40)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--out", default="report.png")
+    parser.add_argument("--punti", type=int, default=PUNTI_PREDEFINITI)
+    args = parser.parse_args()
+
+    logging.basicConfig(level="ERROR", format="%(message)s")
+    stats = rifornimento.avvia_headless(args.colonnine, args.cicli, args.seed)
+    inizio = time.perf_counter()
+    salva_report(dati_report(stats, args.punti), args.out)
+    print(f"{args.out} scritto in {time.perf_counter() - inizio:.2f} s")
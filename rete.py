@@ -0,0 +1,237 @@
+import argparse
+import json
+import logging
+import math
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from rifornimento import (
+    OrologioVirtuale,
+    aggiorna_info_globali,
+    applica_potenza,
+    chiudi_ciclo,
+    conta_anomalie,
+    crea_stazione,
+    gestisci_arrivi,
+    leggi_colonnine,
+    nuove_statistiche,
+    registra_statistiche,
+)
+
+log = logging.getLogger("rifornimento.rete")
+
+# RETE DI DISTRIBUZIONE
+# Albero feeder → (trasformatori) → stazione → colonnina. Ogni ciclo le domande salgono dalle stazioni
+# (richieste regolate dopo le decisioni degli agenti), i budget scendono dal feeder e ogni stazione
+# distribuisce il proprio con la stessa politica di Server.distribuisci_potenza.
+
+ESEMPIO = {
+    "nome": "feeder",
+    "potenza_massima": 700,
+    "figli": [
+        {"nome": "trasformatore_A", "potenza_massima": 450, "figli": [
+            {"nome": "stazione_1", "colonnine": 4},
+            {"nome": "stazione_2", "colonnine": 6},
+        ]},
+        {"nome": "trasformatore_B", "potenza_massima": 400, "figli": [
+            {"nome": "stazione_3", "colonnine": 4, "potenza_massima": 250},
+        ]},
+    ],
+}
+
+
+def ripartisci_budget(domande, budget):
+    # Max-min fair (water-filling tra i figli): chi chiede meno del livello d'acqua non viene limitato
+    # (budget inf), gli altri ricevono tutti il livello. La somma consumabile non supera mai il budget.
+    domande = np.asarray(domande, dtype=float)
+    n = len(domande)
+    if not n or domande.sum() <= budget:
+        return np.full(n, math.inf)
+    ordinate = np.sort(domande)
+    precedenti = np.concatenate(([0.0], np.cumsum(ordinate)[:-1]))
+    k = np.flatnonzero(precedenti + ordinate * (n - np.arange(n)) >= budget)[0]
+    livello = (budget - precedenti[k]) / (n - k)
+    return np.where(domande <= livello, math.inf, livello)
+
+
+# NODI
+class NodoStazione:
+    def __init__(self, nome, server, rng):
+        self.nome = nome
+        self.server = server
+        self.rng = rng
+        self.stats = nuove_statistiche()
+        self.counter_anomalie = 0
+        self.domanda = 0.0
+        self.budget = math.inf
+        self.carico = 0.0
+        self._parametri = None
+        self._richieste = None
+
+    def stazioni(self):
+        yield self
+
+    def prepara(self, ciclo):
+        # Fasi locali fino alle richieste regolate: girano in parallelo tra stazioni
+        server = self.server
+        server.cache.nuovo_ciclo(ciclo)
+        gestisci_arrivi(server, self.rng)
+        self._parametri = leggi_colonnine(server)
+        self.counter_anomalie += conta_anomalie(self._parametri)
+        aggiorna_info_globali(server, self._parametri)
+        self._richieste = server.prepara_richieste(self._parametri)
+
+    def aggrega(self):
+        self.domanda = min(self._richieste["domanda"], self.server.potenza_disponibile())
+        return self.domanda
+
+    def ripartisci(self, budget):
+        self.budget = budget
+
+    def assegna(self, ciclo):
+        server = self.server
+        out = server.assegna_potenza(self._parametri, self._richieste, self.budget)
+        applica_potenza(server, out)
+        registra_statistiche(self.stats, server, ciclo, out, self.counter_anomalie)
+        chiudi_ciclo(server, ciclo, out)
+        self.carico = sum(p.get("potenza_effettiva", 0) for p in out)
+        return self.carico
+
+
+class NodoRete:
+    def __init__(self, nome, potenza_massima=None, figli=()):
+        self.nome = nome
+        self.potenza_massima = potenza_massima if potenza_massima is not None else math.inf
+        self.figli = list(figli)
+        self.domanda = 0.0
+        self.carico = 0.0
+        self.picco = 0.0
+        self.superamenti = 0
+        self.ricalcoli = 0
+        self.riusi = 0
+        self._memo = (None, None)
+
+    def stazioni(self):
+        for figlio in self.figli:
+            yield from figlio.stazioni()
+
+    def aggrega(self):
+        self.domanda = min(sum(f.aggrega() for f in self.figli), self.potenza_massima)
+        return self.domanda
+
+    def ripartisci(self, budget=math.inf):
+        budget = min(budget, self.potenza_massima)
+        # Sottoalbero pulito: stesse domande dei figli e stesso budget del ciclo scorso → stessa ripartizione
+        chiave = (budget, tuple(f.domanda for f in self.figli))
+        chiave_prec, budget_figli = self._memo
+        if chiave == chiave_prec:
+            self.riusi += 1
+        else:
+            self.ricalcoli += 1
+            budget_figli = ripartisci_budget(chiave[1], budget)
+            self._memo = (chiave, budget_figli)
+        for figlio, b in zip(self.figli, budget_figli.tolist()):
+            figlio.ripartisci(b)
+
+    def consuntivo(self):
+        self.carico = sum(f.consuntivo() if isinstance(f, NodoRete) else f.carico for f in self.figli)
+        self.picco = max(self.picco, self.carico)
+        # Tolleranza per gli arrotondamenti a 0.1 kW: fino a 0.05 kW per ogni colonnina del sottoalbero
+        tolleranza = 0.05 * sum(len(s.server.registro) for s in self.stazioni())
+        if self.carico > self.potenza_massima + tolleranza:
+            self.superamenti += 1
+            log.warning("Nodo %s oltre il limite: %.1f / %.1f kW", self.nome, self.carico, self.potenza_massima)
+        return self.carico
+
+    def nodi(self):
+        yield self
+        for figlio in self.figli:
+            if isinstance(figlio, NodoRete):
+                yield from figlio.nodi()
+
+
+def costruisci_rete(struttura, seed=42):
+    # Ogni stazione riceve un proprio SeedSequence, in ordine di visita dell'albero
+    def conta(nodo):
+        return sum(conta(f) for f in nodo["figli"]) if "figli" in nodo else 1
+
+    semi = iter(np.random.SeedSequence(seed).spawn(conta(struttura)))
+
+    def costruisci(nodo):
+        if "figli" in nodo:
+            return NodoRete(nodo["nome"], nodo.get("potenza_massima"), [costruisci(f) for f in nodo["figli"]])
+        server, rng = crea_stazione(nodo.get("colonnine", 4), next(semi))
+        server.potenza_massima = nodo.get("potenza_massima")
+        return NodoStazione(nodo["nome"], server, rng)
+
+    radice = costruisci(struttura)
+    return radice if isinstance(radice, NodoRete) else NodoRete("rete", None, [radice])
+
+
+# RETE
+class Rete:
+    def __init__(self, radice, max_workers=None):
+        self.radice = radice
+        self.stazioni = list(radice.stazioni())
+        # max_workers=1: stesse fasi, eseguite in serie sul thread chiamante
+        self.executor = ThreadPoolExecutor(max_workers, thread_name_prefix="stazione") if max_workers != 1 else None
+
+    def _per_stazione(self, funzione, ciclo):
+        if self.executor is None:
+            return [funzione(s, ciclo) for s in self.stazioni]
+        return list(self.executor.map(lambda s: funzione(s, ciclo), self.stazioni))
+
+    def tick(self, ciclo):
+        self._per_stazione(NodoStazione.prepara, ciclo)
+        self.radice.aggrega()
+        self.radice.ripartisci()
+        self._per_stazione(NodoStazione.assegna, ciclo)
+        return self.radice.consuntivo()
+
+    def chiudi(self):
+        if self.executor is not None:
+            self.executor.shutdown(wait=True)
+
+    def riepilogo(self):
+        return {
+            "nodi": {n.nome: {"potenza_massima": n.potenza_massima, "picco_kw": round(n.picco, 1),
+                              "superamenti": n.superamenti, "ricalcoli": n.ricalcoli, "riusi": n.riusi}
+                     for n in self.radice.nodi()},
+            "stazioni": {s.nome: {"potenza_media": s.stats.aggregato('potenza_totale').media,
+                                  "potenza_max": s.stats.aggregato('potenza_totale').massimo,
+                                  "allocazioni_riusate": s.server.allocazioni_riusate}
+                         for s in self.stazioni},
+        }
+
+
+def avvia_rete(struttura=ESEMPIO, cicli=40, seed=42, max_workers=None, orologio=None):
+    orologio = orologio if orologio is not None else OrologioVirtuale()
+    rete = Rete(costruisci_rete(struttura, seed), max_workers)
+    try:
+        for ciclo in range(1, cicli + 1):
+            log.info("\n --- CICLO %d/%d ---", ciclo, cicli)
+            carico = rete.tick(ciclo)
+            log.info(" Carico feeder: %.1f kW", carico)
+            orologio.attendi()
+    finally:
+        rete.chiudi()
+    return rete
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Più stazioni dietro un feeder condiviso")
+    parser.add_argument("--struttura", default=None, help="file JSON con l'albero feeder/stazioni")
+    parser.add_argument("--cicli", type=int, default=40)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--log", default="WARNING")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=args.log.upper(), format="%(message)s")
+    struttura = ESEMPIO
+    if args.struttura:
+        with open(args.struttura) as f:
+            struttura = json.load(f)
+    rete = avvia_rete(struttura, args.cicli, args.seed, args.workers)
+    print(json.dumps(rete.riepilogo(), indent=2, ensure_ascii=False))
@@ -1,729 +1,1385 @@
-import random
-import time
-import json
-import paho.mqtt.client as mqtt  
-import math
-import numpy as np
-from scipy.stats import entropy, norm
-import matplotlib.pyplot as plt
-from collections import defaultdict
-
-# SISTEMA DI AUTENTICAZIONE
-UTENTI = {
-    "admin": "1234",
-    "tecnico": "password",
-    "ospite": "guest"
-}
-
-def login():
-    print(" ACCESSO SICURO ALLA STAZIONE DI RICARICA")
-    tentativi = 3
-    while tentativi > 0:
-        user = input("Username: ").strip()
-        pwd = input("Password: ").strip()
-        if user in UTENTI and UTENTI[user] == pwd:
-            print("\n Accesso consentito. Benvenuto,", user, "\n")
-            return True
-        tentativi -= 1
-        print(f" Credenziali errate. Tentativi rimasti: {tentativi}")
-    print(" Troppi tentativi falliti. Uscita dal sistema.\n")
-    exit()
-
-# CONFIGURAZIONE STAZIONE
-CONFIG = {
-    "max_potenza": 150,
-    "soglia_temp_alta": 55,
-    "soglia_temp_critica": 70,
-    "soglia_degrado": 90,
-    "modalita": "Standard",
-    "potenza_massima_stazione": 300,
-    "percentuale_riduzione_temp_alta": 0.30,   # ← MODIFICATO (era 0.5)
-    "min_power_for_active": 0.5,               # ← MODIFICATO (era 1.0) → ora vede potenza
-    "cicli_attesa_blocco": 1,
-    "max_raffreddamenti_per_ciclo": 2,
-    "prob_fail_raffreddamento_locale": 0.06,
-    "prob_fail_raffreddamento_centrale": 0.04,
-    "soglia_fail_consecutivi_blocco": 3,
-    "aumento_temp_fail_raff": 3.5,
-}
-
-VEICOLI = {
-    "CityCar": {"batteria": 40, "max_potenza": 50},
-    "SUV": {"batteria": 80, "max_potenza": 120},
-    "Sportiva": {"batteria": 100, "max_potenza": 150}
-}
-
-# SENSORI
-class Sensore:
-    def __init__(self, tipo):
-        self.tipo = tipo
-
-    def rileva(self):
-        if self.tipo == "temperatura":
-            if random.random() < 0.1:
-                return round(random.uniform(50, 90), 1)
-            return round(random.uniform(20, 40), 1)
-        elif self.tipo == "temperatura_esterna":
-            return round(random.uniform(10, 45), 1)
-        elif self.tipo == "degrado":
-            return round(random.uniform(5, 15), 1)
-        elif self.tipo == "tensione":
-            return round(random.uniform(350, 800), 1)
-        return 0.0
-
-# AGENTE LOCALE
-class AgenteLocale:
-    def __init__(self, colonnina):
-        self.colonnina = colonnina
-        self.isteresi_raff_locale = 3.0
-        self.ultima_temp_vista = 25.0
-        self.voto_centrale_ultimo = 0.0
-        self.beliefs = {
-            'p_fail_raff_locale': CONFIG["prob_fail_raffreddamento_locale"],
-            'p_fail_raff_centrale': CONFIG["prob_fail_raffreddamento_centrale"],
-            'var_temp': 5.0
-        }
-
-    def genera_politiche(self):
-        return [
-            {'raff_locale': True,  'downgrade': False, 'rid_pot': 0.0},
-            {'raff_locale': False, 'downgrade': True,  'rid_pot': 0.3},
-            {'raff_locale': True,  'downgrade': True,  'rid_pot': 0.1},
-            {'raff_locale': False, 'downgrade': False, 'rid_pot': 0.0}
-        ]
-
-    def calcola_efe(self, politica, stato_attuale, orizzonte=3):
-        efe = 0.0
-        for t in range(orizzonte):
-            samples = []
-            for _ in range(50):
-                temp_futura = stato_attuale['temperatura'] + np.random.normal(5, self.beliefs['var_temp'])
-                if politica['raff_locale']:
-                    if np.random.rand() < self.beliefs['p_fail_raff_locale']:
-                        temp_futura += CONFIG['aumento_temp_fail_raff']
-                    else:
-                        temp_futura -= 10.0
-                if politica['downgrade']:
-                    temp_futura -= 2.0
-                soc_futura = stato_attuale['soc'] + (stato_attuale.get('potenza_effettiva', 0) * (1 - politica['rid_pot']) / 60)
-                samples.append({'temp': temp_futura, 'soc': soc_futura})
-
-            temps = [s['temp'] for s in samples]
-            mean_temp = np.mean(temps)
-            var_temp = np.var(temps)
-            mean_soc = np.mean([s['soc'] for s in samples])
-
-            pref_dist_temp = norm(loc=40, scale=5)
-            sim_dist_temp = norm(loc=mean_temp, scale=np.sqrt(var_temp))
-            kl_prag_temp = self.kl_divergence(sim_dist_temp, pref_dist_temp)
-            kl_prag_soc = abs(mean_soc - 100) * 0.1
-            kl_prag = kl_prag_temp + kl_prag_soc
-
-            hist, _ = np.histogram(temps, bins=10)
-            hist = hist / hist.sum() if hist.sum() > 0 else hist
-            ent_epist = entropy(hist)
-
-            efe += kl_prag + ent_epist
-
-        return efe
-
-    def kl_divergence(self, p, q, num_samples=1000):
-        samples = p.rvs(num_samples)
-        log_ratios = np.log(p.pdf(samples) / q.pdf(samples))
-        finite = log_ratios[np.isfinite(log_ratios)]
-        return np.mean(finite) if len(finite) > 0 else 0.0
-
-    def aggiorna_beliefs(self, fallito, tipo_raff):
-        key = 'p_fail_raff_locale' if tipo_raff == 'locale' else 'p_fail_raff_centrale'
-        prior_alpha, prior_beta = 1, 19
-        old_p = self.beliefs[key]
-        if fallito:
-            self.beliefs[key] = (old_p * (prior_alpha + prior_beta) + 1) / (prior_alpha + prior_beta + 1)
-        else:
-            self.beliefs[key] = (old_p * (prior_alpha + prior_beta)) / (prior_alpha + prior_beta + 1)
-        self.beliefs['var_temp'] = max(1.0, self.beliefs['var_temp'] * (1.1 if fallito else 0.9))
-
-    def decide(self, info_globali=None):
-        p = self.colonnina.leggi_parametri()
-        if info_globali:
-            p.update(info_globali)
-
-        temp = p["temperatura"]
-        stato_attuale = {
-            'temperatura': temp,
-            'soc': p['soc'],
-            'potenza_effettiva': p.get("potenza_effettiva", 0)
-        }
-
-        politiche = self.genera_politiche()
-        efe_values = [self.calcola_efe(pol, stato_attuale) for pol in politiche]
-        best_idx = np.argmin(efe_values)
-        best_pol = politiche[best_idx]
-        min_efe = efe_values[best_idx]
-
-        if self.colonnina.modalita == "Eco":
-            best_pol['downgrade'] = False
-
-        locale_richiesto = best_pol['raff_locale']
-        downgrade_req = best_pol['downgrade']
-
-        voto = 0.35 if temp > CONFIG["soglia_temp_alta"] else 0.0
-        if p.get("quante_altre_calda", 0) >= 2:
-            voto += 0.25
-        voto = min(1.0, voto)
-
-        motiv = f"Temp {temp:.1f}°C | EFE min {min_efe:.2f} | Politica: {best_pol}"
-        if locale_richiesto:
-            motiv += " → RAFF. LOCALE"
-
-        self.ultima_temp_vista = temp
-        self.voto_centrale_ultimo = voto
-
-        return {
-            "raffreddamento_locale_richiesto": locale_richiesto,
-            "voto_raffreddamento_centrale": round(voto, 2),
-            "downgrade_modalita_richiesto": downgrade_req,
-            "rid_pot_richiesta": best_pol['rid_pot'],
-            "motivazione_agente": motiv,
-            "temp": temp,
-            "anomalia": p["anomalia"],
-            "min_efe": min_efe
-        }
-
-# COLONNINA
-class Colonnina:
-    def __init__(self, id):
-        self.id = id
-        self.veicolo = None
-        self.capacita = None
-        self.soc_kwh = 0.0
-        self.carica_attiva = False
-        self.stato = "LIBERA"
-        self.modalita = "Standard"
-
-        self.s_temp = Sensore("temperatura")
-        self.s_temp_ext = Sensore("temperatura_esterna")
-        self.s_deg = Sensore("degrado")
-        self.s_tens = Sensore("tensione")
-
-        self.raffreddamento_attivo = False
-        self.fail_raff_consecutivi = 0
-        self.stato_raff_fallito = False
-        self.ultimo_raff_usato = None
-        self.agente = AgenteLocale(self)
-
-    def reset_raff_fail(self):
-        self.fail_raff_consecutivi = 0
-        self.stato_raff_fallito = False
-
-    def applica_raffreddamento(self, centrale_attivo: bool, locale_attivo: bool) -> bool:
-        raff_attivato = centrale_attivo or locale_attivo
-        self.ultimo_raff_usato = "centrale" if centrale_attivo else ("locale" if locale_attivo else None)
-        self.raffreddamento_attivo = raff_attivato
-
-        if not raff_attivato:
-            self.reset_raff_fail()
-            return False
-
-        prob_fail = CONFIG["prob_fail_raffreddamento_locale"]
-
-        fallito = random.random() < prob_fail
-        if fallito:
-            self.fail_raff_consecutivi += 1
-            self.stato_raff_fallito = True
-
-            if self.fail_raff_consecutivi >= CONFIG["soglia_fail_consecutivi_blocco"]:
-                self.stato = "BLOCCATA_RAFF_FALLITO"
-                self.carica_attiva = False
-                print(f"!!! COLONNINA {self.id} → BLOCCATA (raffreddamento fallito {self.fail_raff_consecutivi} volte consecutive)")
-                self.agente.aggiorna_beliefs(fallito, self.ultimo_raff_usato)
-                return True
-
-            print(f"  Colonnina {self.id}: raffreddamento ({self.ultimo_raff_usato}) FALLITO ({self.fail_raff_consecutivi})")
-            self.agente.aggiorna_beliefs(fallito, self.ultimo_raff_usato)
-            return False
-
-        self.reset_raff_fail()
-        self.agente.aggiorna_beliefs(fallito, self.ultimo_raff_usato)
-        return False
-
-    def assegna_auto(self):
-        self.veicolo = random.choice(list(VEICOLI.keys()))
-        self.capacita = VEICOLI[self.veicolo]["batteria"]
-        self.soc_kwh = random.uniform(5, 0.25 * self.capacita)   # ← MODIFICATO (SoC più basso)
-        self.carica_attiva = True
-        self.stato = "OCCUPATA"
-        self.raffreddamento_attivo = False
-        self.reset_raff_fail()
-        self.modalita = random.choice(["Eco", "Standard", "Boost"])
-        print(f" Nuova auto ({self.veicolo}) sulla colonnina {self.id}")
-
-    def aggiorna_soc(self, potenza_effettiva: float):
-        if not self.carica_attiva or self.stato.startswith("BLOCCATA"):
-            return
-        self.soc_kwh = min(self.capacita, self.soc_kwh + (potenza_effettiva / 60.0))
-        if self.soc_kwh >= self.capacita * 0.98:
-            self.stato = "COMPLETATA"
-            self.carica_attiva = False
-            print(f" Colonnina {self.id}: ricarica completata. Auto in partenza.")
-
-    def soc_percento(self) -> float:
-        if not self.veicolo or self.capacita is None:
-            return 0.0
-        return round((self.soc_kwh / self.capacita) * 100, 1)
-
-    def leggi_parametri(self) -> dict:
-        t_esterna = self.s_temp_ext.rileva()
-        t_reale_sensore = self.s_temp.rileva()
-
-        if self.stato.startswith("BLOCCATA"):
-            potenza_teorica = 0.0
-            temp_predetta = t_esterna + 1.0
-            inc_teorico = 0
-        else:
-            if self.stato == "OCCUPATA":
-                max_p = VEICOLI[self.veicolo]["max_potenza"]
-                potenza_teorica = random.uniform(max_p * 0.5, max_p)
-                inc_teorico = (potenza_teorica / 10.0) * 2.0
-                if self.raffreddamento_attivo:
-                    inc_teorico *= 0.6
-                temp_predetta = t_esterna + inc_teorico
-            else:
-                potenza_teorica = 0
-                temp_predetta = t_esterna + 1.0
-                inc_teorico = 0
-
-        gap = abs(t_reale_sensore - temp_predetta)
-        soglia_anomalia = 15.0
-        soglia_media_pericolosa = 45.0
-        media_temp = (t_reale_sensore + temp_predetta) / 2
-
-        anomalia = gap > soglia_anomalia
-        anomalia_pericolosa = anomalia and (media_temp > soglia_media_pericolosa)
-
-        diagnostica = "OK"
-        if anomalia:
-            diagnostica = f"ANOMALIA SENSORE: gap {gap:.1f}°C"
-            if anomalia_pericolosa:
-                diagnostica += f" – MEDIA ALTA {media_temp:.1f}°C → ATTENZIONE!"
-
-        if self.stato_raff_fallito and self.raffreddamento_attivo:
-            diagnostica += " – RAFF. FALLITO QUESTO CICLO"
-
-        temperatura_output = max(t_reale_sensore, temp_predetta) if anomalia else t_reale_sensore
-
-        if self.stato.startswith("BLOCCATA"):
-            temperatura_output = max(temperatura_output, 75.0)
-            diagnostica += " – COLONNINA BLOCCATA (guasto raffreddamento)"
-
-        dati = {
-            "id": self.id,
-            "veicolo": self.veicolo if self.stato == "OCCUPATA" else None,
-            "stato": self.stato,
-            "soc": self.soc_percento(),
-            "temperatura": round(temperatura_output, 1),
-            "temperatura_esterna": t_esterna,
-            "temperatura_predetta": round(temp_predetta, 1),
-            "temperatura_reale_grezzo": round(t_reale_sensore, 1),
-            "gap_rilevato": round(gap, 1),
-            "anomalia": anomalia,
-            "anomalia_pericolosa": anomalia_pericolosa,
-            "media_temperatura": round(media_temp, 1),
-            "diagnostica": diagnostica,
-            "degrado": self.s_deg.rileva(),
-            "tensione": self.s_tens.rileva(),
-            "potenza_richiesta": round(potenza_teorica, 1),
-            "raffreddamento_attivo": self.raffreddamento_attivo,
-            "fail_raff_consecutivi": self.fail_raff_consecutivi,
-            "modalita": self.modalita,
-        }
-
-        if self.stato.startswith("BLOCCATA"):
-            dati["alert"] = "COLONNINA BLOCCATA – guasto raffreddamento ripetuto"
-        elif self.stato_raff_fallito:
-            dati["alert"] = "Raffreddamento fallito questo ciclo"
-
-        return dati
-
-# SERVER
-class Server:
-    def __init__(self):
-        self.quante_colonnine_calide = 0
-        self.media_voti_centrali = 0.0
-
-    def distribuisci_potenza(self, lista_parametri):
-        richieste_raff_locali = []
-        richieste_downgrade = []
-
-        for p in lista_parametri:
-            if p.get("stato") != "OCCUPATA":
-                continue
-
-            col = next((c for c in colonnine if c.id == p["id"]), None)
-            if not col:
-                continue
-
-            decisione = col.agente.decide({
-                "quante_altre_calda": self.quante_colonnine_calide,
-                "media_voti_centrali": self.media_voti_centrali
-            })
-            p["agente"] = decisione
-
-            if decisione.get("raffreddamento_locale_richiesto"):
-                richieste_raff_locali.append((p["id"], decisione["min_efe"], p))
-
-            if decisione.get("downgrade_modalita_richiesto"):
-                richieste_downgrade.append((p["id"], decisione["min_efe"], p))
-
-        richieste_raff_locali.sort(key=lambda x: x[1])
-
-        max_raff_locali_approvabili = CONFIG["max_raffreddamenti_per_ciclo"]
-        approvati = 0
-        for _, _, p in richieste_raff_locali:
-            if approvati >= max_raff_locali_approvabili:
-                break
-            p["raffreddamento_locale_attivo"] = True
-            approvati += 1
-            p.setdefault("azioni", []).append(f"RAFF. LOCALE APPROVATO (priorità {approvati})")
-
-        for p in lista_parametri:
-            if p.get("stato") != "OCCUPATA":
-                continue
-
-            col = next((c for c in colonnine if c.id == p["id"]), None)
-            if not col:
-                continue
-
-            centrale = False
-            locale = p.get("raffreddamento_locale_attivo", False)
-
-            bloccata = col.applica_raffreddamento(centrale, locale)
-            if bloccata:
-                p["stato"] = col.stato
-
-        richieste_downgrade.sort(key=lambda x: x[1])
-        num_downgrade = 0
-        for _, _, p in richieste_downgrade:
-            if num_downgrade >= 1:
-                break
-            curr = p.get("modalita_effettiva", p.get("modalita", CONFIG["modalita"]))
-            if curr == "Boost":
-                p["modalita_effettiva"] = "Eco"
-                p.setdefault("azioni", []).append("DOWNGRADE: Boost → Eco")
-                num_downgrade += 1
-
-        dati = [dict(p) for p in lista_parametri if p.get("stato") == "OCCUPATA"]
-        totale_richiesto = 0.0
-
-        for p in dati:
-            req = p.get("potenza_richiesta", 0)
-            veicolo = p.get("veicolo")
-            modalita = p.get("modalita_effettiva", p.get("modalita", CONFIG["modalita"]))
-
-            if modalita == "Eco":
-                req *= 0.75
-            elif modalita == "Boost":
-                req *= 1.2
-
-            if veicolo:
-                req = min(req, VEICOLI[veicolo]["max_potenza"])
-            req = min(req, CONFIG["max_potenza"])
-
-            req *= (1 - p["agente"].get("rid_pot_richiesta", 0.0))
-
-            p["richiesta_adjusted"] = round(req, 1)
-            totale_richiesto += req
-
-        potenza_disponibile = CONFIG["potenza_massima_stazione"]
-        assegnazioni = {p["id"]: 0.0 for p in dati}
-
-        for p in dati:
-            idc = p["id"]
-            if p["stato"] == "BLOCCATA_RAFF_FALLITO":
-                assegnazioni[idc] = 0.0
-                p.setdefault("azioni", []).append("FERMA: BLOCCATA RAFF FALLITO")
-            elif p["temperatura"] > CONFIG["soglia_temp_critica"]:
-                assegnazioni[idc] = 0.0
-                p.setdefault("azioni", []).append("FERMA: Temp Critica")
-            elif p.get("degrado", 0) > CONFIG["soglia_degrado"]:
-                assegnazioni[idc] = 0.0
-                p.setdefault("azioni", []).append("FERMA: Degrado Alto")
-                
-        attive = [p for p in dati if assegnazioni[p["id"]] == 0.0]   # ← MODIFICATO (era != 0.0)
-
-        if not attive:
-            out = []
-            for p in lista_parametri:
-                if p.get("stato") != "OCCUPATA":
-                    p["azioni"], p["potenza_effettiva"] = ["LIBERA"], 0
-                else:
-                    p["azioni"], p["potenza_effettiva"] = ["FERMA: Critico o BLOCCATA"], 0
-                out.append(p)
-            return out
-
-        attive_sorted = sorted(attive, key=lambda x: x.get("soc", 100.0))
-
-        totale_attive_richieste = sum(p["richiesta_adjusted"] for p in attive_sorted)
-
-        if totale_attive_richieste <= potenza_disponibile:
-            for p in attive_sorted:
-                idc = p["id"]
-                alloc = p["richiesta_adjusted"]
-                if p["temperatura"] > CONFIG["soglia_temp_alta"] and p["temperatura"] <= CONFIG["soglia_temp_critica"]:
-                    alloc *= (1 - CONFIG["percentuale_riduzione_temp_alta"])
-                    p.setdefault("azioni", []).append(f"RIDUCI: Temp Alta (-{int(CONFIG['percentuale_riduzione_temp_alta']*100)}%)")
-                else:
-                    p.setdefault("azioni", []).append("OK")
-                assegnazioni[idc] = round(max(0, alloc), 1)
-        else:
-            restante = potenza_disponibile
-            for p in attive_sorted:
-                idc = p["id"]
-                richi = p["richiesta_adjusted"]
-                riduzione = 1.0
-                if p["temperatura"] > CONFIG["soglia_temp_alta"] and p["temperatura"] <= CONFIG["soglia_temp_critica"]:
-                    riduzione = (1 - CONFIG["percentuale_riduzione_temp_alta"])
-                    p.setdefault("azioni", []).append(f"RIDUCI: Temp Alta (-{int(CONFIG['percentuale_riduzione_temp_alta']*100)}%)")
-
-                richi_mod = richi * riduzione
-                asseg = min(richi_mod, restante)
-
-                if restante <= 0 or asseg < CONFIG["min_power_for_active"]:
-                    assegnazioni[idc] = 0.0
-                    p.setdefault("azioni", []).append("RIPOSO: Potenza Non Disponibile")
-                else:
-                    assegnazioni[idc] = round(max(0.0, asseg), 1)
-                    p.setdefault("azioni", []).append("OK (Priorità SOC bassa)")
-                    restante -= assegnazioni[idc]
-
-            if restante > 0:
-                for p in attive_sorted:
-                    idc = p["id"]
-                    richi = p["richiesta_adjusted"]
-                    current = assegnazioni[idc]
-                    max_add = max(0.0, richi - current)
-                    if max_add <= 0:
-                        continue
-                    add = min(max_add, restante)
-                    assegnazioni[idc] = round(current + add, 1)
-                    restante -= add
-                    if restante <= 0:
-                        break
-
-        out = []
-        for p in lista_parametri:
-            if p.get("stato") != "OCCUPATA":
-                p["azioni"], p["potenza_effettiva"] = ["LIBERA"], 0
-            else:
-                pid = p["id"]
-                pot_eff = assegnazioni.get(pid, 0.0)
-                pot_eff = round(max(0.0, min(pot_eff, CONFIG["max_potenza"])), 1)
-                p["potenza_effettiva"] = pot_eff
-                if "azioni" not in p or not p["azioni"]:
-                    p["azioni"] = ["OK"]
-            out.append(p)
-
-        return out
-
-    def analizza_stazione(self, parametri_con_potenza):
-        totale_kw = sum(p.get("potenza_effettiva", 0) for p in parametri_con_potenza)
-        alert = None
-        num_critiche = sum(1 for p in parametri_con_potenza if p.get("temperatura", 0) > CONFIG["soglia_temp_critica"])
-        num_bloccate = sum(1 for p in parametri_con_potenza if p.get("stato", "").startswith("BLOCCATA"))
-        if num_critiche > 0:
-            alert = f"ATTENZIONE: {num_critiche} colonnine con temperatura critica!"
-        elif num_bloccate > 0:
-            alert = f"ATTENZIONE: {num_bloccate} colonnine bloccate per guasto raffreddamento!"
-        return alert, round(totale_kw, 1)
-
-def avvia_stazione(num_colonnine=4):
-    global colonnine
-    colonnine = [Colonnina(id=i+1) for i in range(num_colonnine)]
-    server = Server()
-
-    stats = {
-        'cicli': [],
-        'efe_medio': [],
-        'temp_medie': [],
-        'temp_max': [],
-        'soc_medio': [],
-        'fallimenti_raff': [],
-        'p_fail_medio': [],
-        'var_temp_medio': [],
-        'potenza_totale': [],
-        'anomalie': [],
-        'raffinamenti_locali': []
-    }
-
-    print(f"\n Avvio simulazione ACTIVE INFERENCE per {40} cicli. {num_colonnine} colonnine.")
-
-    counter_anomalie = 0
-    cicli_simulati = 40
-
-    random.seed(42)
-    np.random.seed(42)
-
-    for ciclo in range(cicli_simulati):
-        print(f"\n --- CICLO {ciclo + 1}/{cicli_simulati} ---")
-
-        parametri_lista = []
-
-        for col in colonnine:
-            if col.stato == "LIBERA":
-                if random.random() < 0.4:
-                    col.assegna_auto()
-                else:
-                    parametri_lista.append(col.leggi_parametri())
-                    continue
-
-            if col.stato == "COMPLETATA":
-                print(f" Colonnina {col.id} è stata liberata.")
-                col.stato = "LIBERA"
-                col.veicolo = None
-                col.raffreddamento_attivo = False
-                col.reset_raff_fail()
-                parametri_lista.append(col.leggi_parametri())
-                continue
-
-            p = col.leggi_parametri()
-            parametri_lista.append(p)
-
-            if p.get("anomalia"):
-                counter_anomalie += 1
-
-        server.quante_colonnine_calide = sum(1 for p in parametri_lista if p.get("temperatura", 0) > CONFIG["soglia_temp_alta"] and p.get("stato") == "OCCUPATA")
-        voti_centrali = [col.agente.voto_centrale_ultimo for col in colonnine if col.stato == "OCCUPATA"]
-        server.media_voti_centrali = sum(voti_centrali) / len(voti_centrali) if voti_centrali else 0.0
-
-        parametri_con_potenza = server.distribuisci_potenza(parametri_lista)
-
-        for p in parametri_con_potenza:
-            if p.get("stato") == "OCCUPATA":
-                col = next((c for c in colonnine if c.id == p["id"]), None)
-                if col:
-                    col.aggiorna_soc(p.get("potenza_effettiva", 0))
-
-        # Raccolta statistiche
-        efe_values_this_cycle = []
-        temps_this_cycle = []
-        socs_this_cycle = []
-        fallimenti_this_cycle = 0
-        p_fails = []
-        var_temps = []
-
-        for col in colonnine:
-            if col.stato != "OCCUPATA":
-                continue
-            p = col.leggi_parametri()
-            decisione = col.agente.decide({
-                "quante_altre_calda": server.quante_colonnine_calide,
-                "media_voti_centrali": server.media_voti_centrali
-            })
-            if "min_efe" in decisione:
-                efe_values_this_cycle.append(decisione["min_efe"])
-            temps_this_cycle.append(p["temperatura"])
-            socs_this_cycle.append(col.soc_percento())
-            if col.stato_raff_fallito:
-                fallimenti_this_cycle += 1
-            p_fails.append(col.agente.beliefs['p_fail_raff_locale'])
-            var_temps.append(col.agente.beliefs['var_temp'])
-
-        stats['cicli'].append(ciclo + 1)
-        stats['efe_medio'].append(np.mean(efe_values_this_cycle) if efe_values_this_cycle else 0)
-        stats['temp_medie'].append(np.mean(temps_this_cycle) if temps_this_cycle else 0)
-        stats['temp_max'].append(max(temps_this_cycle) if temps_this_cycle else 0)
-        stats['soc_medio'].append(np.mean(socs_this_cycle) if socs_this_cycle else 0)
-        stats['fallimenti_raff'].append(fallimenti_this_cycle)
-        stats['p_fail_medio'].append(np.mean(p_fails) if p_fails else 0)
-        stats['var_temp_medio'].append(np.mean(var_temps) if var_temps else 0)
-        stats['anomalie'].append(counter_anomalie)
-
-        totale_kw = sum(p.get("potenza_effettiva", 0) for p in parametri_con_potenza)
-        stats['potenza_totale'].append(totale_kw)
-
-        num_raff_locali = sum(1 for p in parametri_con_potenza if p.get("raffreddamento_locale_attivo", False))
-        stats['raffinamenti_locali'].append(num_raff_locali)
-
-        for p in parametri_con_potenza:
-            if p.get("stato") == "OCCUPATA":
-                print(f" Col. {p['id']}: SoC {p['soc']}% | Pot. {p.get('potenza_effettiva',0):.1f} kW | Temp {p.get('temperatura','?')}°C")
-
-        alert, totale_carica = server.analizza_stazione(parametri_con_potenza)
-        if alert:
-            print(f" ALERT: {alert}")
-        print(f" Totale Carica Stazione: {totale_carica} kW")
-
-        time.sleep(0.5)
-
-    # REPORT + GRAFICI
-    print("\n" + "="*80)
-    print(" RISULTATI SPERIMENTALI – ACTIVE INFERENCE")
-    print("="*80)
-    print(f"Durata: {cicli_simulati} cicli")
-    print(f"Anomalie sensore totali: {counter_anomalie}")
-    print(f"Fallimenti raffreddamento totali: {sum(stats['fallimenti_raff'])}")
-    print(f"Credenza media finale p(fail raff. locale): {stats['p_fail_medio'][-1]:.3f}")
-    print(f"Media potenza erogata: {np.mean(stats['potenza_totale']):.1f} kW")
-    print(f"Massima temperatura osservata: {max(stats['temp_max']):.1f} °C")
-
-    fig, axs = plt.subplots(3, 2, figsize=(15, 12))
-    fig.suptitle("Risultati sperimentali – Active Inference", fontsize=16)
-
-    axs[0,0].plot(stats['cicli'], stats['efe_medio'], 'b-', label='EFE medio')
-    axs[0,0].set_title("Expected Free Energy medio")
-    axs[0,0].set_xlabel("Ciclo")
-    axs[0,0].set_ylabel("EFE")
-    axs[0,0].grid(True)
-    axs[0,0].legend()
-
-    axs[0,1].plot(stats['cicli'], stats['temp_medie'], 'r-', label='Temp media')
-    axs[0,1].plot(stats['cicli'], stats['temp_max'],   'r--', label='Temp max')
-    axs[0,1].axhline(CONFIG["soglia_temp_alta"], color='orange', ls='--', label='Soglia alta')
-    axs[0,1].axhline(CONFIG["soglia_temp_critica"], color='darkred', ls='--', label='Soglia critica')
-    axs[0,1].set_title("Temperature")
-    axs[0,1].set_xlabel("Ciclo")
-    axs[0,1].set_ylabel("°C")
-    axs[0,1].grid(True)
-    axs[0,1].legend()
-
-    axs[1,0].plot(stats['cicli'], stats['soc_medio'], 'g-', label='SoC medio')
-    axs[1,0].set_title("Stato di carica medio")
-    axs[1,0].set_xlabel("Ciclo")
-    axs[1,0].set_ylabel("%")
-    axs[1,0].grid(True)
-    axs[1,0].legend()
-
-    axs[1,1].bar(stats['cicli'], stats['fallimenti_raff'], color='purple', alpha=0.6)
-    axs[1,1].set_title("Fallimenti raffreddamento per ciclo")
-    axs[1,1].set_xlabel("Ciclo")
-    axs[1,1].set_ylabel("N°")
-    axs[1,1].grid(True, axis='y')
-
-    axs[2,0].plot(stats['cicli'], stats['p_fail_medio'], 'm-', label='p(fail raff) medio')
-    axs[2,0].plot(stats['cicli'], stats['var_temp_medio'], 'c-', label='var_temp media')
-    axs[2,0].set_title("Evoluzione credenze bayesiane")
-    axs[2,0].set_xlabel("Ciclo")
-    axs[2,0].grid(True)
-    axs[2,0].legend()
-
-    axs[2,1].plot(stats['cicli'], stats['potenza_totale'], 'darkgreen', label='Potenza totale')
-    axs[2,1].axhline(CONFIG["potenza_massima_stazione"], color='red', ls='--', label='Limite')
-    axs[2,1].set_title("Potenza erogata totale")
-    axs[2,1].set_xlabel("Ciclo")
-    axs[2,1].set_ylabel("kW")
-    axs[2,1].grid(True)
-    axs[2,1].legend()
-
-    plt.tight_layout(rect=[0, 0, 1, 0.96])
-    plt.show()
-
-    print("\nSimulazione completata.\n")
-    return stats
-
-
-if __name__ == "__main__":
-    if login():
-        avvia_stazione(num_colonnine=4)
-    
-
-
+import time
+import json
+import logging
+import argparse
+import math
+import os
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import nullcontext
+import numpy as np
+from collections import defaultdict
+
+from allocatore import FATTORI_MODALITA, Allocatore, richieste_regolate
+from sensori import BancoSensori, SorgenteMQTT, SorgenteSintetica
+from statistiche import STORICO_PREDEFINITO, StatisticheStazione
+
+log = logging.getLogger("rifornimento")
+
+# SISTEMA DI AUTENTICAZIONE
+UTENTI = {
+    "admin": "1234",
+    "tecnico": "password",
+    "ospite": "guest"
+}
+
+def login():
+    print(" ACCESSO SICURO ALLA STAZIONE DI RICARICA")
+    tentativi = 3
+    while tentativi > 0:
+        user = input("Username: ").strip()
+        pwd = input("Password: ").strip()
+        if user in UTENTI and UTENTI[user] == pwd:
+            print("\n Accesso consentito. Benvenuto,", user, "\n")
+            return True
+        tentativi -= 1
+        print(f" Credenziali errate. Tentativi rimasti: {tentativi}")
+    print(" Troppi tentativi falliti. Uscita dal sistema.\n")
+    exit()
+
+# CONFIGURAZIONE STAZIONE
+CONFIG = {
+    "max_potenza": 150,
+    "soglia_temp_alta": 55,
+    "soglia_temp_critica": 70,
+    "soglia_degrado": 90,
+    "modalita": "Standard",
+    "potenza_massima_stazione": 300,
+    "percentuale_riduzione_temp_alta": 0.30,   # ← MODIFICATO (era 0.5)
+    "min_power_for_active": 0.5,               # ← MODIFICATO (era 1.0) → ora vede potenza
+    "cicli_attesa_blocco": 1,
+    "max_raffreddamenti_per_ciclo": 2,
+    "prob_fail_raffreddamento_locale": 0.06,
+    "prob_fail_raffreddamento_centrale": 0.04,
+    "soglia_fail_consecutivi_blocco": 3,
+    "aumento_temp_fail_raff": 3.5,
+    "metodo_kl": "analitico",                  # "analitico" (gaussiane) | "monte_carlo"
+    "prob_arrivo": 0.4,                        # probabilità per ciclo di un arrivo su una colonnina libera
+}
+
+VEICOLI = {
+    "CityCar": {"batteria": 40, "max_potenza": 50},
+    "SUV": {"batteria": 80, "max_potenza": 120},
+    "Sportiva": {"batteria": 100, "max_potenza": 150}
+}
+
+MODALITA = ["Eco", "Standard", "Boost"]
+
+# SENSORI
+class Sensore:
+    def __init__(self, tipo, rng=None):
+        self.tipo = tipo
+        self.rng = rng if rng is not None else np.random.default_rng()
+
+    # Lettura singola; per un'intera flotta si usa sensori.BancoSensori (una estrazione per tick)
+    _DISTRIBUZIONI = {
+        "temperatura": lambda rng: rng.uniform(50, 90) if rng.random() < 0.1 else rng.uniform(20, 40),
+        "temperatura_esterna": lambda rng: rng.uniform(10, 45),
+        "degrado": lambda rng: rng.uniform(5, 15),
+        "tensione": lambda rng: rng.uniform(350, 800),
+    }
+
+    def rileva(self):
+        distribuzione = self._DISTRIBUZIONI.get(self.tipo)
+        return round(distribuzione(self.rng), 1) if distribuzione else 0.0
+
+# AGENTE LOCALE
+class Gaussiana:
+    # Gaussiana congelata con la stessa interfaccia di scipy.stats.norm(loc, scale) usata dagli agenti:
+    # il nucleo di controllo non importa scipy (le distribuzioni scipy restano accettate ovunque)
+    def __init__(self, loc=0.0, scale=1.0):
+        self.loc = float(loc)
+        self.scale = float(scale)
+
+    def mean(self):
+        return self.loc
+
+    def std(self):
+        return self.scale
+
+    def logpdf(self, x):
+        z = (np.asarray(x, dtype=float) - self.loc) / self.scale
+        return -0.5 * z ** 2 - math.log(self.scale) - 0.5 * math.log(2 * math.pi)
+
+    def pdf(self, x):
+        return np.exp(self.logpdf(x))
+
+    def rvs(self, size=None, random_state=None):
+        rng = random_state if isinstance(random_state, np.random.Generator) else np.random.default_rng(random_state)
+        return rng.normal(self.loc, self.scale, size)
+
+# Distribuzione preferita della temperatura: costruita una sola volta e riusata da tutti gli agenti
+PREFERENZA_TEMP = Gaussiana(loc=40, scale=5)
+# Sotto questa deviazione standard la gaussiana predetta è degenere: la si allarga invece di restituire 0
+SIGMA_MINIMA_KL = 1e-3
+
+def _is_gaussiana(dist):
+    return isinstance(dist, Gaussiana) or getattr(getattr(dist, 'dist', None), 'name', None) == 'norm'
+
+def _parametri_gaussiana(dist):
+    if isinstance(dist, Gaussiana):
+        return np.asarray(dist.loc), np.asarray(dist.scale)
+    # loc/scale della gaussiana scipy congelata, come passati a norm(loc, scale) (posizionali o per nome);
+    # mean()/std() restituiscono nan se scale == 0
+    parametri = {"loc": 0.0, "scale": 1.0, **dict(zip(("loc", "scale"), dist.args)), **dist.kwds}
+    return np.asarray(parametri["loc"], dtype=float), np.asarray(parametri["scale"], dtype=float)
+
+def _kl_gaussiane(mu_p, sigma_p, mu_q, sigma_q):
+    # KL(N(mu_p, sigma_p) || N(mu_q, sigma_q)) in forma chiusa
+    sigma_p = np.maximum(sigma_p, SIGMA_MINIMA_KL)
+    return np.log(sigma_q / sigma_p) + (sigma_p ** 2 + (mu_p - mu_q) ** 2) / (2 * sigma_q ** 2) - 0.5
+
+def _kl_monte_carlo(mu_p, sigma_p, q, num_samples=1000, rng=None):
+    # Stima Monte Carlo di KL(p || q) per ogni riga, con p gaussiana e q qualsiasi distribuzione congelata
+    rng = rng if rng is not None else np.random.default_rng()
+    sigma_p = np.maximum(sigma_p, SIGMA_MINIMA_KL)[..., None]
+    z = rng.normal(size=mu_p.shape + (num_samples,))
+    campioni = mu_p[..., None] + sigma_p * z
+    with np.errstate(divide='ignore', invalid='ignore'):
+        log_ratios = (-0.5 * z ** 2 - np.log(sigma_p) - 0.5 * np.log(2 * np.pi)) - q.logpdf(campioni)
+    finiti = np.isfinite(log_ratios)
+    n_finiti = finiti.sum(axis=-1)
+    somma = np.where(finiti, log_ratios, 0.0).sum(axis=-1)
+    return np.where(n_finiti > 0, somma / np.maximum(n_finiti, 1), 0.0)
+
+def _entropia_istogrammi(righe, bins=10):
+    # Equivalente di entropy(np.histogram(riga, bins)) applicato all'ultimo asse
+    lo = righe.min(axis=-1, keepdims=True)
+    hi = righe.max(axis=-1, keepdims=True)
+    degenere = lo == hi
+    lo = np.where(degenere, lo - 0.5, lo)
+    hi = np.where(degenere, hi + 0.5, hi)
+    bordi = lo + (hi - lo) * (np.arange(bins + 1) / bins)
+    bordi[..., -1] = hi[..., 0]
+
+    idx = ((righe - lo) * (bins / (hi - lo))).astype(np.intp)
+    idx = np.clip(idx, 0, bins - 1)
+    # Stessa correzione di np.histogram sugli errori di arrotondamento ai bordi
+    idx -= righe < np.take_along_axis(bordi, idx, axis=-1)
+    idx += (righe >= np.take_along_axis(bordi, idx + 1, axis=-1)) & (idx != bins - 1)
+
+    conteggi = (idx[..., None] == np.arange(bins)).sum(axis=-2)
+    prob = conteggi / conteggi.sum(axis=-1, keepdims=True)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        termini = np.where(prob > 0, prob * np.log(prob), 0.0)
+    return -termini.sum(axis=-1)
+
+class AgenteLocale:
+    def __init__(self, colonnina, rng=None):
+        self.colonnina = colonnina
+        self.rng = rng if rng is not None else colonnina.rng
+        self.isteresi_raff_locale = 3.0
+        self.ultima_temp_vista = 25.0
+        self.voto_centrale_ultimo = 0.0
+        self.beliefs = {
+            'p_fail_raff_locale': CONFIG["prob_fail_raffreddamento_locale"],
+            'p_fail_raff_centrale': CONFIG["prob_fail_raffreddamento_centrale"],
+            'var_temp': 5.0
+        }
+        self.preferenza_temp = PREFERENZA_TEMP
+        self.campioni_estratti = 0
+        self.cache_efe = None               # cache_efe.CacheEFE condivisa tra gli agenti della stazione
+        self.bucket_efe = None
+
+    def usa_cache_efe(self, cache):
+        self.cache_efe = cache
+        self.bucket_efe = cache.bucket_beliefs(self.beliefs)
+        cache.entra(self.bucket_efe)
+
+    def genera_politiche(self):
+        return [
+            {'raff_locale': True,  'downgrade': False, 'rid_pot': 0.0},
+            {'raff_locale': False, 'downgrade': True,  'rid_pot': 0.3},
+            {'raff_locale': True,  'downgrade': True,  'rid_pot': 0.1},
+            {'raff_locale': False, 'downgrade': False, 'rid_pot': 0.0}
+        ]
+
+    def calcola_efe(self, politica, stato_attuale, orizzonte=3):
+        return float(self.calcola_efe_politiche([politica], stato_attuale, orizzonte)[0])
+
+    def calcola_efe_politiche(self, politiche, stato_attuale, orizzonte=3, num_campioni=50):
+        # Valuta tutte le politiche in un colpo solo: tensori (politiche × orizzonte × campioni)
+        raff = np.array([pol['raff_locale'] for pol in politiche], dtype=bool)
+        downgrade = np.array([pol['downgrade'] for pol in politiche], dtype=bool)
+        rid_pot = np.array([pol['rid_pot'] for pol in politiche], dtype=float)
+        forma = (len(politiche), orizzonte, num_campioni)
+        self.campioni_estratti += forma[0] * forma[1] * forma[2]
+
+        temps = stato_attuale['temperatura'] + self.rng.normal(5, self.beliefs['var_temp'], size=forma)
+        fallito = self.rng.random(size=forma) < self.beliefs['p_fail_raff_locale']
+        effetto_raff = np.where(fallito, CONFIG['aumento_temp_fail_raff'], -10.0)
+        temps += np.where(raff[:, None, None], effetto_raff, 0.0)
+        temps -= np.where(downgrade, 2.0, 0.0)[:, None, None]
+
+        # La SoC futura non dipende dal campione: una sola media per politica
+        mean_soc = stato_attuale['soc'] + stato_attuale.get('potenza_effettiva', 0) * (1 - rid_pot) / 60
+        kl_prag_soc = np.abs(mean_soc - 100) * 0.1
+
+        mean_temp = temps.mean(axis=2)
+        std_temp = np.sqrt(temps.var(axis=2))
+        if CONFIG["metodo_kl"] == "analitico" and _is_gaussiana(self.preferenza_temp):
+            kl_prag_temp = _kl_gaussiane(mean_temp, std_temp, *_parametri_gaussiana(self.preferenza_temp))
+        else:
+            kl_prag_temp = _kl_monte_carlo(mean_temp, std_temp, self.preferenza_temp, rng=self.rng)
+
+        ent_epist = _entropia_istogrammi(temps, bins=10)
+
+        return (kl_prag_temp + kl_prag_soc[:, None] + ent_epist).sum(axis=1)
+
+    def kl_divergence(self, p, q, num_samples=1000, metodo=None):
+        metodo = metodo or CONFIG["metodo_kl"]
+        if metodo == "analitico" and _is_gaussiana(p) and _is_gaussiana(q):
+            return float(_kl_gaussiane(*_parametri_gaussiana(p), *_parametri_gaussiana(q)))
+        if _is_gaussiana(p):
+            return float(_kl_monte_carlo(*_parametri_gaussiana(p), q, num_samples, rng=self.rng))
+        samples = p.rvs(num_samples)
+        log_ratios = p.logpdf(samples) - q.logpdf(samples)
+        finite = log_ratios[np.isfinite(log_ratios)]
+        return np.mean(finite) if len(finite) > 0 else 0.0
+
+    def aggiorna_beliefs(self, fallito, tipo_raff):
+        key = 'p_fail_raff_locale' if tipo_raff == 'locale' else 'p_fail_raff_centrale'
+        prior_alpha, prior_beta = 1, 19
+        old_p = self.beliefs[key]
+        if fallito:
+            self.beliefs[key] = (old_p * (prior_alpha + prior_beta) + 1) / (prior_alpha + prior_beta + 1)
+        else:
+            self.beliefs[key] = (old_p * (prior_alpha + prior_beta)) / (prior_alpha + prior_beta + 1)
+        self.beliefs['var_temp'] = max(1.0, self.beliefs['var_temp'] * (1.1 if fallito else 0.9))
+        self.aggiorna_bucket_efe()
+
+    def aggiorna_bucket_efe(self):
+        # Dopo ogni modifica delle belief: l'agente passa al bucket della cache EFE in cui ora ricadono
+        if self.cache_efe is not None:
+            bucket = self.cache_efe.bucket_beliefs(self.beliefs)
+            if bucket != self.bucket_efe:
+                self.cache_efe.sposta(self.bucket_efe, bucket)
+                self.bucket_efe = bucket
+
+    def decide(self, info_globali=None, parametri=None):
+        # Se il chiamante ha già letto i sensori in questo ciclo si decide su quelle letture
+        p = parametri if parametri is not None else self.colonnina.leggi_parametri()
+        info_globali = info_globali or {}
+
+        temp = p["temperatura"]
+        stato_attuale = {
+            'temperatura': temp,
+            'soc': p['soc'],
+            'potenza_effettiva': p.get("potenza_effettiva", 0)
+        }
+
+        politiche = self.genera_politiche()
+        if self.cache_efe is not None:
+            efe_values = self.cache_efe.efe(self, politiche, stato_attuale)
+        else:
+            efe_values = self.calcola_efe_politiche(politiche, stato_attuale)
+        best_idx = int(np.argmin(efe_values))
+        best_pol = politiche[best_idx]
+        min_efe = float(efe_values[best_idx])
+
+        if self.colonnina.modalita == "Eco":
+            best_pol['downgrade'] = False
+
+        locale_richiesto = best_pol['raff_locale']
+        downgrade_req = best_pol['downgrade']
+
+        voto = 0.35 if temp > CONFIG["soglia_temp_alta"] else 0.0
+        if info_globali.get("quante_altre_calda", p.get("quante_altre_calda", 0)) >= 2:
+            voto += 0.25
+        voto = min(1.0, voto)
+
+        motiv = f"Temp {temp:.1f}°C | EFE min {min_efe:.2f} | Politica: {best_pol}"
+        if locale_richiesto:
+            motiv += " → RAFF. LOCALE"
+
+        self.ultima_temp_vista = temp
+        self.voto_centrale_ultimo = voto
+
+        return {
+            "raffreddamento_locale_richiesto": locale_richiesto,
+            "voto_raffreddamento_centrale": round(voto, 2),
+            "downgrade_modalita_richiesto": downgrade_req,
+            "rid_pot_richiesta": best_pol['rid_pot'],
+            "motivazione_agente": motiv,
+            "temp": temp,
+            "anomalia": p["anomalia"],
+            "min_efe": min_efe,
+            "politica": best_idx
+        }
+
+# COLONNINA
+class Colonnina:
+    def __init__(self, id, rng=None):
+        self.id = id
+        self.rng = rng if rng is not None else np.random.default_rng()
+        self.veicolo = None
+        self.capacita = None
+        self.soc_kwh = 0.0
+        self.carica_attiva = False
+        self.versione_stato = 0
+        self.registro = None
+        self.stato = "LIBERA"
+        self.modalita = "Standard"
+
+        self.s_temp = Sensore("temperatura", self.rng)
+        self.s_temp_ext = Sensore("temperatura_esterna", self.rng)
+        self.s_deg = Sensore("degrado", self.rng)
+        self.s_tens = Sensore("tensione", self.rng)
+
+        self.raffreddamento_attivo = False
+        self.fail_raff_consecutivi = 0
+        self.stato_raff_fallito = False
+        self.ultimo_raff_usato = None
+        # L'agente ha un proprio flusso casuale: può decidere in parallelo alla lettura dei sensori
+        self.agente = AgenteLocale(self, rng=self.rng.spawn(1)[0])
+
+    @property
+    def stato(self):
+        return self._stato
+
+    @stato.setter
+    def stato(self, nuovo):
+        # Ogni cambio di stato invalida letture e decisioni già memorizzate per questo ciclo
+        vecchio = getattr(self, '_stato', None)
+        self._stato = nuovo
+        self.versione_stato += 1
+        if self.registro is not None and vecchio != nuovo:
+            self.registro.cambio_stato(self, vecchio, nuovo)
+
+    def reset_raff_fail(self):
+        self.fail_raff_consecutivi = 0
+        self.stato_raff_fallito = False
+
+    def applica_raffreddamento(self, centrale_attivo: bool, locale_attivo: bool) -> bool:
+        raff_attivato = centrale_attivo or locale_attivo
+        self.ultimo_raff_usato = "centrale" if centrale_attivo else ("locale" if locale_attivo else None)
+        self.raffreddamento_attivo = raff_attivato
+
+        if not raff_attivato:
+            self.reset_raff_fail()
+            return False
+
+        prob_fail = CONFIG["prob_fail_raffreddamento_locale"]
+
+        fallito = self.rng.random() < prob_fail
+        if fallito:
+            self.fail_raff_consecutivi += 1
+            self.stato_raff_fallito = True
+
+            if self.fail_raff_consecutivi >= CONFIG["soglia_fail_consecutivi_blocco"]:
+                self.stato = "BLOCCATA_RAFF_FALLITO"
+                self.carica_attiva = False
+                log.warning("!!! COLONNINA %s → BLOCCATA (raffreddamento fallito %d volte consecutive)", self.id, self.fail_raff_consecutivi)
+                self.agente.aggiorna_beliefs(fallito, self.ultimo_raff_usato)
+                return True
+
+            log.info("  Colonnina %s: raffreddamento (%s) FALLITO (%d)", self.id, self.ultimo_raff_usato, self.fail_raff_consecutivi)
+            self.agente.aggiorna_beliefs(fallito, self.ultimo_raff_usato)
+            return False
+
+        self.reset_raff_fail()
+        self.agente.aggiorna_beliefs(fallito, self.ultimo_raff_usato)
+        return False
+
+    def assegna_auto(self):
+        self.veicolo = list(VEICOLI)[self.rng.integers(len(VEICOLI))]
+        self.capacita = VEICOLI[self.veicolo]["batteria"]
+        self.soc_kwh = self.rng.uniform(5, 0.25 * self.capacita)   # ← MODIFICATO (SoC più basso)
+        self.carica_attiva = True
+        self.stato = "OCCUPATA"
+        self.raffreddamento_attivo = False
+        self.reset_raff_fail()
+        self.modalita = MODALITA[self.rng.integers(len(MODALITA))]
+        log.info(" Nuova auto (%s) sulla colonnina %s", self.veicolo, self.id)
+
+    def aggiorna_soc(self, potenza_effettiva: float):
+        if not self.carica_attiva or self.stato.startswith("BLOCCATA"):
+            return
+        self.soc_kwh = min(self.capacita, self.soc_kwh + (potenza_effettiva / 60.0))
+        if self.soc_kwh >= self.capacita * 0.98:
+            self.stato = "COMPLETATA"
+            self.carica_attiva = False
+            log.info(" Colonnina %s: ricarica completata. Auto in partenza.", self.id)
+
+    def soc_percento(self) -> float:
+        if not self.veicolo or self.capacita is None:
+            return 0.0
+        return round((self.soc_kwh / self.capacita) * 100, 1)
+
+    def leggi_parametri(self, letture=None) -> "Lettura":
+        # letture: valori grezzi già campionati da un BancoSensori; altrimenti si interrogano i sensori propri
+        if letture is None:
+            letture = {"temperatura_esterna": self.s_temp_ext.rileva(), "temperatura": self.s_temp.rileva()}
+        t_esterna = letture["temperatura_esterna"]
+        t_reale_sensore = letture["temperatura"]
+
+        if self.stato.startswith("BLOCCATA"):
+            potenza_teorica = 0.0
+            temp_predetta = t_esterna + 1.0
+            inc_teorico = 0
+        else:
+            if self.stato == "OCCUPATA":
+                max_p = VEICOLI[self.veicolo]["max_potenza"]
+                potenza_teorica = self.rng.uniform(max_p * 0.5, max_p)
+                inc_teorico = (potenza_teorica / 10.0) * 2.0
+                if self.raffreddamento_attivo:
+                    inc_teorico *= 0.6
+                temp_predetta = t_esterna + inc_teorico
+            else:
+                potenza_teorica = 0
+                temp_predetta = t_esterna + 1.0
+                inc_teorico = 0
+
+        gap = abs(t_reale_sensore - temp_predetta)
+        soglia_anomalia = 15.0
+        soglia_media_pericolosa = 45.0
+        media_temp = (t_reale_sensore + temp_predetta) / 2
+
+        anomalia = gap > soglia_anomalia
+        anomalia_pericolosa = anomalia and (media_temp > soglia_media_pericolosa)
+
+        temperatura_output = max(t_reale_sensore, temp_predetta) if anomalia else t_reale_sensore
+        bloccata = self.stato.startswith("BLOCCATA")
+        if bloccata:
+            temperatura_output = max(temperatura_output, 75.0)
+
+        # Diagnostica e alert non si formattano qui: Lettura li ricava dai flag solo quando servono
+        return Lettura(
+            self.id, self.stato, self.veicolo if self.stato == "OCCUPATA" else None, self.modalita,
+            self.soc_percento(), round(temperatura_output, 1), t_esterna, round(temp_predetta, 1),
+            round(t_reale_sensore, 1), round(gap, 1), anomalia, anomalia_pericolosa, round(media_temp, 1),
+            letture["degrado"] if "degrado" in letture else self.s_deg.rileva(),
+            letture["tensione"] if "tensione" in letture else self.s_tens.rileva(),
+            round(potenza_teorica, 1), self.raffreddamento_attivo, self.fail_raff_consecutivi,
+            self.stato_raff_fallito, bloccata,
+        )
+
+# TELEMETRIA COLONNINA
+STATI = ("LIBERA", "OCCUPATA", "COMPLETATA", "BLOCCATA_RAFF_FALLITO")
+_CODICE_STATO = {s: i for i, s in enumerate(STATI)}
+_CODICE_MODALITA = {m: i for i, m in enumerate(MODALITA)}
+NOMI_VEICOLI = tuple(VEICOLI)
+_CODICE_VEICOLO = {v: i for i, v in enumerate(NOMI_VEICOLI)}
+
+# Chiavi nell'ordine del vecchio dict di leggi_parametri, seguite da quelle aggiunte durante il ciclo
+CAMPI_LETTURA = (
+    "id", "veicolo", "stato", "soc", "temperatura", "temperatura_esterna", "temperatura_predetta",
+    "temperatura_reale_grezzo", "gap_rilevato", "anomalia", "anomalia_pericolosa", "media_temperatura",
+    "diagnostica", "degrado", "tensione", "potenza_richiesta", "raffreddamento_attivo",
+    "fail_raff_consecutivi", "modalita", "alert",
+    "agente", "raffreddamento_locale_attivo", "modalita_effettiva", "azioni", "potenza_effettiva",
+)
+_CAMPI = frozenset(CAMPI_LETTURA)
+_FACOLTATIVI = frozenset(("alert", "agente", "raffreddamento_locale_attivo", "modalita_effettiva", "azioni",
+                          "potenza_effettiva"))
+_ASSENTE = object()                         # campo facoltativo non ancora assegnato
+
+class Lettura:
+    # Record compatto di una colonnina per un ciclo: si usa come il dict di prima (p["stato"], p.get, setdefault,
+    # "azioni" in p), ma stato, modalità e veicolo sono codici e diagnostica/alert vengono formattati solo
+    # quando qualcuno li legge (log, telemetria). I campi facoltativi valgono _ASSENTE finché non assegnati.
+    __slots__ = (
+        "id", "_stato", "_veicolo", "_modalita", "soc", "temperatura", "temperatura_esterna",
+        "temperatura_predetta", "temperatura_reale_grezzo", "gap_rilevato", "anomalia", "anomalia_pericolosa",
+        "media_temperatura", "degrado", "tensione", "potenza_richiesta", "raffreddamento_attivo",
+        "fail_raff_consecutivi", "raff_fallito", "bloccata",
+        "agente", "raffreddamento_locale_attivo", "_modalita_effettiva", "azioni", "potenza_effettiva", "_extra",
+    )
+
+    def __init__(self, id, stato, veicolo, modalita, soc, temperatura, temperatura_esterna, temperatura_predetta,
+                 temperatura_reale_grezzo, gap_rilevato, anomalia, anomalia_pericolosa, media_temperatura, degrado,
+                 tensione, potenza_richiesta, raffreddamento_attivo, fail_raff_consecutivi, raff_fallito, bloccata):
+        self.id = id
+        self._stato = _CODICE_STATO[stato]
+        self._veicolo = -1 if veicolo is None else _CODICE_VEICOLO[veicolo]
+        self._modalita = _CODICE_MODALITA[modalita]
+        self.soc = soc
+        self.temperatura = temperatura
+        self.temperatura_esterna = temperatura_esterna
+        self.temperatura_predetta = temperatura_predetta
+        self.temperatura_reale_grezzo = temperatura_reale_grezzo
+        self.gap_rilevato = gap_rilevato
+        self.anomalia = anomalia
+        self.anomalia_pericolosa = anomalia_pericolosa
+        self.media_temperatura = media_temperatura
+        self.degrado = degrado
+        self.tensione = tensione
+        self.potenza_richiesta = potenza_richiesta
+        self.raffreddamento_attivo = raffreddamento_attivo
+        self.fail_raff_consecutivi = fail_raff_consecutivi
+        # Stato del raffreddamento e blocco al momento della lettura (per diagnostica e alert)
+        self.raff_fallito = raff_fallito
+        self.bloccata = bloccata
+        self.agente = self.raffreddamento_locale_attivo = self.azioni = self.potenza_effettiva = _ASSENTE
+        self._modalita_effettiva = -1
+        self._extra = None
+
+    # Campi codificati
+    @property
+    def stato(self):
+        return STATI[self._stato]
+
+    @stato.setter
+    def stato(self, nuovo):
+        self._stato = _CODICE_STATO[nuovo]
+
+    @property
+    def veicolo(self):
+        return NOMI_VEICOLI[self._veicolo] if self._veicolo >= 0 else None
+
+    @property
+    def modalita(self):
+        return MODALITA[self._modalita]
+
+    @modalita.setter
+    def modalita(self, nuova):
+        self._modalita = _CODICE_MODALITA[nuova]
+
+    @property
+    def modalita_effettiva(self):
+        return MODALITA[self._modalita_effettiva] if self._modalita_effettiva >= 0 else _ASSENTE
+
+    @modalita_effettiva.setter
+    def modalita_effettiva(self, nuova):
+        self._modalita_effettiva = _CODICE_MODALITA[nuova]
+
+    # Campi derivati, formattati su richiesta
+    @property
+    def diagnostica(self):
+        diagnostica = "OK"
+        if self.anomalia:
+            diagnostica = f"ANOMALIA SENSORE: gap {self.gap_rilevato:.1f}°C"
+            if self.anomalia_pericolosa:
+                diagnostica += f" – MEDIA ALTA {self.media_temperatura:.1f}°C → ATTENZIONE!"
+        if self.raff_fallito and self.raffreddamento_attivo:
+            diagnostica += " – RAFF. FALLITO QUESTO CICLO"
+        if self.bloccata:
+            diagnostica += " – COLONNINA BLOCCATA (guasto raffreddamento)"
+        return diagnostica
+
+    @property
+    def alert(self):
+        if self.bloccata:
+            return "COLONNINA BLOCCATA – guasto raffreddamento ripetuto"
+        if self.raff_fallito:
+            return "Raffreddamento fallito questo ciclo"
+        return _ASSENTE
+
+    # Interfaccia dict
+    def __getitem__(self, chiave):
+        if chiave in _CAMPI:
+            valore = getattr(self, chiave)
+            if valore is not _ASSENTE:
+                return valore
+        elif self._extra is not None and chiave in self._extra:
+            return self._extra[chiave]
+        raise KeyError(chiave)
+
+    def get(self, chiave, predefinito=None):
+        if chiave in _CAMPI:
+            valore = getattr(self, chiave)
+            return predefinito if valore is _ASSENTE else valore
+        return self._extra.get(chiave, predefinito) if self._extra is not None else predefinito
+
+    def __setitem__(self, chiave, valore):
+        if chiave in _CAMPI:
+            setattr(self, chiave, valore)
+        else:
+            if self._extra is None:
+                self._extra = {}
+            self._extra[chiave] = valore
+
+    def __contains__(self, chiave):
+        if chiave in _CAMPI:
+            return getattr(self, chiave) is not _ASSENTE
+        return self._extra is not None and chiave in self._extra
+
+    def setdefault(self, chiave, predefinito=None):
+        if chiave not in self:
+            self[chiave] = predefinito
+        return self[chiave]
+
+    def keys(self):
+        chiavi = [k for k in CAMPI_LETTURA if k not in _FACOLTATIVI or getattr(self, k) is not _ASSENTE]
+        return chiavi + list(self._extra) if self._extra else chiavi
+
+    def __iter__(self):
+        return iter(self.keys())
+
+    def __len__(self):
+        return len(self.keys())
+
+    def items(self):
+        return [(k, self[k]) for k in self.keys()]
+
+    def copy(self):
+        nuova = Lettura.__new__(Lettura)
+        for nome in Lettura.__slots__:
+            setattr(nuova, nome, getattr(self, nome))
+        if self._extra is not None:
+            nuova._extra = dict(self._extra)
+        return nuova
+
+    def come_dict(self):
+        # Per la telemetria JSON: chiavi e valori come nel vecchio dict
+        return dict(self.items())
+
+    def __repr__(self):
+        return f"Lettura({self.come_dict()!r})"
+
+# CACHE DI CICLO
+class CacheCiclo:
+    def __init__(self):
+        self.ciclo = None
+        self._letture = {}
+        self._decisioni = {}
+
+    def nuovo_ciclo(self, ciclo):
+        self.ciclo = ciclo
+        self._letture.clear()
+        self._decisioni.clear()
+
+    def _valido(self, voce, col):
+        return voce is not None and voce[0] == col.versione_stato
+
+    def registra_letture(self, col, parametri):
+        self._letture[(self.ciclo, col.id)] = (col.versione_stato, parametri)
+
+    def registra_decisione(self, col, decisione):
+        self._decisioni[(self.ciclo, col.id)] = (col.versione_stato, decisione)
+
+    def letture(self, col):
+        voce = self._letture.get((self.ciclo, col.id))
+        return voce[1] if self._valido(voce, col) else None
+
+    def decisione(self, col):
+        voce = self._decisioni.get((self.ciclo, col.id))
+        return voce[1] if self._valido(voce, col) else None
+
+# REGISTRO COLONNINE
+class RegistroColonnine:
+    # Indice per id e per stato, aggiornato dalle colonnine stesse a ogni cambio di stato
+    def __init__(self, colonnine=()):
+        self._per_id = {}
+        self._per_stato = defaultdict(dict)
+        self.osservatori = []               # funzioni (col, vecchio, nuovo), es. eventi.Pianificatore
+        for col in colonnine:
+            self.registra(col)
+
+    def registra(self, col):
+        if col.registro is not None and col.registro is not self:
+            col.registro.rimuovi(col)
+        col.registro = self
+        self._per_id[col.id] = col
+        self._per_stato[col.stato][col.id] = col
+
+    def rimuovi(self, col):
+        self._per_id.pop(col.id, None)
+        self._per_stato[col.stato].pop(col.id, None)
+        col.registro = None
+
+    def cambio_stato(self, col, vecchio, nuovo):
+        self._per_stato[vecchio].pop(col.id, None)
+        self._per_stato[nuovo][col.id] = col
+        for osservatore in self.osservatori:
+            osservatore(col, vecchio, nuovo)
+
+    def ordine(self, stato):
+        # Id nell'ordine di ingresso nello stato, lo stesso di per_stato (conta per le somme in virgola mobile)
+        return list(self._per_stato[stato])
+
+    def imposta_ordine(self, stato, ids):
+        self._per_stato[stato] = {i: self._per_id[i] for i in ids}
+
+    def get(self, id_colonnina):
+        return self._per_id.get(id_colonnina)
+
+    def per_stato(self, stato):
+        return list(self._per_stato[stato].values())
+
+    def conta(self, stato):
+        return len(self._per_stato[stato])
+
+    def __iter__(self):
+        return iter(list(self._per_id.values()))
+
+    def __len__(self):
+        return len(self._per_id)
+
+# DECISIONI IN PARALLELO
+# Sotto questa soglia di decisioni per thread il costo del pool supera il guadagno: si decide in serie
+MIN_DECISIONI_PER_LAVORATORE = 16
+
+def _decidi_blocco(lavori, info, misura):
+    # Gira su un thread del pool: ogni agente usa solo il proprio generatore e scrive solo su se stesso,
+    # quindi l'esito non dipende da come i blocchi si distribuiscono sui thread
+    esiti = []
+    for col, p in lavori:
+        agente = col.agente
+        campioni = agente.campioni_estratti
+        inizio = time.perf_counter() if misura else 0.0
+        decisione = agente.decide(info, parametri=p)
+        esiti.append((decisione, time.perf_counter() - inizio if misura else 0.0, agente.campioni_estratti - campioni))
+    return esiti
+
+# SERVER
+# Azioni finali condivise tra tutti i record (nessuna lista nuova per colonnina e per ciclo)
+_AZIONI_LIBERA = ("LIBERA",)
+_AZIONI_OK = ("OK",)
+
+class Server:
+    def __init__(self, colonnine=()):
+        self.quante_colonnine_calide = 0
+        self.media_voti_centrali = 0.0
+        self.cache = CacheCiclo()
+        self.registro = RegistroColonnine(colonnine)
+        self.sensori = None
+        self.allocatore = Allocatore()
+        self.potenza_massima = None         # None → CONFIG["potenza_massima_stazione"]
+        self._ultimo_esito = (None, None)
+        self.allocazioni_riusate = 0
+        self.metriche = None                # metriche.Metriche per l'instrumentazione del ciclo
+        self.cache_efe = None
+        self.pool_decisioni = None          # ThreadPoolExecutor per decide(); None → in serie
+        self.flotta = None                  # flotta.Flotta se le colonnine sono sue viste: kernel in blocco
+        self.lavoratori_decisioni = 1
+
+    def usa_pool_decisioni(self, max_workers=None):
+        # max_workers=1: decisioni in serie sul thread del ciclo (come senza pool)
+        self.chiudi_pool_decisioni()
+        if max_workers != 1:
+            self.pool_decisioni = ThreadPoolExecutor(max_workers, thread_name_prefix="decisioni")
+            # Stesso default di ThreadPoolExecutor
+            self.lavoratori_decisioni = max_workers or min(32, (os.cpu_count() or 1) + 4)
+
+    def chiudi_pool_decisioni(self):
+        if self.pool_decisioni is not None:
+            self.pool_decisioni.shutdown(wait=True)
+        self.pool_decisioni = None
+        self.lavoratori_decisioni = 1
+
+    def decidi(self, lavori):
+        # lavori: [(colonnina, parametri)]; decisioni nello stesso ordine
+        info = {
+            "quante_altre_calda": self.quante_colonnine_calide,
+            "media_voti_centrali": self.media_voti_centrali
+        }
+        metriche = self.metriche
+        lavoratori = self.lavoratori_decisioni
+        # La cache EFE condivisa non è thread-safe e il suo esito dipende dall'ordine: con la cache si resta in serie
+        if self.pool_decisioni is None or self.cache_efe is not None or len(lavori) < 2 * MIN_DECISIONI_PER_LAVORATORE:
+            esiti = _decidi_blocco(lavori, info, metriche is not None)
+        else:
+            blocchi = min(lavoratori * 4, len(lavori) // MIN_DECISIONI_PER_LAVORATORE)
+            passo = -(-len(lavori) // blocchi)
+            futuri = [self.pool_decisioni.submit(_decidi_blocco, lavori[i:i + passo], info, metriche is not None)
+                      for i in range(0, len(lavori), passo)]
+            esiti = [esito for futuro in futuri for esito in futuro.result()]
+        if metriche is not None:
+            for _, durata, campioni in esiti:
+                metriche.latenza_decisione.osserva(durata)
+                metriche.incrementa("campioni_efe", campioni)
+            metriche.incrementa("decisioni", len(esiti))
+        return [decisione for decisione, _, _ in esiti]
+
+    def potenza_disponibile(self, budget=None):
+        # Tetto della stazione, eventualmente ristretto dal budget assegnato dal livello superiore (feeder)
+        tetto = self.potenza_massima if self.potenza_massima is not None else CONFIG["potenza_massima_stazione"]
+        return tetto if budget is None else min(tetto, budget)
+
+    def distribuisci_potenza(self, lista_parametri, budget=None):
+        return self.assegna_potenza(lista_parametri, self.prepara_richieste(lista_parametri), budget)
+
+    def prepara_richieste(self, lista_parametri):
+        # Prima metà dell'allocazione: decisioni degli agenti, raffreddamenti, downgrade e richieste regolate.
+        # La domanda risultante è ciò che la stazione dichiara al feeder prima di conoscere il proprio budget.
+        richieste_raff_locali = []
+        richieste_downgrade = []
+        occupate = [p for p in lista_parametri if p.get("stato") == "OCCUPATA"]
+        metriche = self.metriche
+
+        with fase(self, "decisioni"):
+            lavori = []
+            for p in occupate:
+                col = self.registro.get(p["id"])
+                if col:
+                    lavori.append((col, p))
+
+            # Prima tutte le decisioni mancanti (eventualmente sul pool), poi raffreddamenti e downgrade in ordine
+            mancanti = [(col, p) for col, p in lavori if self.cache.decisione(col) is None]
+            for (col, _), decisione in zip(mancanti, self.decidi(mancanti)):
+                self.cache.registra_decisione(col, decisione)
+
+            for col, p in lavori:
+                decisione = self.cache.decisione(col)
+                p["agente"] = decisione
+
+                if decisione.get("raffreddamento_locale_richiesto"):
+                    richieste_raff_locali.append((p["id"], decisione["min_efe"], p))
+
+                if decisione.get("downgrade_modalita_richiesto"):
+                    richieste_downgrade.append((p["id"], decisione["min_efe"], p))
+
+        richieste_raff_locali.sort(key=lambda x: x[1])
+
+        max_raff_locali_approvabili = CONFIG["max_raffreddamenti_per_ciclo"]
+        approvati = 0
+        for _, _, p in richieste_raff_locali:
+            if approvati >= max_raff_locali_approvabili:
+                break
+            p["raffreddamento_locale_attivo"] = True
+            approvati += 1
+            p.setdefault("azioni", []).append(f"RAFF. LOCALE APPROVATO (priorità {approvati})")
+
+        with fase(self, "raffreddamento"):
+            centrale = False
+            locali = [p.get("raffreddamento_locale_attivo", False) for _, p in lavori]
+            if self.flotta is not None:
+                bloccate = self.flotta.applica_raffreddamento_viste([col for col, _ in lavori], centrale, locali)
+            else:
+                bloccate = [col.applica_raffreddamento(centrale, locale) for (col, _), locale in zip(lavori, locali)]
+
+            for (col, p), locale, bloccata in zip(lavori, locali, bloccate):
+                if bloccata:
+                    p["stato"] = col.stato
+                if metriche is not None:
+                    metriche.incrementa("fallimenti_raffreddamento", int(locale and col.stato_raff_fallito))
+                    metriche.incrementa("blocchi", int(bloccata))
+
+        # Downgrade e richieste regolate sono la prima parte dell'allocazione (la seconda è assegna_potenza)
+        with fase(self, "allocazione"):
+            richieste_downgrade.sort(key=lambda x: x[1])
+            num_downgrade = 0
+            for _, _, p in richieste_downgrade:
+                if num_downgrade >= 1:
+                    break
+                curr = p.get("modalita_effettiva", p.get("modalita", CONFIG["modalita"]))
+                if curr == "Boost":
+                    p["modalita_effettiva"] = "Eco"
+                    p.setdefault("azioni", []).append("DOWNGRADE: Boost → Eco")
+                    num_downgrade += 1
+
+            attive = [p for p in lista_parametri if p.get("stato") == "OCCUPATA"]
+            richieste = richieste_regolate(
+                [p.get("potenza_richiesta", 0) for p in attive],
+                [FATTORI_MODALITA.get(p.get("modalita_effettiva", p.get("modalita", CONFIG["modalita"])), 1.0) for p in attive],
+                [VEICOLI[p["veicolo"]]["max_potenza"] if p.get("veicolo") else np.inf for p in attive],
+                CONFIG["max_potenza"],
+                [p.get("agente", {}).get("rid_pot_richiesta", 0.0) for p in attive],
+            )
+            temperature = np.array([p["temperatura"] for p in attive], dtype=float)
+            return {
+                "attive": attive,
+                "ids": np.array([p["id"] for p in attive], dtype=np.int64),
+                "richieste": richieste,
+                "soc": np.array([p.get("soc", 100.0) for p in attive], dtype=float),
+                "calde": (temperature > CONFIG["soglia_temp_alta"]) & (temperature <= CONFIG["soglia_temp_critica"]),
+                "domanda": float(richieste.sum()),
+            }
+
+    def _esito_allocazione(self, richieste, budget):
+        # Se richieste, priorità e budget sono quelli del ciclo scorso l'allocazione non cambia: si riusa
+        parametri = (budget, CONFIG["min_power_for_active"], CONFIG["percentuale_riduzione_temp_alta"], CONFIG["max_potenza"])
+        firma = (parametri, richieste["ids"].tobytes(), richieste["richieste"].tobytes(),
+                 richieste["soc"].tobytes(), richieste["calde"].tobytes())
+        firma_prec, esito = self._ultimo_esito
+        if firma == firma_prec:
+            self.allocazioni_riusate += 1
+            return esito
+        esito = self.allocatore.alloca(
+            richieste["ids"], richieste["richieste"], richieste["soc"], richieste["calde"],
+            potenza_disponibile=budget,
+            min_attiva=CONFIG["min_power_for_active"],
+            riduzione_calde=CONFIG["percentuale_riduzione_temp_alta"],
+            max_potenza=CONFIG["max_potenza"],
+        )
+        self._ultimo_esito = (firma, esito)
+        return esito
+
+    def assegna_potenza(self, lista_parametri, richieste, budget=None):
+        # Seconda metà: water-filling entro il budget e composizione dei record in uscita
+        attive = richieste["attive"]
+        calde = richieste["calde"]
+        esito = self._esito_allocazione(richieste, self.potenza_disponibile(budget))
+        assegnazioni = dict(zip(richieste["ids"].tolist(), esito["potenza"].tolist()))
+
+        # Le note dell'allocazione finiscono solo nelle colonnine che hanno già azioni in questo ciclo
+        # (raffreddamento approvato, downgrade): le altre restano "OK" come prima
+        riduci = f"RIDUCI: Temp Alta (-{int(CONFIG['percentuale_riduzione_temp_alta']*100)}%)"
+        for k, p in enumerate(attive):
+            if "azioni" not in p:
+                continue
+            if p["temperatura"] > CONFIG["soglia_temp_critica"]:
+                p["azioni"].append("FERMA: Temp Critica")
+            elif p.get("degrado", 0) > CONFIG["soglia_degrado"]:
+                p["azioni"].append("FERMA: Degrado Alto")
+            if calde[k]:
+                p["azioni"].append(riduci)
+            if esito["sotto_budget"]:
+                if not calde[k]:
+                    p["azioni"].append("OK")
+            else:
+                p["azioni"].append("RIPOSO: Potenza Non Disponibile" if esito["riposo"][k] else "OK (Priorità SOC bassa)")
+
+        out = []
+        for p in lista_parametri:
+            if p.get("stato") != "OCCUPATA":
+                p["azioni"], p["potenza_effettiva"] = _AZIONI_LIBERA, 0
+            else:
+                p["potenza_effettiva"] = assegnazioni.get(p["id"], 0.0)
+                if "azioni" not in p or not p["azioni"]:
+                    p["azioni"] = _AZIONI_OK
+            out.append(p)
+
+        return out
+
+    def analizza_stazione(self, parametri_con_potenza):
+        totale_kw = sum(p.get("potenza_effettiva", 0) for p in parametri_con_potenza)
+        alert = None
+        num_critiche = sum(1 for p in parametri_con_potenza if p.get("temperatura", 0) > CONFIG["soglia_temp_critica"])
+        num_bloccate = sum(1 for p in parametri_con_potenza if p.get("stato", "").startswith("BLOCCATA"))
+        if num_critiche > 0:
+            alert = f"ATTENZIONE: {num_critiche} colonnine con temperatura critica!"
+        elif num_bloccate > 0:
+            alert = f"ATTENZIONE: {num_bloccate} colonnine bloccate per guasto raffreddamento!"
+        return alert, round(totale_kw, 1)
+
+# OROLOGIO
+class OrologioReale:
+    # Cadenza i cicli in tempo reale (demo): attende solo il tempo che manca alla fine del periodo
+    def __init__(self, periodo=0.5):
+        self.periodo = periodo
+        self._prossimo = None
+
+    def adesso(self):
+        return time.monotonic()
+
+    def prossima_attesa(self):
+        # Secondi che mancano alla fine del periodo corrente (0 se il ciclo è già in ritardo)
+        if self._prossimo is None:
+            self._prossimo = time.monotonic()
+        self._prossimo += self.periodo
+        ritardo = self._prossimo - time.monotonic()
+        if ritardo <= 0:
+            self._prossimo = time.monotonic()
+            return 0.0
+        return ritardo
+
+    def attendi(self):
+        ritardo = self.prossima_attesa()
+        if ritardo > 0:
+            time.sleep(ritardo)
+
+class OrologioVirtuale:
+    # Tempo simulato: ogni ciclo avanza di un periodo senza dormire, i cicli girano uno dopo l'altro
+    def __init__(self, periodo=0.5):
+        self.periodo = periodo
+        self.tempo = 0.0
+
+    def adesso(self):
+        return self.tempo
+
+    def prossima_attesa(self):
+        self.tempo += self.periodo
+        return 0.0
+
+    def attendi(self):
+        self.prossima_attesa()
+
+# GRAFICI
+def mostra_grafici(stats):
+    # matplotlib si carica solo qui: il nucleo di controllo (e i worker degli scenari) non lo importano.
+    # Stessi pannelli del report su file (report.py), con le serie già ridotte a un numero fisso di punti.
+    import matplotlib.pyplot as plt
+    from report import dati_report, disegna_pannelli
+
+    fig = plt.figure(figsize=(15, 12))
+    disegna_pannelli(fig, dati_report(stats))
+    plt.show()
+
+# CICLO DI CONTROLLO
+_SENZA_METRICHE = nullcontext()
+
+def fase(server, nome):
+    # Timer della fase se le metriche sono attive, altrimenti un contesto vuoto condiviso
+    return server.metriche.fase(nome) if server.metriche is not None else _SENZA_METRICHE
+
+def nuove_statistiche(storico=STORICO_PREDEFINITO):
+    return StatisticheStazione(storico)
+
+def gestisci_arrivi(server, rng):
+    # Arrivi sulle colonnine libere e partenze da quelle completate
+    for col in server.registro:
+        if col.stato == "LIBERA":
+            if rng.random() < CONFIG["prob_arrivo"]:
+                col.assegna_auto()
+        elif col.stato == "COMPLETATA":
+            log.info(" Colonnina %s è stata liberata.", col.id)
+            col.stato = "LIBERA"
+            col.veicolo = None
+            col.raffreddamento_attivo = False
+            col.reset_raff_fail()
+
+def leggi_colonnine(server, colonnine=None):
+    colonnine = list(server.registro if colonnine is None else colonnine)
+    letture = server.sensori.leggi(colonnine) if server.sensori is not None else [None] * len(colonnine)
+    parametri_lista = []
+    for col, grezze in zip(colonnine, letture):
+        p = col.leggi_parametri(grezze)
+        # Stesso record, non una copia: l'allocazione aggiunge solo campi facoltativi e, se cambia lo stato
+        # della colonnina, la voce in cache decade da sola (versione_stato)
+        server.cache.registra_letture(col, p)
+        parametri_lista.append(p)
+    return parametri_lista
+
+def conta_anomalie(parametri_lista):
+    # Le colonnine libere non contano: il loro sensore non è sotto carico
+    return sum(1 for p in parametri_lista if p.get("anomalia") and p.get("stato") != "LIBERA")
+
+def aggiorna_info_globali(server, parametri_lista):
+    server.quante_colonnine_calide = sum(1 for p in parametri_lista if p.get("temperatura", 0) > CONFIG["soglia_temp_alta"] and p.get("stato") == "OCCUPATA")
+    voti_centrali = [col.agente.voto_centrale_ultimo for col in server.registro.per_stato("OCCUPATA")]
+    server.media_voti_centrali = sum(voti_centrali) / len(voti_centrali) if voti_centrali else 0.0
+
+def applica_potenza(server, parametri_con_potenza):
+    lavori = []
+    for p in parametri_con_potenza:
+        if p.get("stato") == "OCCUPATA":
+            col = server.registro.get(p["id"])
+            if col:
+                lavori.append((col, p.get("potenza_effettiva", 0)))
+    if server.flotta is not None:
+        server.flotta.aggiorna_soc_viste([col for col, _ in lavori], [potenza for _, potenza in lavori])
+    else:
+        for col, potenza in lavori:
+            col.aggiorna_soc(potenza)
+
+def registra_statistiche(stats, server, ciclo, parametri_con_potenza, counter_anomalie):
+    efe_values_this_cycle = []
+    temps_this_cycle = []
+    socs_this_cycle = []
+    fallimenti_this_cycle = 0
+    p_fails = []
+    var_temps = []
+
+    for col in server.registro.per_stato("OCCUPATA"):
+        # Si riusano letture e decisione che hanno guidato l'allocazione di questo ciclo
+        p = server.cache.letture(col)
+        if p is None:
+            p = col.leggi_parametri()
+            server.cache.registra_letture(col, p)
+        decisione = server.cache.decisione(col)
+        if decisione is None:
+            decisione = col.agente.decide({
+                "quante_altre_calda": server.quante_colonnine_calide,
+                "media_voti_centrali": server.media_voti_centrali
+            }, parametri=p)
+            server.cache.registra_decisione(col, decisione)
+        if "min_efe" in decisione:
+            efe_values_this_cycle.append(decisione["min_efe"])
+        temps_this_cycle.append(p["temperatura"])
+        socs_this_cycle.append(col.soc_percento())
+        if col.stato_raff_fallito:
+            fallimenti_this_cycle += 1
+        p_fails.append(col.agente.beliefs['p_fail_raff_locale'])
+        var_temps.append(col.agente.beliefs['var_temp'])
+
+    totale_kw = sum(p.get("potenza_effettiva", 0) for p in parametri_con_potenza)
+    num_raff_locali = sum(1 for p in parametri_con_potenza if p.get("raffreddamento_locale_attivo", False))
+
+    stats.registra(ciclo, {
+        'efe_medio': np.mean(efe_values_this_cycle) if efe_values_this_cycle else 0,
+        'temp_medie': np.mean(temps_this_cycle) if temps_this_cycle else 0,
+        'temp_max': max(temps_this_cycle) if temps_this_cycle else 0,
+        'soc_medio': np.mean(socs_this_cycle) if socs_this_cycle else 0,
+        'fallimenti_raff': fallimenti_this_cycle,
+        'p_fail_medio': np.mean(p_fails) if p_fails else 0,
+        'var_temp_medio': np.mean(var_temps) if var_temps else 0,
+        'anomalie': counter_anomalie,
+        'potenza_totale': totale_kw,
+        'raffinamenti_locali': num_raff_locali,
+    })
+
+def chiudi_ciclo(server, ciclo, parametri_con_potenza, pubblicatore=None):
+    if log.isEnabledFor(logging.DEBUG):
+        for p in parametri_con_potenza:
+            if p.get("stato") == "OCCUPATA":
+                log.debug(" Col. %s: SoC %s%% | Pot. %.1f kW | Temp %s°C", p['id'], p['soc'], p.get('potenza_effettiva', 0), p.get('temperatura', '?'))
+
+    alert, totale_carica = server.analizza_stazione(parametri_con_potenza)
+    if alert:
+        log.warning(" ALERT: %s", alert)
+    log.info(" Totale Carica Stazione: %s kW", totale_carica)
+
+    if pubblicatore is not None:
+        pubblicatore.pubblica_ciclo(ciclo, parametri_con_potenza, alert, totale_carica)
+
+def crea_stazione(num_colonnine=4, seed=42, sorgente_sensori=None, cache_efe=None, flotta=False):
+    # Flussi indipendenti derivati dal seed: stazione (arrivi), una per colonnina, uno per i sensori di flotta.
+    # flotta=True: backend struct-of-arrays (flotta.Flotta), colonnine come viste sulle sue righe e letture
+    # calcolate in blocco; la flotta ha un flusso in più per i propri kernel.
+    seme = seed if isinstance(seed, np.random.SeedSequence) else np.random.SeedSequence(seed)
+    flussi = seme.spawn(num_colonnine + 2)
+    rng = np.random.default_rng(flussi[0])
+    rngs = [np.random.default_rng(flussi[i + 1]) for i in range(num_colonnine)]
+    if sorgente_sensori is None:
+        sorgente_sensori = SorgenteSintetica(np.random.default_rng(flussi[-1]))
+    if flotta:
+        from flotta import BancoFlotta, Flotta
+        righe = Flotta(num_colonnine, np.random.default_rng(seme.spawn(1)[0]), sorgente_sensori)
+        server = Server(righe.colonnine(rngs))
+        server.flotta = righe
+        server.sensori = BancoFlotta(righe)
+    else:
+        server = Server([Colonnina(id=i+1, rng=r) for i, r in enumerate(rngs)])
+        server.sensori = BancoSensori(sorgente_sensori)
+    if cache_efe is not None:
+        usa_cache_efe(server, cache_efe)
+    return server, rng
+
+def usa_cache_efe(server, cache):
+    # Una sola cache per stazione: gli agenti con belief nello stesso bucket si scambiano i valori EFE
+    server.cache_efe = cache
+    for col in server.registro:
+        col.agente.usa_cache_efe(cache)
+
+def esegui_ciclo(server, rng, stats, ciclo, counter_anomalie, pubblicatore=None, comandi=None, registratore=None,
+                 pianificatore=None):
+    # Un ciclo completo di controllo; restituisce il contatore aggiornato delle anomalie.
+    # Con un eventi.Pianificatore arrivi e partenze vengono dalla coda eventi e si leggono solo le colonnine attive.
+    metriche = server.metriche
+    with (metriche.durata_ciclo() if metriche is not None else _SENZA_METRICHE):
+        # I comandi degli operatori arrivati nel frattempo entrano in vigore tutti insieme, a inizio ciclo
+        if comandi is not None:
+            with fase(server, "comandi"):
+                comandi.applica(server)
+
+        with fase(server, "arrivi"):
+            server.cache.nuovo_ciclo(ciclo)
+            if pianificatore is None:
+                gestisci_arrivi(server, rng)
+                colonnine = None
+            else:
+                colonnine = pianificatore.tick(ciclo)
+        with fase(server, "sensori"):
+            parametri_lista = leggi_colonnine(server, colonnine)
+            anomalie = conta_anomalie(parametri_lista)
+            aggiorna_info_globali(server, parametri_lista)
+        counter_anomalie += anomalie
+
+        richieste = server.prepara_richieste(parametri_lista)
+        with fase(server, "allocazione"):
+            parametri_con_potenza = server.assegna_potenza(parametri_lista, richieste)
+        with fase(server, "applicazione"):
+            applica_potenza(server, parametri_con_potenza)
+            if registratore is not None:
+                registratore.registra_ciclo(ciclo, parametri_con_potenza, server)
+
+        with fase(server, "statistiche"):
+            registra_statistiche(stats, server, ciclo, parametri_con_potenza, counter_anomalie)
+        with fase(server, "pubblicazione"):
+            chiudi_ciclo(server, ciclo, parametri_con_potenza, pubblicatore)
+
+    if metriche is not None:
+        metriche.incrementa("anomalie", anomalie)
+        metriche.imposta("colonnine_occupate", server.registro.conta("OCCUPATA"))
+        metriche.imposta("colonnine_bloccate", server.registro.conta("BLOCCATA_RAFF_FALLITO"))
+        metriche.imposta("potenza_totale_kw", sum(p.get("potenza_effettiva", 0) for p in parametri_con_potenza))
+        if server.cache_efe is not None:
+            metriche.imposta("cache_efe_hit_rate", server.cache_efe.hit_rate)
+        metriche.fine_ciclo(pubblicatore)
+    return counter_anomalie
+
+def avvia_stazione(num_colonnine=4, cicli=40, seed=42, grafici=True, orologio=None, pubblicatore=None,
+                   comandi=None, sorgente_sensori=None, registratore=None, metriche=None, cache_efe=None,
+                   eventi=False, arrivi=None, checkpoint=None, lavoratori_decisioni=None, flotta=False):
+    # flotta=True: colonnine sul backend struct-of-arrays (vedi crea_stazione).
+    # lavoratori_decisioni: thread per le decide() degli agenti (None → in serie, 0 → default del pool).
+    # eventi=True: simulazione a eventi discreti (arrivi Poisson, o dalla traccia `arrivi` di (ciclo, id)).
+    # checkpoint: checkpoint.GestoreCheckpoint; si riprende dal più recente e `cicli` è il totale della corsa.
+    orologio = orologio if orologio is not None else OrologioReale(0.5)
+    server, rng = crea_stazione(num_colonnine, seed, sorgente_sensori, cache_efe, flotta)
+    server.metriche = metriche
+    if lavoratori_decisioni is not None:
+        server.usa_pool_decisioni(lavoratori_decisioni or None)
+    pianificatore = None
+    if eventi or arrivi is not None:
+        from eventi import Pianificatore
+        pianificatore = Pianificatore(server, rng, arrivi)
+    stats = nuove_statistiche()
+
+    log.info("\n Avvio simulazione ACTIVE INFERENCE per %d cicli. %d colonnine.", cicli, num_colonnine)
+
+    counter_anomalie = 0
+    cicli_simulati = cicli
+    ultimo_ciclo = 0
+    if checkpoint is not None:
+        ripreso = checkpoint.ripristina(server, rng, stats, pianificatore)
+        if ripreso is not None:
+            ultimo_ciclo, counter_anomalie = ripreso
+
+    try:
+        for ciclo in range(ultimo_ciclo, cicli_simulati):
+            log.info("\n --- CICLO %d/%d ---", ciclo + 1, cicli_simulati)
+            counter_anomalie = esegui_ciclo(server, rng, stats, ciclo + 1, counter_anomalie,
+                                            pubblicatore=pubblicatore, comandi=comandi, registratore=registratore,
+                                            pianificatore=pianificatore)
+            if checkpoint is not None:
+                checkpoint.dopo_ciclo(ciclo + 1, server, rng, counter_anomalie, stats, pianificatore)
+            orologio.attendi()
+
+        # Fine corsa: anche l'ultimo ciclo va su disco, per poterla proseguire con più cicli
+        if checkpoint is not None and checkpoint.ultimo_ciclo != cicli_simulati:
+            checkpoint.salva(cicli_simulati, server, rng, counter_anomalie, stats, pianificatore)
+    finally:
+        server.chiudi_pool_decisioni()
+        # Le scritture sono su un thread a parte: al ritorno l'ultima fotografia è già su disco
+        if checkpoint is not None:
+            checkpoint.svuota()
+
+    # REPORT + GRAFICI
+    log.info("\n" + "="*80)
+    log.info(" RISULTATI SPERIMENTALI – ACTIVE INFERENCE")
+    log.info("="*80)
+    log.info("Durata: %d cicli", cicli_simulati)
+    log.info("Anomalie sensore totali: %d", counter_anomalie)
+    # Il report usa gli aggregati sull'intera corsa, non la sola storia recente degli anelli
+    log.info("Fallimenti raffreddamento totali: %d", stats.aggregato('fallimenti_raff').somma)
+    log.info("Credenza media finale p(fail raff. locale): %.3f", stats.aggregato('p_fail_medio').ultimo)
+    log.info("Media potenza erogata: %.1f kW (p95 %.1f kW)", stats.aggregato('potenza_totale').media,
+             stats.quantile('potenza_totale', 0.95))
+    log.info("Massima temperatura osservata: %.1f °C", stats.aggregato('temp_max').massimo)
+    if pianificatore is not None:
+        r = pianificatore.riepilogo()
+        log.info("Eventi gestiti: %d (arrivi persi %d, in coda %d) | colonnine lette: %.1f per ciclo",
+                 r["eventi_gestiti"], r["arrivi_persi"], r["in_coda"], r["colonnine_toccate"] / max(cicli_simulati, 1))
+    if cache_efe is not None:
+        r = cache_efe.riepilogo()
+        log.warning("Cache EFE: hit rate %.1f%% (%d/%d), %d voci, %d evizioni, %d invalidazioni | "
+                    "errore EFE min %.3f medio / %.3f max, stessa politica %.1f%% su %d verifiche",
+                    r["hit_rate"] * 100, r["hit"], r["hit"] + r["miss"], r["voci"], r["evizioni"],
+                    r["invalidazioni"], r["errore_medio"], r["errore_max"], r["concordanza_politica"] * 100,
+                    r["verifiche"])
+
+    if grafici:
+        mostra_grafici(stats)
+
+    log.info("\nSimulazione completata.\n")
+    return stats
+
+
+def avvia_headless(num_colonnine=4, cicli=40, seed=42, pubblicatore=None, comandi=None, sorgente_sensori=None,
+                   registratore=None, metriche=None, cache_efe=None, eventi=False, arrivi=None, checkpoint=None,
+                   lavoratori_decisioni=None, flotta=False):
+    # Esecuzione non interattiva: nessun login, nessun grafico, cicli senza attese
+    return avvia_stazione(num_colonnine, cicli, seed, grafici=False, orologio=OrologioVirtuale(),
+                          pubblicatore=pubblicatore, comandi=comandi, sorgente_sensori=sorgente_sensori,
+                          registratore=registratore, metriche=metriche, cache_efe=cache_efe,
+                          eventi=eventi, arrivi=arrivi, checkpoint=checkpoint,
+                          lavoratori_decisioni=lavoratori_decisioni, flotta=flotta)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Simulazione stazione di ricarica – Active Inference")
+    parser.add_argument("--headless", action="store_true", help="nessun login, nessun grafico, orologio virtuale")
+    parser.add_argument("--colonnine", type=int, default=4)
+    parser.add_argument("--cicli", type=int, default=40)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--log", default=None, help="livello di log (DEBUG, INFO, WARNING, ...)")
+    parser.add_argument("--mqtt", default=None, metavar="HOST[:PORTA]", help="pubblica la telemetria sul broker")
+    parser.add_argument("--sensori-mqtt", action="store_true",
+                        help="letture dei sensori dal broker (ev/sensori), sintetiche per le grandezze mai ricevute")
+    parser.add_argument("--telemetria-binaria", action="store_true", help="colonnine in formato binario su ev/stazione/binario")
+    parser.add_argument("--telemetria-delta", type=int, nargs="?", const=30, default=None, metavar="KEYFRAME",
+                        help="su ev/stazione solo i campi cambiati, con un keyframe completo ogni KEYFRAME cicli")
+    parser.add_argument("--traccia", default=None, metavar="CARTELLA", help="registra i cicli in una traccia colonnare")
+    parser.add_argument("--report", default=None, metavar="FILE", help="salva i grafici su file (.png/.svg) invece di mostrarli")
+    parser.add_argument("--cache-efe", type=int, default=None, metavar="VOCI",
+                        help="memorizza l'EFE su stati quantizzati (cache LRU condivisa tra gli agenti)")
+    parser.add_argument("--lavoratori-decisioni", type=int, default=None, metavar="N",
+                        help="thread per le decisioni degli agenti (0 = default del pool, 1 = in serie)")
+    parser.add_argument("--flotta", action="store_true", help="colonnine sul backend struct-of-arrays (array NumPy)")
+    parser.add_argument("--eventi", action="store_true", help="simulazione a eventi discreti (solo colonnine attive)")
+    parser.add_argument("--arrivi", default=None, metavar="CSV", help="arrivi da traccia (ciclo,id); implica --eventi")
+    parser.add_argument("--prob-arrivo", type=float, default=None, help="probabilità di arrivo per ciclo e colonnina libera")
+    parser.add_argument("--checkpoint", default=None, metavar="CARTELLA",
+                        help="checkpoint periodici della stazione; all'avvio si riprende dal più recente")
+    parser.add_argument("--checkpoint-ogni", type=int, default=100, metavar="CICLI")
+    parser.add_argument("--ricomincia", action="store_true", help="ignora i checkpoint esistenti")
+    parser.add_argument("--metriche", default=None, metavar="FILE", help="metriche Prometheus su file (textfile collector)")
+    parser.add_argument("--metriche-porta", type=int, default=None, help="espone /metrics su questa porta HTTP")
+    args = parser.parse_args()
+    if args.sensori_mqtt and not args.mqtt:
+        parser.error("--sensori-mqtt richiede --mqtt")
+
+    livello = args.log or ("WARNING" if args.headless else "DEBUG")
+    logging.basicConfig(level=livello.upper(), format="%(message)s")
+
+    client = pubblicatore = comandi = registratore = metriche = cache_efe = arrivi = checkpoint = sensori = None
+    # Configurazione da riga di comando: prevale anche su quella di un checkpoint da cui si riprende
+    config_cli = {}
+    if args.prob_arrivo is not None:
+        config_cli["prob_arrivo"] = args.prob_arrivo
+    CONFIG.update(config_cli)
+    if args.arrivi:
+        from eventi import carica_arrivi
+        arrivi = carica_arrivi(args.arrivi)
+    if args.cache_efe:
+        from cache_efe import CacheEFE
+        cache_efe = CacheEFE(args.cache_efe)
+    if args.metriche or args.metriche_porta:
+        from metriche import Metriche, avvia_endpoint
+        metriche = Metriche(file=args.metriche)
+        if args.metriche_porta:
+            avvia_endpoint(metriche, args.metriche_porta)
+    if args.checkpoint:
+        from checkpoint import GestoreCheckpoint
+        checkpoint = GestoreCheckpoint(args.checkpoint, args.checkpoint_ogni, riprendi=not args.ricomincia,
+                                       mantieni=config_cli)
+    if args.traccia:
+        from tracce import RegistratoreTraccia
+        registratore = RegistratoreTraccia(args.traccia)
+    if args.mqtt:
+        from telemetria import CodificatoreDelta, PubblicatoreTelemetria, crea_client_mqtt
+        from comandi import RicevitoreComandi
+        host, _, porta = args.mqtt.partition(":")
+        client = crea_client_mqtt(host, int(porta or 1883))
+        delta = CodificatoreDelta(args.telemetria_delta) if args.telemetria_delta else None
+        pubblicatore = PubblicatoreTelemetria(client, binario=args.telemetria_binaria, delta=delta)
+        comandi = RicevitoreComandi()
+        comandi.collega(client)
+        if args.sensori_mqtt:
+            sensori = SorgenteMQTT()
+            sensori.collega(client)
+
+    try:
+        stats = None
+        if args.headless:
+            stats = avvia_headless(args.colonnine, args.cicli, args.seed, pubblicatore=pubblicatore, comandi=comandi,
+                                   sorgente_sensori=sensori, registratore=registratore, metriche=metriche,
+                                   cache_efe=cache_efe, eventi=args.eventi, arrivi=arrivi, checkpoint=checkpoint,
+                                   lavoratori_decisioni=args.lavoratori_decisioni, flotta=args.flotta)
+        elif login():
+            stats = avvia_stazione(num_colonnine=args.colonnine, cicli=args.cicli, seed=args.seed,
+                                   grafici=args.report is None, pubblicatore=pubblicatore, comandi=comandi,
+                                   sorgente_sensori=sensori, registratore=registratore, metriche=metriche,
+                                   cache_efe=cache_efe, eventi=args.eventi, arrivi=arrivi, checkpoint=checkpoint,
+                                   lavoratori_decisioni=args.lavoratori_decisioni, flotta=args.flotta)
+        if stats is not None and args.report:
+            from report import salva_report
+            salva_report(stats, args.report)
+            log.warning("Report salvato in %s", args.report)
+    finally:
+        if metriche is not None and metriche.file:
+            metriche.scrivi_file(metriche.file)
+        if registratore is not None:
+            registratore.chiudi()
+        if checkpoint is not None:
+            checkpoint.chiudi()
+            log.warning("Checkpoint: %s", checkpoint.riepilogo())
+        if pubblicatore is not None:
+            from telemetria import chiudi_client_mqtt
+            pubblicatore.chiudi()
+            chiudi_client_mqtt(client)
+            log.info("Comandi: %s", comandi.metriche())
+            if pubblicatore.delta is not None:
+                log.warning("Telemetria delta: %s", pubblicatore.delta.riepilogo())
@@ -0,0 +1,194 @@
+import asyncio
+import copy
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from rifornimento import (
+    OrologioVirtuale,
+    aggiorna_info_globali,
+    applica_potenza,
+    chiudi_ciclo,
+    conta_anomalie,
+    crea_stazione,
+    gestisci_arrivi,
+    nuove_statistiche,
+    registra_statistiche,
+)
+
+log = logging.getLogger("rifornimento.runtime")
+
+# Usata quando un agente è in ritardo e non ha ancora mai deciso: nessuna richiesta al server
+DECISIONE_PRUDENTE = {
+    "raffreddamento_locale_richiesto": False,
+    "voto_raffreddamento_centrale": 0.0,
+    "downgrade_modalita_richiesto": False,
+    "rid_pot_richiesta": 0.0,
+    "motivazione_agente": "Decisione non disponibile entro la scadenza",
+    "temp": None,
+    "anomalia": False,
+}
+
+
+# TASK PER COLONNINA
+class TaskColonnina:
+    # Coppia Colonnina/AgenteLocale come task asyncio: riceve richieste dal server e risponde con
+    # telemetria e decisione. L'EFE (CPU) gira nell'executor, i sensori restano sul loop.
+    def __init__(self, col, executor):
+        self.col = col
+        self.executor = executor
+        self.richieste = asyncio.Queue()
+        self.ultima_decisione = None
+        self.in_ritardo = 0
+        self._decisione_in_corso = None
+        self._task = None
+
+    def avvia(self):
+        self._task = asyncio.create_task(self._esegui(), name=f"colonnina-{self.col.id}")
+
+    async def ferma(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+        if self._decisione_in_corso is not None:
+            await asyncio.gather(self._decisione_in_corso, return_exceptions=True)
+
+    async def _esegui(self):
+        while True:
+            richiesta, argomenti, futuro = await self.richieste.get()
+            if richiesta == "leggi":
+                futuro.set_result(await self.leggi(*argomenti))
+            else:
+                futuro.set_result(self._decidi(*argomenti))
+
+    async def leggi(self, letture=None):
+        # Punto di aggancio per sorgenti reali (I/O): oggi i sensori sono sincroni e istantanei
+        return self.col.leggi_parametri(letture)
+
+    def _decidi(self, info_globali, parametri):
+        # Un agente ancora impegnato sul tick precedente non riceve un nuovo lavoro: il server
+        # attende la decisione in corso entro la scadenza, poi ripiega sull'ultima disponibile
+        if self._decisione_in_corso is None or self._decisione_in_corso.done():
+            # Il calcolo lavora su un'istantanea dell'agente (belief comprese): intanto il thread di controllo
+            # può aggiornare raffreddamento e belief dell'agente vero senza condividerle con l'executor
+            istantanea = copy.copy(self.col.agente)
+            istantanea.beliefs = dict(istantanea.beliefs)
+            loop = asyncio.get_running_loop()
+            calcolo = loop.run_in_executor(self.executor, istantanea.decide, info_globali, parametri)
+            self._decisione_in_corso = asyncio.ensure_future(self._memorizza(calcolo, istantanea))
+        return self._decisione_in_corso
+
+    async def _memorizza(self, calcolo, istantanea):
+        decisione = await calcolo
+        # Di nuovo sul loop: quello che decide() ha scritto sull'istantanea passa all'agente vero
+        agente = self.col.agente
+        agente.ultima_temp_vista = istantanea.ultima_temp_vista
+        agente.voto_centrale_ultimo = istantanea.voto_centrale_ultimo
+        agente.campioni_estratti = istantanea.campioni_estratti
+        self.ultima_decisione = decisione
+        return decisione
+
+    async def richiedi(self, richiesta, *argomenti):
+        futuro = asyncio.get_running_loop().create_future()
+        await self.richieste.put((richiesta, argomenti, futuro))
+        return await futuro
+
+    def ripiego(self):
+        self.in_ritardo += 1
+        base = self.ultima_decisione if self.ultima_decisione is not None else DECISIONE_PRUDENTE
+        return {**base, "in_ritardo": True}
+
+
+# STAZIONE ASINCRONA
+class StazioneAsincrona:
+    def __init__(self, server, rng, scadenza=0.25, max_workers=None):
+        self.server = server
+        self.rng = rng
+        self.scadenza = scadenza
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="efe")
+        self.task = {}
+        self.latenze_tick = []
+
+    def _task_per(self, col):
+        task = self.task.get(col.id)
+        if task is None:
+            task = self.task[col.id] = TaskColonnina(col, self.executor)
+            task.avvia()
+        return task
+
+    async def tick(self, ciclo):
+        inizio = time.perf_counter()
+        server = self.server
+        server.cache.nuovo_ciclo(ciclo)
+        gestisci_arrivi(server, self.rng)
+
+        colonnine = list(server.registro)
+        letture = server.sensori.leggi(colonnine) if server.sensori is not None else [None] * len(colonnine)
+        parametri_lista = await asyncio.gather(*(self._task_per(col).richiedi("leggi", grezze)
+                                                 for col, grezze in zip(colonnine, letture)))
+        for col, p in zip(colonnine, parametri_lista):
+            server.cache.registra_letture(col, p)
+        aggiorna_info_globali(server, parametri_lista)
+
+        info = {
+            "quante_altre_calda": server.quante_colonnine_calide,
+            "media_voti_centrali": server.media_voti_centrali,
+        }
+        occupate = [(col, p) for col, p in zip(colonnine, parametri_lista) if p.get("stato") == "OCCUPATA"]
+        futuri = [await self._task_per(col).richiedi("decidi", info, p) for col, p in occupate]
+        if futuri:
+            await asyncio.wait(futuri, timeout=self.scadenza)
+
+        for (col, _), futuro in zip(occupate, futuri):
+            if futuro.done() and not futuro.cancelled() and futuro.exception() is None:
+                decisione = futuro.result()
+            else:
+                if futuro.done() and not futuro.cancelled():
+                    log.error("Decisione della colonnina %s fallita: %r", col.id, futuro.exception())
+                decisione = self.task[col.id].ripiego()
+                log.info(" Colonnina %s: agente in ritardo, uso l'ultima decisione", col.id)
+            server.cache.registra_decisione(col, decisione)
+
+        # Tutte le decisioni sono in cache: distribuisci_potenza non chiama più decide()
+        parametri_con_potenza = server.distribuisci_potenza(parametri_lista)
+        applica_potenza(server, parametri_con_potenza)
+        self.latenze_tick.append(time.perf_counter() - inizio)
+        return parametri_lista, parametri_con_potenza
+
+    def decisioni_in_ritardo(self):
+        return {id_col: t.in_ritardo for id_col, t in self.task.items() if t.in_ritardo}
+
+    async def chiudi(self):
+        await asyncio.gather(*(t.ferma() for t in self.task.values()))
+        self.executor.shutdown(wait=True)
+
+
+async def avvia_stazione_async(num_colonnine=4, cicli=40, seed=42, scadenza=0.25, orologio=None,
+                               pubblicatore=None, comandi=None, max_workers=None, sorgente_sensori=None):
+    orologio = orologio if orologio is not None else OrologioVirtuale()
+    server, rng = crea_stazione(num_colonnine, seed, sorgente_sensori)
+    stazione = StazioneAsincrona(server, rng, scadenza, max_workers)
+    stats = nuove_statistiche()
+    counter_anomalie = 0
+
+    try:
+        for ciclo in range(1, cicli + 1):
+            log.info("\n --- CICLO %d/%d ---", ciclo, cicli)
+            if comandi is not None:
+                comandi.applica(server)
+            parametri_lista, parametri_con_potenza = await stazione.tick(ciclo)
+            counter_anomalie += conta_anomalie(parametri_lista)
+            registra_statistiche(stats, server, ciclo, parametri_con_potenza, counter_anomalie)
+            chiudi_ciclo(server, ciclo, parametri_con_potenza, pubblicatore)
+            await asyncio.sleep(orologio.prossima_attesa())
+    finally:
+        await stazione.chiudi()
+
+    ritardi = stazione.decisioni_in_ritardo()
+    if ritardi:
+        log.warning("Decisioni arrivate oltre la scadenza: %s", ritardi)
+    return stats
+
+
+def avvia_runtime(num_colonnine=4, cicli=40, seed=42, scadenza=0.25, **kwargs):
+    return asyncio.run(avvia_stazione_async(num_colonnine, cicli, seed, scadenza, **kwargs))
@@ -0,0 +1,202 @@
+import argparse
+import contextlib
+import itertools
+import logging
+import math
+import os
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import numpy as np
+
+import rifornimento
+from rifornimento import CONFIG
+
+# SCENARI MONTE CARLO
+# Repliche indipendenti di avvia_stazione distribuite su un pool di processi.
+# Ogni replica riceve il proprio SeedSequence: i risultati non dipendono da quale worker la esegue.
+
+METRICHE = ("potenza_media", "temp_media", "temp_max", "efe_medio", "soc_medio_finale",
+            "fallimenti_raff", "raff_locali", "anomalie", "p_fail_finale")
+
+
+@contextlib.contextmanager
+def config_temporanea(modifiche):
+    originale = dict(CONFIG)
+    CONFIG.update(modifiche)
+    try:
+        yield CONFIG
+    finally:
+        CONFIG.clear()
+        CONFIG.update(originale)
+
+
+def genera_scenari(griglia, repliche=10, seed=0, num_colonnine=4, cicli=40):
+    # Prodotto cartesiano dei valori in griglia ({"soglia_temp_alta": [50, 55], ...}) × repliche
+    chiavi = sorted(griglia)
+    combinazioni = list(itertools.product(*(griglia[k] for k in chiavi)))
+    semi = np.random.SeedSequence(seed).spawn(len(combinazioni) * repliche)
+    scenari = []
+    for i, valori in enumerate(combinazioni):
+        for r in range(repliche):
+            scenari.append({
+                "id": len(scenari),
+                "config": dict(zip(chiavi, valori)),
+                "replica": r,
+                "seed": semi[i * repliche + r],
+                "num_colonnine": num_colonnine,
+                "cicli": cicli,
+            })
+    return scenari
+
+
+def riassumi_stats(stats):
+    return {
+        "potenza_media": stats.aggregato('potenza_totale').media,
+        "temp_media": stats.aggregato('temp_medie').media,
+        "temp_max": stats.aggregato('temp_max').massimo,
+        "efe_medio": stats.aggregato('efe_medio').media,
+        "soc_medio_finale": stats.aggregato('soc_medio').ultimo,
+        "fallimenti_raff": int(stats.aggregato('fallimenti_raff').somma),
+        "raff_locali": int(stats.aggregato('raffinamenti_locali').somma),
+        "anomalie": int(stats.aggregato('anomalie').ultimo),
+        "p_fail_finale": stats.aggregato('p_fail_medio').ultimo,
+    }
+
+
+def esegui_scenario(scenario):
+    # Eseguita nei worker: headless e con il log della simulazione limitato agli errori
+    logger = logging.getLogger("rifornimento")
+    livello = logger.level
+    logger.setLevel(logging.ERROR)
+    try:
+        with config_temporanea(scenario["config"]):
+            stats = rifornimento.avvia_headless(scenario["num_colonnine"], scenario["cicli"], scenario["seed"])
+            if scenario.get("report"):
+                # Il rendering avviene nel worker: i report delle repliche si disegnano in parallelo
+                from report import salva_report
+                salva_report(stats, scenario["report"])
+    finally:
+        logger.setLevel(livello)
+    return {
+        "id": scenario["id"],
+        "config": scenario["config"],
+        "replica": scenario["replica"],
+        "metriche": riassumi_stats(stats),
+    }
+
+
+def esegui_scenari(scenari, max_workers=None):
+    # Generatore: restituisce i risultati man mano che i worker terminano (ordine non garantito)
+    if max_workers == 1:
+        for scenario in scenari:
+            yield esegui_scenario(scenario)
+        return
+    with ProcessPoolExecutor(max_workers=max_workers) as pool:
+        futuri = [pool.submit(esegui_scenario, s) for s in scenari]
+        for futuro in as_completed(futuri):
+            yield futuro.result()
+
+
+def intervallo_confidenza(valori, livello=0.95):
+    valori = np.asarray(valori, dtype=float)
+    n = len(valori)
+    media = float(valori.mean()) if n else 0.0
+    if n < 2:
+        return media, media, media
+    # scipy serve solo al processo principale, in aggregazione: i worker non lo importano
+    from scipy.stats import t as student_t
+
+    semi_ampiezza = student_t.ppf(0.5 + livello / 2, n - 1) * valori.std(ddof=1) / np.sqrt(n)
+    return media, media - semi_ampiezza, media + semi_ampiezza
+
+
+class AggregatoreScenari:
+    def __init__(self, livello=0.95):
+        self.livello = livello
+        self._valori = defaultdict(lambda: defaultdict(list))
+
+    @staticmethod
+    def chiave(config):
+        return tuple(sorted(config.items()))
+
+    def aggiungi(self, risultato):
+        gruppo = self._valori[self.chiave(risultato["config"])]
+        for nome, valore in risultato["metriche"].items():
+            gruppo[nome].append(valore)
+
+    def riepilogo(self):
+        out = {}
+        for chiave, gruppo in self._valori.items():
+            out[chiave] = {
+                nome: {
+                    "n": len(valori),
+                    **dict(zip(("media", "ci_basso", "ci_alto"), intervallo_confidenza(valori, self.livello))),
+                }
+                for nome, valori in gruppo.items()
+            }
+        return out
+
+
+def _leggi_griglia(voci):
+    griglia = {}
+    for voce in voci:
+        chiave, uguale, valori = voce.partition("=")
+        if not uguale:
+            raise SystemExit(f"Voce di griglia senza '=': {voce!r} (atteso parametro=v1,v2,...)")
+        if chiave not in CONFIG:
+            raise SystemExit(f"Parametro CONFIG sconosciuto: {chiave}")
+        griglia[chiave] = [_valore_griglia(chiave, v) for v in valori.split(",")]
+    return griglia
+
+
+def _valore_griglia(chiave, testo):
+    # Stesso tipo del valore in CONFIG; per gli interi si accetta anche "55.0", non "55.5"
+    testo = testo.strip()
+    if not testo:
+        raise SystemExit(f"Valore vuoto per {chiave} nella griglia")
+    tipo = type(CONFIG[chiave])
+    if tipo is str:
+        return testo
+    try:
+        valore = float(testo)
+    except ValueError:
+        raise SystemExit(f"Valore non numerico per {chiave}: {testo!r}") from None
+    if not math.isfinite(valore):
+        raise SystemExit(f"Valore non finito per {chiave}: {testo!r}")
+    if tipo is int:
+        if not valore.is_integer():
+            raise SystemExit(f"Valore non intero per {chiave}: {testo!r}")
+        return int(valore)
+    return valore
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Repliche Monte Carlo della stazione in parallelo")
+    parser.add_argument("--griglia", action="append", default=[],
+                        help="parametro=v1,v2,... (ripetibile), es. soglia_temp_alta=50,55,60")
+    parser.add_argument("--repliche", type=int, default=20)
+    parser.add_argument("--colonnine", type=int, default=4)
+    parser.add_argument("--cicli", type=int, default=40)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--workers", type=int, default=os.cpu_count())
+    parser.add_argument("--report", default=None, metavar="CARTELLA", help="un report PNG per replica")
+    args = parser.parse_args()
+
+    scenari = genera_scenari(_leggi_griglia(args.griglia), args.repliche, args.seed, args.colonnine, args.cicli)
+    if args.report:
+        for s in scenari:
+            s["report"] = os.path.join(args.report, f"scenario_{s['id']:04d}.png")
+    aggregatore = AggregatoreScenari()
+    for k, risultato in enumerate(esegui_scenari(scenari, args.workers), start=1):
+        aggregatore.aggiungi(risultato)
+        m = risultato["metriche"]
+        print(f"[{k}/{len(scenari)}] {risultato['config']} replica {risultato['replica']}: "
+              f"potenza media {m['potenza_media']:.1f} kW | temp max {m['temp_max']:.1f}°C")
+
+    print("\n" + "=" * 80)
+    for chiave, metriche in aggregatore.riepilogo().items():
+        print(dict(chiave) or "configurazione base")
+        for nome in METRICHE:
+            r = metriche[nome]
+            print(f"  {nome:18s} {r['media']:10.3f}  IC95% [{r['ci_basso']:.3f}, {r['ci_alto']:.3f}]  n={r['n']}")
@@ -0,0 +1,117 @@
+import json
+import logging
+import threading
+
+import numpy as np
+
+log = logging.getLogger("rifornimento.sensori")
+
+# SENSORI DI FLOTTA
+# Le letture grezze di tutte le colonnine per un tick arrivano da una sorgente in blocco (array allineati agli id).
+GRANDEZZE = ("temperatura_esterna", "temperatura", "degrado", "tensione")
+
+TOPIC_SENSORI = "ev/sensori"
+
+
+class LettureEsaurite(Exception):
+    # Una SorgenteReplay non ciclica ha restituito tutti i tick registrati
+    pass
+
+
+class SorgenteSintetica:
+    # Stessa distribuzione di Sensore.rileva, ma una sola estrazione vettoriale per grandezza
+    def __init__(self, rng=None, prob_picco=0.1):
+        self.rng = rng if rng is not None else np.random.default_rng()
+        self.prob_picco = prob_picco
+
+    def campiona(self, ids):
+        n = len(ids)
+        rng = self.rng
+        picco = rng.random(n) < self.prob_picco
+        temperatura = np.where(picco, rng.uniform(50, 90, n), rng.uniform(20, 40, n))
+        return {
+            "temperatura_esterna": np.round(rng.uniform(10, 45, n), 1),
+            "temperatura": np.round(temperatura, 1),
+            "degrado": np.round(rng.uniform(5, 15, n), 1),
+            "tensione": np.round(rng.uniform(350, 800, n), 1),
+        }
+
+
+class SorgenteReplay:
+    # Rilegge letture registrate: file .npz (o dict) con "id" (n,) e una matrice (cicli, n) per grandezza
+    def __init__(self, dati, ciclico=False):
+        if not isinstance(dati, dict):
+            with np.load(dati) as f:
+                dati = {k: f[k] for k in f.files}
+        self.id = np.asarray(dati["id"])
+        self.valori = {g: np.asarray(dati[g], dtype=float) for g in GRANDEZZE}
+        self.ciclico = ciclico
+        self.tick = 0
+        self._colonna = {int(i): k for k, i in enumerate(self.id)}
+
+    def __len__(self):
+        return len(self.valori["temperatura"])
+
+    def campiona(self, ids):
+        if self.tick >= len(self):
+            if not self.ciclico:
+                raise LettureEsaurite(f"Letture registrate esaurite dopo {len(self)} tick")
+            self.tick = 0
+        colonne = [self._colonna[int(i)] for i in ids]
+        out = {g: self.valori[g][self.tick, colonne] for g in GRANDEZZE}
+        self.tick += 1
+        return out
+
+
+class SorgenteMQTT:
+    # Letture live: ogni messaggio porta una o più colonnine ({"id": 3, "temperatura": 41.2, ...}).
+    # Si usa l'ultimo valore ricevuto; le grandezze mai ricevute arrivano dalla sorgente di riserva.
+    def __init__(self, riserva=None):
+        self.riserva = riserva if riserva is not None else SorgenteSintetica()
+        self._ultime = {}
+        self._lock = threading.Lock()
+        self.ricevuti = 0
+        self.scartati = 0
+
+    def collega(self, client, topic=TOPIC_SENSORI):
+        from telemetria import sottoscrivi_sempre
+
+        # Callback solo per questo topic: lo stesso client riceve anche i comandi (comandi.RicevitoreComandi)
+        client.message_callback_add(topic, lambda client, userdata, msg: self.ricevi(msg.payload))
+        sottoscrivi_sempre(client, topic)
+
+    def ricevi(self, payload):
+        try:
+            dati = json.loads(payload)
+            voci = dati if isinstance(dati, list) else [dati]
+            aggiornamenti = {int(v["id"]): {g: float(v[g]) for g in GRANDEZZE if g in v} for v in voci}
+        except (ValueError, TypeError, KeyError) as e:
+            self.scartati += 1
+            log.warning("Lettura sensori scartata: %s", e)
+            return
+        with self._lock:
+            for id_col, valori in aggiornamenti.items():
+                self._ultime.setdefault(id_col, {}).update(valori)
+        self.ricevuti += 1
+
+    def campiona(self, ids):
+        out = self.riserva.campiona(ids)
+        with self._lock:
+            ultime = [self._ultime.get(int(i), {}) for i in ids]
+        for g in GRANDEZZE:
+            for k, valori in enumerate(ultime):
+                if g in valori:
+                    out[g][k] = valori[g]
+        return out
+
+
+class BancoSensori:
+    def __init__(self, sorgente):
+        self.sorgente = sorgente
+
+    def leggi(self, colonnine):
+        # Una estrazione per tutta la flotta; restituisce le letture per colonnina, nell'ordine dato
+        ids = [col.id for col in colonnine]
+        colonne = self.sorgente.campiona(ids)
+        righe = zip(*(colonne[g].tolist() for g in GRANDEZZE))
+        return [dict(zip(GRANDEZZE, riga)) for riga in righe]
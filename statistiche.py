@@ -0,0 +1,312 @@
+import math
+
+import numpy as np
+
+# STATISTICHE IN STREAMING
+# Memoria costante per stazioni che girano per mesi: per ogni grandezza un anello con la storia recente
+# (per i grafici), una panoramica decimata min/max dell'intera corsa e aggregati aggiornati in O(1)
+# (per il report finale).
+
+STORICO_PREDEFINITO = 3600          # cicli conservati negli anelli (un'ora a un ciclo al secondo)
+PUNTI_PANORAMICA = 1024             # bucket min/max per la panoramica dell'intera corsa
+QUANTILI_PREDEFINITI = (0.5, 0.95, 0.99)
+
+GRANDEZZE = (
+    'efe_medio',
+    'temp_medie',
+    'temp_max',
+    'soc_medio',
+    'fallimenti_raff',
+    'p_fail_medio',
+    'var_temp_medio',
+    'potenza_totale',
+    'anomalie',
+    'raffinamenti_locali',
+)
+
+
+class Anello:
+    # Buffer circolare preallocato: gli ultimi `capacita` valori, dal più vecchio al più recente
+    def __init__(self, capacita, dtype=float):
+        self._buffer = np.zeros(capacita, dtype=dtype)
+        self.capacita = capacita
+        self.scritti = 0
+
+    def aggiungi(self, valore):
+        self._buffer[self.scritti % self.capacita] = valore
+        self.scritti += 1
+
+    def __len__(self):
+        return min(self.scritti, self.capacita)
+
+    def esporta_stato(self):
+        return {"buffer": self._buffer.copy(), "scritti": np.array(self.scritti)}
+
+    def carica_stato(self, stato):
+        self._buffer[:] = stato["buffer"]
+        self.scritti = int(stato["scritti"])
+
+    def valori(self):
+        if self.scritti <= self.capacita:
+            return self._buffer[:self.scritti].copy()
+        inizio = self.scritti % self.capacita
+        return np.concatenate((self._buffer[inizio:], self._buffer[:inizio]))
+
+
+class Aggregato:
+    # Media e varianza con l'algoritmo di Welford, più somma, minimo, massimo e ultimo valore
+    def __init__(self):
+        self.n = 0
+        self.media = 0.0
+        self._m2 = 0.0
+        self.somma = 0.0
+        self.minimo = math.inf
+        self.massimo = -math.inf
+        self.ultimo = 0.0
+
+    def aggiungi(self, x):
+        x = float(x)
+        self.n += 1
+        delta = x - self.media
+        self.media += delta / self.n
+        self._m2 += delta * (x - self.media)
+        self.somma += x
+        self.minimo = min(self.minimo, x)
+        self.massimo = max(self.massimo, x)
+        self.ultimo = x
+
+    def esporta_stato(self):
+        return {"valori": np.array([self.n, self.media, self._m2, self.somma, self.minimo, self.massimo, self.ultimo])}
+
+    def carica_stato(self, stato):
+        n, self.media, self._m2, self.somma, self.minimo, self.massimo, self.ultimo = stato["valori"].tolist()
+        self.n = int(n)
+
+    @property
+    def varianza(self):
+        return self._m2 / (self.n - 1) if self.n > 1 else 0.0
+
+    @property
+    def deviazione(self):
+        return math.sqrt(self.varianza)
+
+
+class QuantileP2:
+    # Stima di un quantile con l'algoritmo P² (Jain & Chlamtac): cinque marcatori, memoria costante
+    def __init__(self, p):
+        self.p = p
+        self._iniziali = []
+        self._q = None
+        self._n = None
+        self._desiderate = None
+        self._incrementi = (0.0, p / 2, p, (1 + p) / 2, 1.0)
+
+    def aggiungi(self, x):
+        x = float(x)
+        if self._q is None:
+            self._iniziali.append(x)
+            if len(self._iniziali) == 5:
+                self._q = sorted(self._iniziali)
+                self._n = [0, 1, 2, 3, 4]
+                p = self.p
+                self._desiderate = [0.0, 2 * p, 4 * p, 2 + 2 * p, 4.0]
+            return
+
+        q, n = self._q, self._n
+        if x < q[0]:
+            q[0] = x
+            k = 0
+        elif x >= q[4]:
+            q[4] = x
+            k = 3
+        else:
+            k = 0
+            while x >= q[k + 1]:
+                k += 1
+        for i in range(k + 1, 5):
+            n[i] += 1
+        for i in range(5):
+            self._desiderate[i] += self._incrementi[i]
+
+        # Aggiusta i tre marcatori centrali verso le posizioni desiderate
+        for i in (1, 2, 3):
+            d = self._desiderate[i] - n[i]
+            if (d >= 1 and n[i + 1] - n[i] > 1) or (d <= -1 and n[i - 1] - n[i] < -1):
+                d = 1 if d > 0 else -1
+                candidato = q[i] + d / (n[i + 1] - n[i - 1]) * (
+                    (n[i] - n[i - 1] + d) * (q[i + 1] - q[i]) / (n[i + 1] - n[i])
+                    + (n[i + 1] - n[i] - d) * (q[i] - q[i - 1]) / (n[i] - n[i - 1])
+                )
+                if not q[i - 1] < candidato < q[i + 1]:
+                    candidato = q[i] + d * (q[i + d] - q[i]) / (n[i + d] - n[i])
+                q[i] = candidato
+                n[i] += d
+
+    def esporta_stato(self):
+        # Prima dei cinque campioni iniziali bastano quelli; poi marcatori, posizioni e posizioni desiderate
+        if self._q is None:
+            return {"iniziali": np.array(self._iniziali, dtype=float)}
+        return {"marcatori": np.array([self._q, self._n, self._desiderate], dtype=float)}
+
+    def carica_stato(self, stato):
+        if "marcatori" in stato:
+            q, n, desiderate = stato["marcatori"].tolist()
+            self._q, self._n, self._desiderate = q, [int(x) for x in n], desiderate
+            self._iniziali = []
+        else:
+            self._q = self._n = self._desiderate = None
+            self._iniziali = stato["iniziali"].tolist()
+
+    def valore(self):
+        if self._q is not None:
+            return self._q[2]
+        if not self._iniziali:
+            return 0.0
+        return float(np.percentile(self._iniziali, self.p * 100))
+
+
+class Decimatore:
+    # Panoramica dell'intera corsa a memoria costante: bucket (min, max, media) di larghezza crescente.
+    # Quando i bucket sono tutti pieni si fondono a coppie e la larghezza raddoppia.
+    def __init__(self, capacita=PUNTI_PANORAMICA):
+        self.capacita = capacita - capacita % 2
+        self.larghezza = 1
+        self.x = np.zeros(self.capacita)
+        self.minimo = np.zeros(self.capacita)
+        self.massimo = np.zeros(self.capacita)
+        self.somma = np.zeros(self.capacita)
+        self.conteggio = np.zeros(self.capacita, dtype=np.int64)
+        self.n = 0
+        self._aperto = False
+
+    def aggiungi(self, x, y):
+        k = self.n
+        if not self._aperto:
+            self.x[k] = x
+            self.minimo[k] = self.massimo[k] = self.somma[k] = y
+            self.conteggio[k] = 1
+            self._aperto = True
+        else:
+            if y < self.minimo[k]:
+                self.minimo[k] = y
+            if y > self.massimo[k]:
+                self.massimo[k] = y
+            self.somma[k] += y
+            self.conteggio[k] += 1
+        if self.conteggio[k] == self.larghezza:
+            self._aperto = False
+            self.n += 1
+            if self.n == self.capacita:
+                self._dimezza()
+
+    def _dimezza(self):
+        meta = self.capacita // 2
+        self.x[:meta] = self.x[0::2]
+        self.minimo[:meta] = np.minimum(self.minimo[0::2], self.minimo[1::2])
+        self.massimo[:meta] = np.maximum(self.massimo[0::2], self.massimo[1::2])
+        self.somma[:meta] = self.somma[0::2] + self.somma[1::2]
+        self.conteggio[:meta] = self.conteggio[0::2] + self.conteggio[1::2]
+        self.n = meta
+        self.larghezza *= 2
+
+    def esporta_stato(self):
+        return {"x": self.x.copy(), "minimo": self.minimo.copy(), "massimo": self.massimo.copy(),
+                "somma": self.somma.copy(), "conteggio": self.conteggio.copy(),
+                "posizione": np.array([self.larghezza, self.n, self._aperto])}
+
+    def carica_stato(self, stato):
+        for nome in ("x", "minimo", "massimo", "somma", "conteggio"):
+            getattr(self, nome)[:] = stato[nome]
+        larghezza, n, aperto = stato["posizione"].tolist()
+        self.larghezza, self.n, self._aperto = int(larghezza), int(n), bool(aperto)
+
+    def valori(self):
+        # x (primo ciclo del bucket), min, max, media; include il bucket ancora aperto
+        fine = self.n + self._aperto
+        return (self.x[:fine].copy(), self.minimo[:fine].copy(), self.massimo[:fine].copy(),
+                self.somma[:fine] / self.conteggio[:fine])
+
+
+class StatisticheStazione:
+    # Si legge come il vecchio dict di liste (stats['temp_medie'] → storia recente come array),
+    # ma la memoria non cresce con la durata della corsa
+    def __init__(self, storico=STORICO_PREDEFINITO, quantili=QUANTILI_PREDEFINITI, punti_panoramica=PUNTI_PANORAMICA):
+        self.storico = storico
+        self.quantili = tuple(quantili)
+        self.anelli = {'cicli': Anello(storico, dtype=np.int64)}
+        self.anelli.update({g: Anello(storico) for g in GRANDEZZE})
+        self.aggregati = {g: Aggregato() for g in GRANDEZZE}
+        self.sketch = {g: [QuantileP2(q) for q in self.quantili] for g in GRANDEZZE}
+        self.panoramica = {g: Decimatore(punti_panoramica) for g in GRANDEZZE}
+
+    def registra(self, ciclo, valori):
+        self.anelli['cicli'].aggiungi(ciclo)
+        for g in GRANDEZZE:
+            x = valori[g]
+            self.anelli[g].aggiungi(x)
+            self.aggregati[g].aggiungi(x)
+            self.panoramica[g].aggiungi(ciclo, x)
+            for s in self.sketch[g]:
+                s.aggiungi(x)
+
+    # CHECKPOINT
+    def esporta_stato(self):
+        # Tutto lo stato in array con nomi piatti ("anello/temp_medie/buffer", ...), per checkpoint.py
+        parti = [(f"anello/{nome}", a) for nome, a in self.anelli.items()]
+        parti += [(f"aggregato/{g}", self.aggregati[g]) for g in GRANDEZZE]
+        parti += [(f"sketch/{g}/{i}", s) for g in GRANDEZZE for i, s in enumerate(self.sketch[g])]
+        parti += [(f"panoramica/{g}", self.panoramica[g]) for g in GRANDEZZE]
+        return {f"{prefisso}/{k}": v for prefisso, oggetto in parti for k, v in oggetto.esporta_stato().items()}
+
+    def carica_stato(self, stato):
+        # Stesse dimensioni (storico, quantili, punti della panoramica) di chi ha scritto il checkpoint
+        def parte(prefisso):
+            return {k[len(prefisso) + 1:]: v for k, v in stato.items() if k.startswith(prefisso + "/")}
+
+        for nome, a in self.anelli.items():
+            a.carica_stato(parte(f"anello/{nome}"))
+        for g in GRANDEZZE:
+            self.aggregati[g].carica_stato(parte(f"aggregato/{g}"))
+            for i, s in enumerate(self.sketch[g]):
+                s.carica_stato(parte(f"sketch/{g}/{i}"))
+            self.panoramica[g].carica_stato(parte(f"panoramica/{g}"))
+
+    def __getitem__(self, nome):
+        return self.anelli[nome].valori()
+
+    def __contains__(self, nome):
+        return nome in self.anelli
+
+    def __iter__(self):
+        return iter(self.anelli)
+
+    def __len__(self):
+        return len(self.anelli)
+
+    def keys(self):
+        return self.anelli.keys()
+
+    def items(self):
+        return ((nome, anello.valori()) for nome, anello in self.anelli.items())
+
+    @property
+    def cicli(self):
+        return self.anelli['cicli'].scritti
+
+    def aggregato(self, nome):
+        return self.aggregati[nome]
+
+    def quantile(self, nome, p):
+        return self.sketch[nome][self.quantili.index(p)].valore()
+
+    def riepilogo(self):
+        # Sintesi dell'intera corsa, indipendente dalla lunghezza dello storico
+        out = {}
+        for g in GRANDEZZE:
+            a = self.aggregati[g]
+            voce = {"media": a.media, "dev_std": a.deviazione, "min": a.minimo if a.n else 0.0,
+                    "max": a.massimo if a.n else 0.0, "somma": a.somma, "ultimo": a.ultimo}
+            for s in self.sketch[g]:
+                voce[f"p{s.p * 100:g}"] = s.valore()
+            out[g] = voce
+        return out
@@ -0,0 +1,626 @@
+import json
+import logging
+import struct
+import threading
+import time
+from collections import deque
+from itertools import compress
+
+import numpy as np
+
+from metriche import TOPIC_METRICHE
+
+log = logging.getLogger("rifornimento.telemetria")
+
+# TOPIC (gli stessi sottoscritti dal flow Node-RED)
+TOPIC_COLONNINE = "ev/stazione"
+TOPIC_SERVER = "ev/stazione/server"
+TOPIC_RIFORNIMENTO = "ev/rifornimento"
+TOPIC_COLONNINE_BINARIO = "ev/stazione/binario"
+
+POLITICHE_PRESSIONE = ("coalesci", "scarta_vecchi", "scarta_nuovi")
+
+
+def _json_default(obj):
+    # Lettura (rifornimento) e altri record con la stessa interfaccia diventano il dict di sempre
+    if hasattr(obj, "come_dict"):
+        return obj.come_dict()
+    if isinstance(obj, np.generic):
+        return obj.item()
+    if isinstance(obj, np.ndarray):
+        return obj.tolist()
+    return str(obj)
+
+
+def serializza(payload):
+    return json.dumps(payload, default=_json_default, ensure_ascii=False)
+
+
+def messaggi_ciclo(ciclo, parametri_con_potenza, alert, totale_kw):
+    # Un messaggio per topic e per ciclo: la telemetria delle colonnine viaggia in un unico batch
+    return {
+        TOPIC_COLONNINE: {"ciclo": ciclo, "colonnine": parametri_con_potenza},
+        TOPIC_SERVER: {
+            "ciclo": ciclo,
+            "alert": alert,
+            "totale_kw": totale_kw,
+            "occupate": sum(1 for p in parametri_con_potenza if p.get("stato") == "OCCUPATA"),
+            "bloccate": sum(1 for p in parametri_con_potenza if str(p.get("stato", "")).startswith("BLOCCATA")),
+        },
+        TOPIC_RIFORNIMENTO: {
+            "ciclo": ciclo,
+            "batterie": [
+                {"id": p["id"], "veicolo": p.get("veicolo"), "soc": p.get("soc"),
+                 "potenza_effettiva": p.get("potenza_effettiva", 0)}
+                for p in parametri_con_potenza if p.get("stato") == "OCCUPATA"
+            ],
+        },
+    }
+
+
+# FORMATO BINARIO
+# Una riga a dimensione fissa per colonnina (57 byte contro ~900 del JSON), preceduta dal ciclo (uint32).
+# Stato, modalità e veicolo sono i codici di rifornimento.STATI / MODALITA / NOMI_VEICOLI (-1 = nessuno),
+# le azioni una maschera di bit su AZIONI; la diagnostica testuale si ricostruisce dai flag.
+AZIONI = ("LIBERA", "OK", "OK (Priorità SOC bassa)", "RIPOSO: Potenza Non Disponibile", "FERMA: Temp Critica",
+          "FERMA: Degrado Alto", "DOWNGRADE: Boost → Eco", "RIDUCI", "RAFF. LOCALE APPROVATO")
+_BIT_AZIONE = {a: 1 << i for i, a in enumerate(AZIONI)}
+FLAG = ("anomalia", "anomalia_pericolosa", "raffreddamento_attivo", "raffreddamento_locale_attivo",
+        "raff_fallito", "bloccata")
+
+DTYPE_COLONNINA = np.dtype([
+    ("id", "<i4"), ("stato", "i1"), ("veicolo", "i1"), ("modalita", "i1"), ("modalita_effettiva", "i1"),
+    ("soc", "<f4"), ("temperatura", "<f4"), ("temperatura_esterna", "<f4"), ("temperatura_predetta", "<f4"),
+    ("temperatura_reale_grezzo", "<f4"), ("gap_rilevato", "<f4"), ("media_temperatura", "<f4"),
+    ("degrado", "<f4"), ("tensione", "<f4"), ("potenza_richiesta", "<f4"), ("potenza_effettiva", "<f4"),
+    ("fail_raff_consecutivi", "u1"), ("flag", "u1"), ("azioni", "<u2"), ("priorita_raff", "u1"),
+])
+_INTESTAZIONE = struct.Struct("<I")
+
+
+def _maschera_azioni(azioni):
+    maschera, priorita = 0, 0
+    for a in azioni:
+        bit = _BIT_AZIONE.get(a)
+        if bit is None:
+            if a.startswith("RIDUCI"):
+                bit = _BIT_AZIONE["RIDUCI"]
+            elif a.startswith("RAFF. LOCALE APPROVATO"):
+                bit = _BIT_AZIONE["RAFF. LOCALE APPROVATO"]
+                priorita = int("".join(c for c in a if c.isdigit()) or 0)
+            else:
+                continue
+        maschera |= bit
+    return maschera, priorita
+
+
+def _riga_binaria(p, codici):
+    stati, modalita, veicoli = codici
+    if hasattr(p, "_stato"):
+        # Lettura: i codici ci sono già
+        stato, veicolo, mod = p._stato, p._veicolo, p._modalita
+        mod_eff = p._modalita_effettiva if p._modalita_effettiva >= 0 else mod
+    else:
+        stato = stati.get(p.get("stato"), -1)
+        veicolo = veicoli.get(p.get("veicolo"), -1)
+        mod = modalita.get(p.get("modalita"), -1)
+        mod_eff = modalita.get(p.get("modalita_effettiva"), mod)
+    flag = 0
+    for i, nome in enumerate(FLAG):
+        # raff_fallito e bloccata sono attributi di Lettura, non chiavi del vecchio dict
+        if getattr(p, nome, None) is True or p.get(nome, False):
+            flag |= 1 << i
+    azioni, priorita = _maschera_azioni(p.get("azioni", ()))
+    return (p["id"], stato, veicolo, mod, mod_eff, p.get("soc", 0.0), p.get("temperatura", 0.0),
+            p.get("temperatura_esterna", 0.0), p.get("temperatura_predetta", 0.0),
+            p.get("temperatura_reale_grezzo", 0.0), p.get("gap_rilevato", 0.0), p.get("media_temperatura", 0.0),
+            p.get("degrado", 0.0), p.get("tensione", 0.0), p.get("potenza_richiesta", 0.0),
+            p.get("potenza_effettiva", 0.0), p.get("fail_raff_consecutivi", 0), flag, azioni, priorita)
+
+
+def _codici():
+    from rifornimento import MODALITA, NOMI_VEICOLI, STATI
+    return ({s: i for i, s in enumerate(STATI)}, {m: i for i, m in enumerate(MODALITA)},
+            {v: i for i, v in enumerate(NOMI_VEICOLI)})
+
+
+def righe_binarie(parametri, codici=None):
+    codici = codici if codici is not None else _codici()
+    return np.array([_riga_binaria(p, codici) for p in parametri], dtype=DTYPE_COLONNINA)
+
+
+def codifica_binaria(ciclo, parametri):
+    # Le righe si scrivono direttamente nel buffer del payload (bytearray): nessuna copia intermedia
+    codici = _codici()
+    buffer = bytearray(_INTESTAZIONE.size + len(parametri) * DTYPE_COLONNINA.itemsize)
+    _INTESTAZIONE.pack_into(buffer, 0, ciclo)
+    righe = np.frombuffer(buffer, dtype=DTYPE_COLONNINA, count=len(parametri), offset=_INTESTAZIONE.size)
+    righe[:] = [_riga_binaria(p, codici) for p in parametri]
+    return buffer
+
+
+def decodifica_binaria(payload):
+    # Vista in sola lettura sul payload ricevuto, senza copiarlo
+    ciclo, = _INTESTAZIONE.unpack_from(payload, 0)
+    return ciclo, np.frombuffer(payload, dtype=DTYPE_COLONNINA, offset=_INTESTAZIONE.size)
+
+
+# TELEMETRIA DELTA
+# Per ogni colonnina si ricorda l'ultimo valore pubblicato di ogni campo e su ev/stazione vanno solo i campi
+# cambiati. Le grandezze analogiche rumorose hanno una banda morta rispetto all'ultimo valore inviato, quindi
+# anche una deriva lenta prima o poi si pubblica. Ogni `ogni_keyframe` cicli parte un keyframe completo
+# (retained) da cui i sottoscrittori si risincronizzano; i delta riportano il ciclo del keyframe di riferimento.
+# Il confronto è vettoriale sulle righe di DTYPE_COLONNINA; i valori inviati sono quelli originali del record.
+OGNI_KEYFRAME = 30
+BANDE_MORTE = {
+    "temperatura": 0.5,
+    "temperatura_esterna": 0.5,
+    "temperatura_predetta": 0.5,
+    "temperatura_reale_grezzo": 0.5,
+    "media_temperatura": 0.5,
+    "gap_rilevato": 0.5,
+    "degrado": 0.5,
+    "tensione": 5.0,
+}
+_CAMPI_DELTA = ("stato", "veicolo", "modalita", "modalita_effettiva", "soc", "temperatura", "temperatura_esterna",
+                "temperatura_predetta", "temperatura_reale_grezzo", "gap_rilevato", "media_temperatura", "degrado",
+                "tensione", "potenza_richiesta", "potenza_effettiva", "fail_raff_consecutivi")
+# Flag che sono anche chiavi del record (raff_fallito e bloccata entrano solo in diagnostica e alert)
+_FLAG_RECORD = ("anomalia", "anomalia_pericolosa", "raffreddamento_attivo", "raffreddamento_locale_attivo")
+# Campi confrontati per valore rispetto all'ultimo inviato; di quelli dict (agente) vanno solo le voci cambiate
+_CAMPI_OGGETTO = ("azioni", "diagnostica", "alert", "agente")
+_MANCANTE = object()
+
+# Formato dei delta: ogni voce ha "id" e i campi con il nuovo valore; "_parziali" porta le voci cambiate dei
+# campi dict ({"agente": {"min_efe": ...}}), "_rimossi" le chiavi che il record completo non ha più.
+
+
+class CodificatoreDelta:
+    def __init__(self, ogni_keyframe=OGNI_KEYFRAME, bande=None):
+        self.ogni_keyframe = ogni_keyframe
+        self.bande = dict(BANDE_MORTE, **(bande or {}))
+        self._codici = None
+        self._indice = {}                                   # id colonnina → riga di _inviato
+        self._inviato = np.zeros(64, dtype=DTYPE_COLONNINA)  # ultimi valori pubblicati
+        self._noto = np.zeros(64, dtype=bool)                # il sottoscrittore ha il record completo
+        self._chiavi = [frozenset()] * 64                    # chiavi del record inviato
+        self._oggetti = [None] * 64                          # ultimi valori di _CAMPI_OGGETTO inviati
+        self._forza = True
+        self.ultimo_keyframe = None
+        # Statistiche
+        self.cicli = 0
+        self.keyframe = 0
+        self.byte = 0
+        self.byte_ultimo = 0
+        self.campi = 0
+        self.tempo_s = 0.0
+
+    def forza_keyframe(self):
+        self._forza = True
+
+    def _righe(self, ids):
+        nuovi = [i for i in ids if i not in self._indice]
+        if nuovi:
+            richieste = len(self._indice) + len(nuovi)
+            if richieste > len(self._inviato):
+                capacita = max(richieste, 2 * len(self._inviato))
+                aggiunte = capacita - len(self._inviato)
+                self._inviato = np.concatenate((self._inviato, np.zeros(aggiunte, dtype=DTYPE_COLONNINA)))
+                self._noto = np.concatenate((self._noto, np.zeros(aggiunte, dtype=bool)))
+                self._chiavi.extend([frozenset()] * aggiunte)
+                self._oggetti.extend([None] * aggiunte)
+            for i in nuovi:
+                self._indice[i] = len(self._indice)
+        return np.fromiter((self._indice[i] for i in ids), dtype=np.intp, count=len(ids))
+
+    def _ricorda(self, r, p, chiavi):
+        self._chiavi[r] = chiavi
+        self._oggetti[r] = {campo: p[campo] for campo in _CAMPI_OGGETTO if campo in chiavi}
+
+    def codifica(self, ciclo, parametri):
+        # Restituisce (payload JSON, keyframe); keyframe va pubblicato retained
+        inizio = time.perf_counter()
+        if self._codici is None:
+            self._codici = _codici()
+        righe = righe_binarie(parametri, self._codici)
+        idx = self._righe(righe["id"].tolist())
+        keyframe = self._forza or self.ultimo_keyframe is None or ciclo - self.ultimo_keyframe >= self.ogni_keyframe
+
+        if keyframe:
+            # Chi non compare nel keyframe dovrà ripartire da un record completo
+            self._noto[:] = False
+            self._noto[idx] = True
+            self._inviato[idx] = righe
+            for p, r in zip(parametri, idx.tolist()):
+                self._ricorda(r, p, frozenset(p.keys()))
+            self._forza = False
+            self.ultimo_keyframe = ciclo
+            self.keyframe += 1
+            self.campi += sum(len(self._chiavi[r]) for r in idx.tolist())
+            testo = serializza({"ciclo": ciclo, "tipo": "keyframe", "colonnine": parametri})
+        else:
+            testo = serializza({"ciclo": ciclo, "tipo": "delta", "keyframe": self.ultimo_keyframe,
+                                "colonnine": self._delta(parametri, righe, idx)})
+
+        self.cicli += 1
+        self.byte_ultimo = len(testo.encode())
+        self.byte += self.byte_ultimo
+        self.tempo_s += time.perf_counter() - inizio
+        return testo, keyframe
+
+    def _delta(self, parametri, righe, idx):
+        prec = self._inviato[idx]
+        nuovi = (~self._noto[idx]).tolist()
+        nomi, maschere = [], []
+        for campo in _CAMPI_DELTA:
+            banda = self.bande.get(campo, 0.0)
+            if banda:
+                cambiato = np.abs(righe[campo] - prec[campo]) >= banda
+            else:
+                cambiato = righe[campo] != prec[campo]
+            nomi.append(campo)
+            maschere.append(cambiato)
+            prec[campo] = np.where(cambiato, righe[campo], prec[campo])
+        flag_diversi = righe["flag"] ^ prec["flag"]
+        for nome in _FLAG_RECORD:
+            nomi.append(nome)
+            maschere.append(((flag_diversi >> FLAG.index(nome)) & 1).astype(bool))
+        for campo in ("flag", "azioni", "priorita_raff"):
+            prec[campo] = righe[campo]
+        cambi = np.column_stack(maschere).tolist()
+
+        uscita = []
+        for k, r in enumerate(idx.tolist()):
+            p = parametri[k]
+            chiavi = frozenset(p.keys())
+            if nuovi[k]:
+                voce = dict(p.items())
+                self._ricorda(r, p, chiavi)
+                uscita.append(voce)
+                self.campi += len(voce)
+                continue
+
+            voce = {"id": p["id"]}
+            for campo in compress(nomi, cambi[k]):
+                if campo in chiavi:
+                    voce[campo] = p[campo]
+            inviati = self._oggetti[r]
+            for campo in _CAMPI_OGGETTO:
+                if campo not in chiavi:
+                    inviati.pop(campo, None)
+                    continue
+                valore = p[campo]
+                vecchio = inviati.get(campo, _MANCANTE)
+                if isinstance(valore, dict) and isinstance(vecchio, dict) and valore.keys() == vecchio.keys():
+                    parziale = {k2: v for k2, v in valore.items() if vecchio[k2] != v}
+                    if parziale:
+                        voce.setdefault("_parziali", {})[campo] = parziale
+                elif vecchio is _MANCANTE or valore != vecchio:
+                    voce[campo] = valore
+                inviati[campo] = valore
+            # Chiavi comparse (es. modalita_effettiva uguale alla nominale) e sparite rispetto all'ultimo invio
+            prima = self._chiavi[r]
+            if chiavi != prima:
+                for campo in chiavi - prima:
+                    if campo not in voce and campo not in _CAMPI_OGGETTO:
+                        voce[campo] = p[campo]
+                if prima - chiavi:
+                    voce["_rimossi"] = sorted(prima - chiavi)
+                self._chiavi[r] = chiavi
+            if len(voce) > 1:
+                uscita.append(voce)
+                self.campi += len(voce) - 1
+
+        self._inviato[idx] = prec
+        self._noto[idx] = True
+        return uscita
+
+    def riepilogo(self):
+        return {
+            "cicli": self.cicli,
+            "keyframe": self.keyframe,
+            "byte_per_ciclo": self.byte / self.cicli if self.cicli else 0.0,
+            "byte_ultimo": self.byte_ultimo,
+            "campi_per_ciclo": self.campi / self.cicli if self.cicli else 0.0,
+            "codifica_ms": self.tempo_s / self.cicli * 1e3 if self.cicli else 0.0,
+        }
+
+
+class RicostruttoreDelta:
+    # Lato sottoscrittore: stato completo per colonnina a partire da keyframe e delta
+    def __init__(self):
+        self.colonnine = {}
+        self.keyframe = None
+        self.sincronizzato = False
+
+    def applica(self, payload):
+        dati = json.loads(payload) if isinstance(payload, (str, bytes, bytearray)) else payload
+        if dati.get("tipo") == "keyframe":
+            self.colonnine = {c["id"]: dict(c) for c in dati["colonnine"]}
+            self.keyframe = dati["ciclo"]
+            self.sincronizzato = True
+        elif not self.sincronizzato or dati.get("keyframe") != self.keyframe:
+            # Delta riferito a un keyframe che non abbiamo: si aspetta il prossimo
+            self.sincronizzato = False
+            return False
+        else:
+            for c in dati["colonnine"]:
+                record = self.colonnine.setdefault(c["id"], {})
+                for campo in c.get("_rimossi", ()):
+                    record.pop(campo, None)
+                for campo, parziale in c.get("_parziali", {}).items():
+                    record[campo] = {**record.get(campo, {}), **parziale}
+                record.update((k, v) for k, v in c.items() if k not in ("_rimossi", "_parziali"))
+        return True
+
+
+def differenze_ricostruzione(ricostruite, parametri, bande=None):
+    # Confronta lo stato del sottoscrittore con i record completi (come arrivano in JSON): stesse chiavi,
+    # stessi valori, a parte i campi con banda morta che possono restare indietro di meno della banda
+    bande = dict(BANDE_MORTE, **(bande or {}))
+    differenze = []
+    for p in json.loads(serializza(parametri)):
+        record = ricostruite.get(p["id"])
+        if record is None:
+            differenze.append((p["id"], None, "mancante"))
+            continue
+        for campo in p.keys() | record.keys():
+            atteso, valore = p.get(campo, _MANCANTE), record.get(campo, _MANCANTE)
+            if campo in bande and atteso is not _MANCANTE and valore is not _MANCANTE:
+                if abs(atteso - valore) >= bande[campo] + 1e-3:
+                    differenze.append((p["id"], campo, (valore, atteso)))
+            elif atteso != valore:
+                differenze.append((p["id"], campo, (valore, atteso)))
+    return differenze
+
+
+def verifica_delta(num_colonnine=30, cicli=60, seed=42, ogni_keyframe=10, **opzioni):
+    # Stazione headless pubblicata in delta e ricostruita a ogni ciclo; restituisce le differenze trovate
+    import rifornimento
+
+    class Verifica:
+        def __init__(self):
+            self.codificatore = CodificatoreDelta(ogni_keyframe)
+            self.ricostruttore = RicostruttoreDelta()
+            self.differenze = []
+
+        def pubblica_ciclo(self, ciclo, parametri_con_potenza, alert, totale_kw):
+            testo, _ = self.codificatore.codifica(ciclo, parametri_con_potenza)
+            self.ricostruttore.applica(testo)
+            self.differenze += [(ciclo, *d) for d in
+                                differenze_ricostruzione(self.ricostruttore.colonnine, parametri_con_potenza)]
+
+    verifica = Verifica()
+    rifornimento.avvia_headless(num_colonnine, cicli, seed, pubblicatore=verifica, **opzioni)
+    return {"differenze": verifica.differenze, **verifica.codificatore.riepilogo()}
+
+
+def codifica(topic, payload):
+    if topic == TOPIC_COLONNINE_BINARIO:
+        return codifica_binaria(payload["ciclo"], payload["colonnine"])
+    return serializza(payload)
+
+
+# PUBBLICATORE
+class PubblicatoreTelemetria:
+    # Il ciclo di simulazione si limita ad accodare; serializzazione e invio avvengono su un thread dedicato.
+    # Con la coda piena si applica la politica scelta invece di bloccare il chiamante.
+    def __init__(self, client, capacita=32, politica="coalesci", qos=0, binario=False, delta=None):
+        if politica not in POLITICHE_PRESSIONE:
+            raise ValueError(f"Politica di backpressure sconosciuta: {politica}")
+        self.client = client
+        self.binario = binario              # colonnine su TOPIC_COLONNINE_BINARIO invece del JSON
+        # CodificatoreDelta per ev/stazione. Codifica sul thread di invio, al momento dell'invio: con la
+        # coalescenza il delta si calcola comunque rispetto all'ultimo stato davvero pubblicato.
+        self.delta = delta
+        self.capacita = capacita
+        self.politica = politica
+        self.qos = qos
+
+        self.inviati = 0                    # batch di ciclo (pubblica_ciclo)
+        self.inviati_metriche = 0           # istantanee delle metriche (Metriche.pubblica)
+        self.scartati = 0
+        self.coalescenti = 0
+        self.errori = 0
+
+        self._coda = deque()
+        self._cond = threading.Condition()
+        self._attivo = True
+        self._thread = threading.Thread(target=self._esegui, name="pubblicatore-telemetria", daemon=True)
+        self._thread.start()
+
+    def pubblica_ciclo(self, ciclo, parametri_con_potenza, alert, totale_kw):
+        batch = messaggi_ciclo(ciclo, parametri_con_potenza, alert, totale_kw)
+        if self.binario:
+            batch[TOPIC_COLONNINE_BINARIO] = batch.pop(TOPIC_COLONNINE)
+        self.accoda(batch)
+
+    def accoda(self, batch):
+        with self._cond:
+            if not self._attivo:
+                return False
+            if len(self._coda) >= self.capacita:
+                if self.politica == "scarta_nuovi":
+                    self.scartati += 1
+                    return False
+                if self.politica == "scarta_vecchi":
+                    self._coda.popleft()
+                    self.scartati += 1
+                else:
+                    # Ogni payload è uno snapshot completo: il più recente sostituisce quello in attesa
+                    self._coda[-1] = {**self._coda[-1], **batch}
+                    self.coalescenti += 1
+                    return True
+            self._coda.append(batch)
+            self._cond.notify()
+            return True
+
+    def in_attesa(self):
+        with self._cond:
+            return len(self._coda)
+
+    def _esegui(self):
+        while True:
+            with self._cond:
+                while not self._coda and self._attivo:
+                    self._cond.wait()
+                if not self._coda:
+                    return
+                batch = self._coda.popleft()
+            for topic, payload in batch.items():
+                try:
+                    if topic == TOPIC_COLONNINE and self.delta is not None:
+                        dati, keyframe = self.delta.codifica(payload["ciclo"], payload["colonnine"])
+                        self.client.publish(topic, dati, qos=self.qos, retain=keyframe)
+                    else:
+                        self.client.publish(topic, codifica(topic, payload), qos=self.qos)
+                except Exception:
+                    self.errori += 1
+                    log.exception("Invio su %s fallito", topic)
+            # Con la coalescenza un batch può portare sia il ciclo sia le metriche: si contano entrambi
+            if TOPIC_METRICHE in batch:
+                self.inviati_metriche += 1
+            if any(topic != TOPIC_METRICHE for topic in batch):
+                self.inviati += 1
+
+    def chiudi(self, timeout=5.0):
+        # Svuota la coda (entro timeout) e ferma il thread
+        scadenza = time.monotonic() + timeout
+        with self._cond:
+            self._attivo = False
+            self._cond.notify_all()
+        self._thread.join(max(0.0, scadenza - time.monotonic()))
+
+    def statistiche(self):
+        # Conteggi in batch (cicli), non in singoli messaggi
+        statistiche = {
+            "inviati": self.inviati,
+            "inviati_metriche": self.inviati_metriche,
+            "scartati": self.scartati,
+            "coalescenti": self.coalescenti,
+            "errori": self.errori,
+            "in_coda": self.in_attesa(),
+        }
+        if self.delta is not None:
+            statistiche["delta"] = self.delta.riepilogo()
+        return statistiche
+
+
+# CLIENT
+def crea_client_mqtt(host="localhost", port=1883, client_id=""):
+    # paho viene importato solo quando serve davvero un broker
+    import paho.mqtt.client as mqtt
+
+    try:
+        client = mqtt.Client(mqtt.CallbackAPIVersion.VERSION2, client_id=client_id)
+    except AttributeError:
+        client = mqtt.Client(client_id=client_id)
+    client.connect_async(host, port)
+    client.loop_start()
+    return client
+
+
+def sottoscrivi_sempre(client, topic, qos=0):
+    # Sottoscrive ora e a ogni riconnessione (paho non ripristina le sottoscrizioni). L'on_connect già
+    # presente sul client viene richiamato per primo: più utenti dello stesso client si compongono.
+    precedente = client.on_connect
+
+    def on_connect(client, *args):
+        if precedente is not None:
+            precedente(client, *args)
+        client.subscribe(topic, qos=qos)
+
+    client.on_connect = on_connect
+    client.subscribe(topic, qos=qos)
+
+
+def chiudi_client_mqtt(client):
+    client.loop_stop()
+    client.disconnect()
+
+
+# BROKER FINTO (in-process, per test e simulazioni senza rete)
+class MessaggioFinto:
+    def __init__(self, topic, payload):
+        self.topic = topic
+        self.payload = payload.encode() if isinstance(payload, str) else payload
+
+
+def topic_corrisponde(filtro, topic):
+    parti_f, parti_t = filtro.split("/"), topic.split("/")
+    for i, parte in enumerate(parti_f):
+        if parte == "#":
+            return True
+        if i >= len(parti_t) or (parte != "+" and parte != parti_t[i]):
+            return False
+    return len(parti_f) == len(parti_t)
+
+
+class BrokerFinto:
+    def __init__(self, ritardo=0.0):
+        self.ritardo = ritardo
+        self.messaggi = []
+        self._client = []
+        self._lock = threading.Lock()
+
+    def client(self):
+        c = ClientFinto(self)
+        self._client.append(c)
+        return c
+
+    def consegna(self, topic, payload):
+        if self.ritardo:
+            time.sleep(self.ritardo)
+        with self._lock:
+            self.messaggi.append((topic, payload))
+        for c in self._client:
+            if not any(topic_corrisponde(f, topic) for f in c.sottoscrizioni):
+                continue
+            # Come paho: prima le callback per topic, on_message solo se nessuna corrisponde
+            messaggio = MessaggioFinto(topic, payload)
+            callback = [cb for f, cb in list(c.callback_topic.items()) if topic_corrisponde(f, topic)]
+            for cb in callback:
+                cb(c, None, messaggio)
+            if not callback and c.on_message:
+                c.on_message(c, None, messaggio)
+
+    def su_topic(self, topic):
+        with self._lock:
+            return [json.loads(p) for t, p in self.messaggi if t == topic]
+
+
+class ClientFinto:
+    # Stessa interfaccia minima di paho.mqtt.client.Client usata dal progetto
+    def __init__(self, broker):
+        self.broker = broker
+        self.sottoscrizioni = []
+        self.callback_topic = {}
+        self.on_message = None
+        self.on_connect = None
+
+    def publish(self, topic, payload, qos=0, retain=False):
+        self.broker.consegna(topic, payload)
+
+    def subscribe(self, topic, qos=0):
+        self.sottoscrizioni.append(topic)
+
+    def message_callback_add(self, sub, callback):
+        self.callback_topic[sub] = callback
+
+    def message_callback_remove(self, sub):
+        self.callback_topic.pop(sub, None)
+
+    def riconnetti(self):
+        # Come una riconnessione di paho: il broker ha perso le sottoscrizioni, poi arriva on_connect
+        self.sottoscrizioni = []
+        if self.on_connect:
+            self.on_connect(self, None, {}, 0)
+
+    def loop_start(self):
+        pass
+
+    def loop_stop(self):
+        pass
+
+    def disconnect(self):
+        pass
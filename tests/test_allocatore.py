@@ -0,0 +1,71 @@
+import numpy as np
+
+from allocatore import Allocatore
+
+RIDUZIONE_CALDE = 0.3
+MAX_POTENZA = 150
+
+
+# GREEDY ORIGINALE
+def alloca_riferimento(richieste, soc, calde, potenza_disponibile, min_attiva):
+    # Il ciclo di Server.distribuisci_potenza prima della versione vettoriale, colonnina per colonnina
+    ordine = sorted(range(len(richieste)), key=lambda i: soc[i])
+    assegnazioni = {i: 0.0 for i in ordine}
+    if sum(richieste[i] for i in ordine) <= potenza_disponibile:
+        for i in ordine:
+            allocata = richieste[i] * (1 - RIDUZIONE_CALDE) if calde[i] else richieste[i]
+            assegnazioni[i] = round(max(0, allocata), 1)
+    else:
+        restante = potenza_disponibile
+        for i in ordine:
+            richi = richieste[i] * ((1 - RIDUZIONE_CALDE) if calde[i] else 1.0)
+            asseg = min(richi, restante)
+            if restante <= 0 or asseg < min_attiva:
+                assegnazioni[i] = 0.0
+            else:
+                assegnazioni[i] = round(max(0.0, asseg), 1)
+                restante -= assegnazioni[i]
+        if restante > 0:
+            for i in ordine:
+                max_add = max(0.0, richieste[i] - assegnazioni[i])
+                if max_add <= 0:
+                    continue
+                add = min(max_add, restante)
+                assegnazioni[i] = round(assegnazioni[i] + add, 1)
+                restante -= add
+                if restante <= 0:
+                    break
+    return [round(max(0.0, min(assegnazioni[i], MAX_POTENZA)), 1) for i in range(len(richieste))]
+
+
+# CONFRONTO
+def test_alloca_uguale_al_greedy_originale():
+    rng = np.random.default_rng(0)
+    allocatore = Allocatore()
+    precedente = None
+    for prova in range(3000):
+        if precedente is not None and rng.random() < 0.5:
+            # Stesse colonnine del ciclo prima, poche chiavi cambiate: passa dal riordino incrementale
+            ids, soc = precedente
+            perm = rng.permutation(len(ids)) if rng.random() < 0.3 else np.arange(len(ids))
+            ids, soc = ids[perm], soc[perm].copy()
+            cambiati = rng.random(len(ids)) < 0.1
+            soc[cambiati] = np.round(rng.uniform(0, 100, cambiati.sum()), 1)
+        else:
+            n = int(rng.integers(1, 30))
+            ids = rng.permutation(100)[:n].astype(np.int64)
+            soc = np.round(rng.uniform(0, 100, n), 1)
+            if rng.random() < 0.3:
+                soc = rng.integers(0, 5, n) * 1.0
+        precedente = ids, soc
+        n = len(ids)
+        richieste = np.round(rng.uniform(0, 150, n), 1)
+        calde = rng.random(n) < 0.3
+        potenza = float(rng.choice([50, 100, 300, 1000]))
+        min_attiva = float(rng.choice([0.5, 1.0, 5.0]))
+
+        attese = alloca_riferimento(richieste.tolist(), soc.tolist(), calde.tolist(), potenza, min_attiva)
+        ottenute = allocatore.alloca(ids, richieste, soc, calde, potenza, min_attiva, RIDUZIONE_CALDE, MAX_POTENZA)
+        assert ottenute["potenza"].tolist() == attese, prova
+
+    assert allocatore.riordini_incrementali and allocatore.riordini_completi
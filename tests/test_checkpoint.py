@@ -0,0 +1,92 @@
+import json
+import os
+
+import numpy as np
+import pytest
+
+import checkpoint
+from rifornimento import CONFIG, OrologioVirtuale, avvia_stazione, crea_stazione
+
+
+@pytest.fixture
+def config_pulita():
+    originale = dict(CONFIG)
+    yield CONFIG
+    CONFIG.clear()
+    CONFIG.update(originale)
+
+
+# CONFIGURAZIONE
+def test_ripresa_mantiene_la_config_esplicita(tmp_path, config_pulita):
+    config_pulita["prob_arrivo"] = 0.1
+    config_pulita["metodo_kl"] = "monte_carlo"
+    gestore = checkpoint.GestoreCheckpoint(str(tmp_path), ogni=5)
+    avvia_stazione(4, 5, 3, grafici=False, orologio=OrologioVirtuale(), checkpoint=gestore)
+    gestore.chiudi()
+
+    config_pulita["prob_arrivo"] = 0.9
+    config_pulita["metodo_kl"] = "analitico"
+    gestore = checkpoint.GestoreCheckpoint(str(tmp_path), ogni=5, mantieni={"prob_arrivo"})
+    avvia_stazione(4, 5, 3, grafici=False, orologio=OrologioVirtuale(), checkpoint=gestore)
+    gestore.chiudi()
+
+    assert config_pulita["prob_arrivo"] == 0.9
+    assert config_pulita["metodo_kl"] == "monte_carlo"
+
+
+# FILE
+def test_scrivi_sincronizza_la_cartella(tmp_path, monkeypatch):
+    sincronizzati = []
+    monkeypatch.setattr(checkpoint, "_fsync_cartella", sincronizzati.append)
+    percorso = checkpoint.percorso_checkpoint(str(tmp_path), 7)
+    checkpoint.scrivi(percorso, {"a": np.arange(3)})
+    assert sincronizzati == [str(tmp_path)]
+    assert os.listdir(tmp_path) == [os.path.basename(percorso)]
+
+
+# RIPRESA
+def _corsa(cartella, cicli, **opzioni):
+    gestore = checkpoint.GestoreCheckpoint(str(cartella), ogni=10)
+    stats = avvia_stazione(6, cicli, 11, grafici=False, orologio=OrologioVirtuale(), checkpoint=gestore, **opzioni)
+    gestore.chiudi()
+    return stats, checkpoint.carica(checkpoint.percorso_checkpoint(str(cartella), cicli))
+
+
+@pytest.mark.parametrize("opzioni", [{}, {"eventi": True}, {"flotta": True}, {"lavoratori_decisioni": 2}])
+def test_ripresa_identica_alla_corsa_intera(tmp_path, opzioni):
+    intera, finale = _corsa(tmp_path / "intera", 60, **opzioni)
+    _corsa(tmp_path / "ripresa", 30, **opzioni)
+    ripresa, finale_ripresa = _corsa(tmp_path / "ripresa", 60, **opzioni)
+
+    assert finale.keys() == finale_ripresa.keys()
+    for chiave in finale:
+        if chiave != "meta":
+            assert np.array_equal(finale[chiave], finale_ripresa[chiave], equal_nan=True), chiave
+    meta, meta_ripresa = (json.loads(str(f["meta"])) for f in (finale, finale_ripresa))
+    meta.pop("creato"), meta_ripresa.pop("creato")
+    assert meta == meta_ripresa
+
+    stato, stato_ripresa = intera.esporta_stato(), ripresa.esporta_stato()
+    assert stato.keys() == stato_ripresa.keys()
+    for chiave in stato:
+        assert np.array_equal(stato[chiave], stato_ripresa[chiave], equal_nan=True), chiave
+
+
+# SCRITTURA IN BACKGROUND
+def test_errore_di_scrittura_non_ferma_il_thread(tmp_path, monkeypatch):
+    scrivi = checkpoint.scrivi
+
+    def scrivi_una_volta_male(percorso, dati, comprimi=False):
+        monkeypatch.setattr(checkpoint, "scrivi", scrivi)
+        raise ValueError("serializzazione fallita")
+
+    monkeypatch.setattr(checkpoint, "scrivi", scrivi_una_volta_male)
+    server, rng = crea_stazione(4, 3)
+    gestore = checkpoint.GestoreCheckpoint(str(tmp_path))
+    for ciclo in (1, 2):
+        gestore.salva(ciclo, server, rng, 0)
+        assert gestore.svuota()
+    gestore.chiudi()
+
+    assert gestore.errori == 1
+    assert gestore.scritti == 1 and gestore.ultimo_scritto == 2
@@ -0,0 +1,55 @@
+import json
+
+import pytest
+
+from comandi import RicevitoreComandi
+from metriche import Metriche
+from rifornimento import CONFIG, crea_stazione
+
+
+@pytest.fixture
+def config_pulita():
+    originale = dict(CONFIG)
+    yield CONFIG
+    CONFIG.clear()
+    CONFIG.update(originale)
+
+
+# METRICHE
+def test_applica_alimenta_le_metriche(config_pulita):
+    server, _ = crea_stazione(3, 1)
+    server.metriche = Metriche()
+    ricevitore = RicevitoreComandi()
+    ricevitore.ricevi(json.dumps({"tipo": "config", "chiave": "soglia_temp_alta", "valore": 58}))
+    ricevitore.ricevi(json.dumps({"tipo": "sblocca", "id": 1}))             # non bloccata: fallisce
+    ricevitore.ricevi("{non json")
+
+    assert ricevitore.applica(server) == 2
+    assert server.metriche.latenza_comandi.n == 2
+    assert server.metriche.contatori["comandi_applicati"] == 1
+    assert server.metriche.contatori["comandi_falliti"] == 1
+    assert server.metriche.contatori["comandi_rifiutati"] == 1
+
+    ricevitore.ricevi("[]")
+    ricevitore.applica(server)
+    assert server.metriche.contatori["comandi_rifiutati"] == 2
+    assert server.metriche.latenza_comandi.n == 2
+    assert "rifornimento_comando_latenza_secondi_count" in server.metriche.testo_prometheus()
+    assert ricevitore.metriche()["applicati"] == 1
+
+
+# COLLEGAMENTO MQTT
+def test_collega_si_risottoscrive_senza_perdere_on_connect():
+    from telemetria import BrokerFinto
+
+    broker = BrokerFinto()
+    client = broker.client()
+    chiamate = []
+    client.on_connect = lambda client, *args: chiamate.append(args)
+    ricevitore = RicevitoreComandi()
+    ricevitore.collega(client)
+
+    client.riconnetti()
+    assert len(chiamate) == 1
+    broker.consegna("ev/comandi", json.dumps({"tipo": "sblocca", "id": 2}))
+    assert ricevitore.in_sospeso() == 1
@@ -0,0 +1,77 @@
+import math
+
+import numpy as np
+from scipy.stats import entropy
+
+from rifornimento import CONFIG, AgenteLocale
+
+ORIZZONTE = 3
+CAMPIONI = 50
+
+
+# RUMORE FISSO
+class RumoreFisso:
+    # Al posto del Generator dell'agente: restituisce sempre gli stessi tensori (politiche × orizzonte × campioni)
+    def __init__(self, normali, uniformi):
+        self.normali = normali
+        self.uniformi = uniformi
+
+    def normal(self, loc, scale, size):
+        assert size == self.normali.shape
+        return loc + scale * self.normali
+
+    def random(self, size):
+        assert size == self.uniformi.shape
+        return self.uniformi
+
+
+# CICLO ORIGINALE
+def _kl_gaussiane(mu_p, sigma_p, mu_q, sigma_q):
+    return math.log(sigma_q / sigma_p) + (sigma_p ** 2 + (mu_p - mu_q) ** 2) / (2 * sigma_q ** 2) - 0.5
+
+
+def efe_per_politica(agente, politica, stato_attuale, normali, uniformi):
+    # Il vecchio calcola_efe campione per campione, con il rumore preso dai tensori fissi
+    # e la KL pragmatica in forma chiusa (metodo "analitico")
+    efe = 0.0
+    for t in range(ORIZZONTE):
+        temps, socs = [], []
+        for s in range(CAMPIONI):
+            temp_futura = stato_attuale['temperatura'] + 5 + agente.beliefs['var_temp'] * normali[t, s]
+            if politica['raff_locale']:
+                if uniformi[t, s] < agente.beliefs['p_fail_raff_locale']:
+                    temp_futura += CONFIG['aumento_temp_fail_raff']
+                else:
+                    temp_futura -= 10.0
+            if politica['downgrade']:
+                temp_futura -= 2.0
+            temps.append(temp_futura)
+            socs.append(stato_attuale['soc'] + stato_attuale.get('potenza_effettiva', 0) * (1 - politica['rid_pot']) / 60)
+
+        kl_prag_temp = _kl_gaussiane(np.mean(temps), np.sqrt(np.var(temps)), 40, 5)
+        kl_prag_soc = abs(np.mean(socs) - 100) * 0.1
+        hist, _ = np.histogram(temps, bins=10)
+        efe += kl_prag_temp + kl_prag_soc + entropy(hist / hist.sum())
+    return efe
+
+
+# CONFRONTO
+def test_efe_vettoriale_uguale_al_ciclo_per_politica():
+    gen = np.random.default_rng(2024)
+    agente = AgenteLocale(None, rng=gen)
+    politiche = agente.genera_politiche()
+    forma = (len(politiche), ORIZZONTE, CAMPIONI)
+
+    for prova in range(20):
+        agente.beliefs['p_fail_raff_locale'] = gen.uniform(0.0, 0.6)
+        agente.beliefs['var_temp'] = gen.uniform(1.0, 8.0)
+        stato = {'temperatura': gen.uniform(20, 70), 'soc': gen.uniform(0, 100),
+                 'potenza_effettiva': gen.uniform(0, 150)}
+        normali = gen.standard_normal(forma)
+        uniformi = gen.random(forma)
+
+        agente.rng = RumoreFisso(normali, uniformi)
+        vettoriale = agente.calcola_efe_politiche(politiche, stato, ORIZZONTE, CAMPIONI)
+        attesi = [efe_per_politica(agente, pol, stato, normali[i], uniformi[i]) for i, pol in enumerate(politiche)]
+
+        assert np.allclose(vettoriale, attesi, rtol=1e-9, atol=1e-9), prova
@@ -0,0 +1,19 @@
+from eventi import confronta_modalita
+from rifornimento import CONFIG
+
+# Metriche di stato che le due simulazioni devono riprodurre in media; i conteggi di eventi rari
+# (fallimenti del raffreddamento) su pochi cicli oscillano troppo per un confronto relativo
+STABILI = ("potenza_media", "temp_media", "efe_medio", "soc_medio_finale", "raff_locali")
+
+
+# PASSO FISSO CONTRO EVENTI
+def test_eventi_riproduce_le_metriche_del_passo_fisso():
+    originale = dict(CONFIG)
+    esito = confronta_modalita(40, 60, 42, repliche=2, config={"prob_arrivo": 0.05})
+    assert CONFIG == originale
+
+    fisso, eventi = esito["passo_fisso"], esito["eventi"]
+    assert fisso["metriche"].keys() == eventi["metriche"].keys()
+    assert fisso["tempo_s"] > 0 and eventi["tempo_s"] > 0
+    for k in STABILI:
+        assert abs(eventi["metriche"][k] - fisso["metriche"][k]) <= 0.1 * abs(fisso["metriche"][k]), k
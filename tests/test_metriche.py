@@ -0,0 +1,19 @@
+from metriche import FASI, Metriche
+from rifornimento import esegui_ciclo, crea_stazione, nuove_statistiche
+
+
+# FASI DEL CICLO
+def test_un_valore_per_fase_e_per_ciclo():
+    server, rng = crea_stazione(6, 4)
+    server.metriche = metriche = Metriche()
+    stats = nuove_statistiche()
+    anomalie = 0
+    for ciclo in range(1, 6):
+        anomalie = esegui_ciclo(server, rng, stats, ciclo, anomalie)
+
+    assert metriche.contatori["cicli"] == 5
+    assert metriche.ciclo.n == 5
+    # "comandi" si apre solo con un RicevitoreComandi; "allocazione" si apre due volte per ciclo
+    assert {f: metriche.fasi[f].n for f in FASI} == {f: 0 if f == "comandi" else 5 for f in FASI}
+    # Le fasi stanno dentro il ciclo: la loro somma non può superarne la durata
+    assert sum(h.somma for h in metriche.fasi.values()) <= metriche.ciclo.somma
@@ -0,0 +1,26 @@
+import pytest
+
+from scenari import _leggi_griglia
+
+
+# GRIGLIA DA RIGA DI COMANDO
+def test_griglia_tipi_di_config():
+    griglia = _leggi_griglia(["soglia_temp_alta=50,55.0", "percentuale_riduzione_temp_alta=0.2,0.4",
+                              "modalita=Eco,Boost"])
+    assert griglia == {"soglia_temp_alta": [50, 55], "percentuale_riduzione_temp_alta": [0.2, 0.4],
+                       "modalita": ["Eco", "Boost"]}
+    assert all(type(v) is int for v in griglia["soglia_temp_alta"])
+
+
+@pytest.mark.parametrize("voce, messaggio", [
+    ("soglia_temp_alta", "senza '='"),
+    ("sconosciuto=1", "sconosciuto"),
+    ("soglia_temp_alta=50,,60", "vuoto"),
+    ("soglia_temp_alta=", "vuoto"),
+    ("soglia_temp_alta=55.5", "non intero"),
+    ("soglia_temp_alta=alta", "non numerico"),
+    ("percentuale_riduzione_temp_alta=nan", "non finito"),
+])
+def test_griglia_voci_non_valide(voce, messaggio):
+    with pytest.raises(SystemExit, match=messaggio):
+        _leggi_griglia([voce])
@@ -0,0 +1,34 @@
+import json
+
+import numpy as np
+import pytest
+
+from sensori import GRANDEZZE, LettureEsaurite, SorgenteMQTT, SorgenteReplay, SorgenteSintetica
+from telemetria import BrokerFinto
+
+
+# SORGENTE MQTT
+def test_sorgente_mqtt_si_risottoscrive_alla_riconnessione():
+    broker = BrokerFinto()
+    client = broker.client()
+    sorgente = SorgenteMQTT(SorgenteSintetica(np.random.default_rng(0)))
+    sorgente.collega(client)
+
+    client.riconnetti()
+    broker.consegna("ev/sensori", json.dumps({"id": 2, "temperatura": 61.5}))
+    letture = sorgente.campiona([1, 2])
+    assert sorgente.ricevuti == 1
+    assert letture["temperatura"][1] == 61.5
+
+
+# REPLAY
+def test_replay_esaurito_solleva_letture_esaurite():
+    dati = {"id": np.array([1, 2]), **{g: np.arange(6.0).reshape(3, 2) for g in GRANDEZZE}}
+    sorgente = SorgenteReplay(dati)
+    for tick in range(3):
+        assert sorgente.campiona([2, 1])["temperatura"].tolist() == [2 * tick + 1, 2 * tick]
+    with pytest.raises(LettureEsaurite):
+        sorgente.campiona([1, 2])
+
+    ciclica = SorgenteReplay(dati, ciclico=True)
+    assert [ciclica.campiona([1])["degrado"][0] for _ in range(4)] == [0.0, 2.0, 4.0, 0.0]
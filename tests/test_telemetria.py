@@ -0,0 +1,26 @@
+import pytest
+
+from metriche import Metriche
+from rifornimento import avvia_headless
+from telemetria import BrokerFinto, PubblicatoreTelemetria, verifica_delta
+
+
+# PUBBLICATORE
+def test_batch_di_ciclo_e_metriche_contati_a_parte():
+    broker = BrokerFinto()
+    pubblicatore = PubblicatoreTelemetria(broker.client(), capacita=1000)
+    avvia_headless(4, 12, 2, pubblicatore=pubblicatore, metriche=Metriche())
+    pubblicatore.chiudi()
+
+    statistiche = pubblicatore.statistiche()
+    assert statistiche["inviati"] == 12
+    assert statistiche["inviati_metriche"] == 12
+    assert len(broker.su_topic("ev/metriche")) == 12
+
+
+# DELTA
+@pytest.mark.parametrize("opzioni", [{}, {"eventi": True}, {"flotta": True}])
+def test_delta_ricostruisce_lo_stato_completo(opzioni):
+    esito = verifica_delta(20, 40, 3, ogni_keyframe=7, **opzioni)
+    assert esito["differenze"] == []
+    assert esito["cicli"] == 40 and esito["keyframe"] == 6
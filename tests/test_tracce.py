@@ -0,0 +1,22 @@
+import pytest
+
+from rifornimento import avvia_headless
+from tracce import RegistratoreTraccia, Traccia, confronta
+
+
+# REGISTRAZIONE E REPLAY
+@pytest.mark.parametrize("flotta", [False, True])
+def test_replay_riproduce_le_potenze_registrate(tmp_path, flotta):
+    # Blocchi da 50 righe con 8 colonnine: molti cicli stanno a cavallo di due blocchi
+    with RegistratoreTraccia(str(tmp_path), righe_per_blocco=50) as registratore:
+        avvia_headless(8, 30, 5, registratore=registratore, flotta=flotta)
+    traccia = Traccia(str(tmp_path))
+    assert len(traccia) == 8 * 30
+
+    esito = confronta(traccia, seed=5)
+    assert esito["cicli"] == 30 and esito["righe"] == 8 * 30
+    assert esito["righe_diverse"] == 0
+    assert esito["scarto_max_kw"] < 1e-3
+
+    ricalcolato = confronta(traccia, ricalcola_decisioni=True, seed=5)
+    assert ricalcolato["cicli"] == 30 and ricalcolato["righe"] == 8 * 30
@@ -0,0 +1,290 @@
+import json
+import os
+import time
+
+import numpy as np
+
+from rifornimento import MODALITA, NOMI_VEICOLI, STATI, AgenteLocale, Server, aggiorna_info_globali
+
+# TRACCE COLONNARI
+# Una traccia è una cartella: meta.json + un blocco per cartella, un file .npy per colonna.
+# I blocchi si aprono in memory-map, quindi tracce da diversi GB si scorrono senza caricarle.
+# Ogni riga è una colonnina in un ciclo: letture in ingresso, decisione dell'agente, allocazione.
+
+SCHEMA = {
+    "ciclo": "i4",
+    "id": "i4",
+    "stato": "i1",                      # stato in ingresso al ciclo (codice in STATI)
+    "veicolo": "i1",                    # indice in NOMI_VEICOLI, -1 se nessuno
+    "modalita": "i1",
+    "soc": "f4",
+    "temperatura": "f4",
+    "temperatura_esterna": "f4",
+    "temperatura_predetta": "f4",
+    "temperatura_reale_grezzo": "f4",
+    "anomalia": "?",
+    "degrado": "f4",
+    "tensione": "f4",
+    "potenza_richiesta": "f4",
+    "raffreddamento_attivo": "?",
+    "fail_raff_consecutivi": "i2",
+    # decisione dell'agente (NaN / -1 se la colonnina non era occupata)
+    "politica": "i1",
+    "min_efe": "f4",
+    "rid_pot_richiesta": "f4",
+    "raff_locale_richiesto": "?",
+    "downgrade_richiesto": "?",
+    "voto_centrale": "f4",
+    # esito del ciclo
+    "raff_locale_approvato": "?",
+    "raff_fallito": "?",
+    "bloccata": "?",
+    "modalita_effettiva": "i1",
+    "potenza_effettiva": "f4",
+}
+
+
+def _codice(valori, valore):
+    return valori.index(valore) if valore in valori else -1
+
+
+def _riga(ciclo, p, col):
+    decisione = p.get("agente")
+    stato_uscita = p.get("stato")
+    # distribuisci_potenza aggiorna lo stato solo se la colonnina si blocca durante il ciclo
+    stato_ingresso = "OCCUPATA" if decisione is not None else stato_uscita
+    riga = {
+        "ciclo": ciclo,
+        "id": p["id"],
+        "stato": _codice(STATI, stato_ingresso),
+        "veicolo": _codice(NOMI_VEICOLI, p.get("veicolo")),
+        "modalita": _codice(MODALITA, p.get("modalita")),
+        "modalita_effettiva": _codice(MODALITA, p.get("modalita_effettiva", p.get("modalita"))),
+        "raff_locale_approvato": p.get("raffreddamento_locale_attivo", False),
+        "raff_fallito": bool(col is not None and decisione is not None and col.stato_raff_fallito),
+        "bloccata": decisione is not None and str(stato_uscita).startswith("BLOCCATA"),
+        "potenza_effettiva": p.get("potenza_effettiva", 0.0),
+    }
+    for campo in ("soc", "temperatura", "temperatura_esterna", "temperatura_predetta", "temperatura_reale_grezzo",
+                  "anomalia", "degrado", "tensione", "potenza_richiesta", "raffreddamento_attivo",
+                  "fail_raff_consecutivi"):
+        riga[campo] = p.get(campo, 0)
+    if decisione is not None:
+        riga.update({
+            "politica": decisione.get("politica", -1),
+            "min_efe": decisione.get("min_efe", np.nan),
+            "rid_pot_richiesta": decisione.get("rid_pot_richiesta", 0.0),
+            "raff_locale_richiesto": decisione.get("raffreddamento_locale_richiesto", False),
+            "downgrade_richiesto": decisione.get("downgrade_modalita_richiesto", False),
+            "voto_centrale": decisione.get("voto_raffreddamento_centrale", 0.0),
+        })
+    else:
+        riga.update({"politica": -1, "min_efe": np.nan, "rid_pot_richiesta": 0.0, "raff_locale_richiesto": False,
+                     "downgrade_richiesto": False, "voto_centrale": 0.0})
+    return riga
+
+
+# REGISTRAZIONE
+class RegistratoreTraccia:
+    def __init__(self, percorso, righe_per_blocco=1 << 16):
+        self.percorso = percorso
+        self.righe_per_blocco = righe_per_blocco
+        os.makedirs(percorso, exist_ok=True)
+        self.blocchi = []
+        self._buffer = {nome: np.empty(righe_per_blocco, dtype=tipo) for nome, tipo in SCHEMA.items()}
+        self._righe = 0
+        self._scrivi_meta()
+
+    def registra_ciclo(self, ciclo, parametri_con_potenza, server=None):
+        for p in parametri_con_potenza:
+            col = server.registro.get(p["id"]) if server is not None else None
+            riga = _riga(ciclo, p, col)
+            k = self._righe
+            for nome, colonna in self._buffer.items():
+                colonna[k] = riga[nome]
+            self._righe += 1
+            if self._righe == self.righe_per_blocco:
+                self._svuota()
+
+    def _svuota(self):
+        if not self._righe:
+            return
+        nome_blocco = f"blocco_{len(self.blocchi):06d}"
+        cartella = os.path.join(self.percorso, nome_blocco)
+        os.makedirs(cartella, exist_ok=True)
+        for nome, colonna in self._buffer.items():
+            np.save(os.path.join(cartella, f"{nome}.npy"), colonna[:self._righe])
+        self.blocchi.append({"nome": nome_blocco, "righe": self._righe})
+        self._righe = 0
+        self._scrivi_meta()
+
+    def _scrivi_meta(self):
+        meta = {"versione": 1, "schema": SCHEMA, "blocchi": self.blocchi}
+        temporaneo = os.path.join(self.percorso, "meta.json.tmp")
+        with open(temporaneo, "w") as f:
+            json.dump(meta, f, indent=1)
+        os.replace(temporaneo, os.path.join(self.percorso, "meta.json"))
+
+    def chiudi(self):
+        self._svuota()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.chiudi()
+
+
+# LETTURA
+class Traccia:
+    def __init__(self, percorso):
+        self.percorso = percorso
+        with open(os.path.join(percorso, "meta.json")) as f:
+            meta = json.load(f)
+        self.schema = meta["schema"]
+        self.blocchi = meta["blocchi"]
+
+    def __len__(self):
+        return sum(b["righe"] for b in self.blocchi)
+
+    def blocco(self, i, colonne=None):
+        cartella = os.path.join(self.percorso, self.blocchi[i]["nome"])
+        return {nome: np.load(os.path.join(cartella, f"{nome}.npy"), mmap_mode="r")
+                for nome in (colonne or self.schema)}
+
+    def scorri(self, colonne=None):
+        for i in range(len(self.blocchi)):
+            yield self.blocco(i, colonne)
+
+    def cicli(self, colonne=None):
+        # Raggruppa le righe per ciclo anche quando un ciclo è a cavallo di due blocchi
+        colonne = list(colonne or self.schema)
+        if "ciclo" not in colonne:
+            colonne.append("ciclo")
+        resto = None
+        for blocco in self.scorri(colonne):
+            if resto is not None:
+                blocco = {k: np.concatenate([resto[k], blocco[k]]) for k in colonne}
+            cicli = blocco["ciclo"]
+            tagli = np.flatnonzero(np.diff(cicli)) + 1
+            inizi = np.concatenate([[0], tagli])
+            fini = np.concatenate([tagli, [len(cicli)]])
+            for a, b in zip(inizi[:-1], fini[:-1]):
+                yield int(cicli[a]), {k: v[a:b] for k, v in blocco.items()}
+            a = inizi[-1] if len(cicli) else 0
+            resto = {k: np.asarray(v[a:]) for k, v in blocco.items()}
+        if resto is not None and len(resto["ciclo"]):
+            yield int(resto["ciclo"][0]), resto
+
+
+# RIPRODUZIONE
+class ColonninaRegistrata:
+    # Sostituto di Colonnina per il replay: stato preso dalla traccia, esito del raffreddamento registrato
+    def __init__(self, id_colonnina, rng):
+        self.id = id_colonnina
+        self.rng = rng
+        self.registro = None
+        self.versione_stato = 0
+        self.stato = "LIBERA"
+        self.modalita = "Standard"
+        self.stato_raff_fallito = False
+        self.esito = (False, False)
+        self.agente = AgenteLocale(self, rng=rng)
+
+    def imposta_stato(self, nuovo):
+        if self.registro is not None and nuovo != self.stato:
+            self.registro.cambio_stato(self, self.stato, nuovo)
+        self.stato = nuovo
+
+    def applica_raffreddamento(self, centrale_attivo, locale_attivo):
+        fallito, bloccata = self.esito
+        if not (centrale_attivo or locale_attivo):
+            return False
+        self.stato_raff_fallito = fallito
+        self.agente.aggiorna_beliefs(fallito, "centrale" if centrale_attivo else "locale")
+        if bloccata:
+            self.imposta_stato("BLOCCATA_RAFF_FALLITO")
+        return bloccata
+
+
+def _parametri(righe, k):
+    stato = STATI[righe["stato"][k]]
+    v = righe["veicolo"][k]
+    p = {
+        "id": int(righe["id"][k]),
+        "stato": stato,
+        "veicolo": NOMI_VEICOLI[v] if v >= 0 else None,
+        "modalita": MODALITA[righe["modalita"][k]],
+        "anomalia": bool(righe["anomalia"][k]),
+        "raffreddamento_attivo": bool(righe["raffreddamento_attivo"][k]),
+        "fail_raff_consecutivi": int(righe["fail_raff_consecutivi"][k]),
+    }
+    for campo in ("soc", "temperatura", "temperatura_esterna", "temperatura_predetta", "temperatura_reale_grezzo",
+                  "degrado", "tensione", "potenza_richiesta"):
+        p[campo] = round(float(righe[campo][k]), 1)
+    return p
+
+
+def _decisione(righe, k):
+    return {
+        "raffreddamento_locale_richiesto": bool(righe["raff_locale_richiesto"][k]),
+        "voto_raffreddamento_centrale": float(righe["voto_centrale"][k]),
+        "downgrade_modalita_richiesto": bool(righe["downgrade_richiesto"][k]),
+        "rid_pot_richiesta": round(float(righe["rid_pot_richiesta"][k]), 2),
+        "motivazione_agente": "replay",
+        "temp": round(float(righe["temperatura"][k]), 1),
+        "anomalia": bool(righe["anomalia"][k]),
+        "min_efe": float(righe["min_efe"][k]),
+        "politica": int(righe["politica"][k]),
+    }
+
+
+def riproduci(traccia, ricalcola_decisioni=False, seed=0):
+    # Rimette le letture registrate in Server.distribuisci_potenza, senza orologio né sensori.
+    # Con ricalcola_decisioni=False si usano le decisioni registrate (regressione dell'allocatore),
+    # altrimenti gli agenti decidono di nuovo sugli stessi ingressi (regressione degli agenti).
+    traccia = traccia if isinstance(traccia, Traccia) else Traccia(traccia)
+    semi = np.random.SeedSequence(seed)
+    server = Server()
+    colonnine = {}
+    for ciclo, righe in traccia.cicli():
+        server.cache.nuovo_ciclo(ciclo)
+        parametri_lista = []
+        for k in range(len(righe["id"])):
+            p = _parametri(righe, k)
+            col = colonnine.get(p["id"])
+            if col is None:
+                col = colonnine[p["id"]] = ColonninaRegistrata(p["id"], np.random.default_rng(semi.spawn(1)[0]))
+                server.registro.registra(col)
+            col.imposta_stato(p["stato"])
+            col.modalita = p["modalita"]
+            col.esito = (bool(righe["raff_fallito"][k]), bool(righe["bloccata"][k]))
+            if p["stato"] == "OCCUPATA" and not ricalcola_decisioni:
+                server.cache.registra_decisione(col, _decisione(righe, k))
+            parametri_lista.append(p)
+        aggiorna_info_globali(server, parametri_lista)
+        yield ciclo, righe, server.distribuisci_potenza(parametri_lista)
+
+
+def confronta(traccia, ricalcola_decisioni=False, seed=0):
+    # Esegue il replay e confronta le potenze allocate con quelle registrate
+    inizio = time.perf_counter()
+    cicli = righe_totali = diverse = 0
+    scarto_max = 0.0
+    for _, righe, out in riproduci(traccia, ricalcola_decisioni, seed):
+        registrate = np.asarray(righe["potenza_effettiva"], dtype=float)
+        ottenute = np.array([p.get("potenza_effettiva", 0.0) for p in out], dtype=float)
+        scarti = np.abs(ottenute - registrate)
+        scarto_max = max(scarto_max, float(scarti.max(initial=0.0)))
+        diverse += int((scarti > 0.05).sum())
+        righe_totali += len(registrate)
+        cicli += 1
+    durata = time.perf_counter() - inizio
+    return {
+        "cicli": cicli,
+        "righe": righe_totali,
+        "righe_diverse": diverse,
+        "scarto_max_kw": scarto_max,
+        "durata_s": durata,
+        "cicli_al_secondo": cicli / durata if durata > 0 else float("inf"),
+    }